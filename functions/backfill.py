@@ -0,0 +1,223 @@
+"""Reprocess existing videos with the pipeline's own conversion, transcription and info-card code.
+
+Pages through the videos collection in document ID order and runs the
+requested stages for each video on a worker pool:
+
+    python backfill.py                                   # every stage, skipping current output
+    python backfill.py --stages convert --force convert  # after changing encoding settings
+    python backfill.py --stages info_card --force info_card --per-minute 120   # after a prompt change
+    python backfill.py --restart --limit 500 --workers 8
+
+Each stage goes through the same leases as the deployed functions, so a
+backfill never duplicates work a live request is already doing. Output
+that is already current is skipped without doing the work:
+- audio for the current source generation
+- a transcript of the current audio
+- an info card from the current PROMPT_VERSION
+--force lists the stages to redo anyway.
+
+Progress is checkpointed to --state after every page. A run that is
+interrupted continues after the last completed page; --restart starts
+over. Throughput and an ETA are printed as pages complete.
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import main as pipeline
+from services.clients import get_db, get_openai
+from services.converter import AUDIO_PROFILES, EXTRACTION_MODES, get_extraction_mode
+from services.info_cards import CARD_COLLECTION, PROMPT_VERSION, RateLimiter, generate_info_cards
+from services.jobs import STAGES
+from services.tracing import trace
+
+# Outcomes of one stage for one video
+DONE = 'done'
+SKIPPED = 'skipped'
+FAILED = 'failed'
+NO_AUDIO = 'no_audio'
+
+
+def iter_video_pages(db, after, page_size):
+    """Yield pages of video snapshots in document ID order, starting after the ID after."""
+    query = db.collection('videos').order_by('__name__')
+    last = db.collection('videos').document(after).get() if after else None
+    while True:
+        page_query = query.limit(page_size)
+        if last is not None:
+            page_query = page_query.start_after(last)
+        page = list(page_query.stream())
+        if not page:
+            return
+        yield page
+        last = page[-1]
+
+
+def count_videos(db):
+    """Number of video documents, or None where count aggregation is unavailable."""
+    try:
+        return int(db.collection('videos').count().get()[0][0].value)
+    except Exception as e:
+        print(f"Could not count videos, no ETA will be shown: {str(e)}")
+        return None
+
+
+def load_state(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_state(path, state):
+    """Write the checkpoint atomically, so an interrupted write leaves the previous one."""
+    staged = f'{path}.tmp'
+    with open(staged, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(staged, path)
+
+
+def info_card_current(db, video_id):
+    doc = db.collection(CARD_COLLECTION).document(video_id).get()
+    return doc.exists and doc.to_dict().get('promptVersion') == PROMPT_VERSION
+
+
+def run_stage(db, video_id, stage, args):
+    """Run one stage for a video; returns DONE or SKIPPED, raising on failure."""
+    force = stage in args.force
+    if stage == 'convert':
+        result = pipeline.run_deduplicated('convert', video_id, lambda: pipeline.convert_video(
+            video_id, args.mode, profile=args.profile, previews=args.previews, force=force
+        ))
+        return SKIPPED if result.get('skipped_conversion') and 'previews' not in result else DONE
+    if stage == 'transcribe':
+        result = pipeline.run_deduplicated('transcribe', video_id, lambda: pipeline.transcribe_video(
+            video_id, force=force
+        ))
+        return SKIPPED if result.get('skipped_transcription') and not result.get('cache_hit') else DONE
+    if stage == 'info_card':
+        if not force and info_card_current(db, video_id):
+            return SKIPPED
+        results, _ = generate_info_cards(db, get_openai(), [{'videoId': video_id, 'transcript': None}], force=force)
+        if 'error' in results[0]:
+            raise Exception(results[0]['error'])
+        return SKIPPED if results[0]['cached'] else DONE
+    raise ValueError(f"Unknown stage: {stage}")
+
+
+def process_video(db, video_id, args, limiter):
+    """Run the requested stages in pipeline order; a failed stage ends the video's run.
+
+    Returns {stage: outcome} and the error message of a failure, if any.
+    """
+    limiter.acquire()
+    outcomes = {}
+    with trace('backfill', video_id=video_id, stages=','.join(args.stages)):
+        for stage in args.stages:
+            try:
+                outcomes[stage] = run_stage(db, video_id, stage, args)
+            except pipeline.NoAudioError:
+                # Nothing to transcribe or summarize either
+                outcomes[stage] = NO_AUDIO
+                return outcomes, None
+            except Exception as e:
+                outcomes[stage] = FAILED
+                return outcomes, f"{stage}: {type(e).__name__}: {str(e)}"
+    return outcomes, None
+
+
+class Progress:
+    """Outcome counts, throughput and ETA of a run."""
+
+    def __init__(self, total, already_processed):
+        self.total = total
+        self.already_processed = already_processed
+        self.processed = 0
+        self.counts = Counter()
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def record(self, outcomes):
+        with self._lock:
+            self.processed += 1
+            self.counts.update(f'{stage}:{outcome}' for stage, outcome in outcomes.items())
+
+    def report(self):
+        elapsed = time.monotonic() - self.started
+        rate = self.processed / elapsed if elapsed else 0.0
+        line = f"  {self.processed} videos in {elapsed:.0f}s ({rate * 60:.1f}/min)"
+        if self.total and rate:
+            done = self.already_processed + self.processed
+            line += f", {done}/{self.total} done, ETA {max(self.total - done, 0) / rate / 60:.1f} min"
+        print(line)
+
+    def summary(self):
+        return ', '.join(f'{key} {count}' for key, count in sorted(self.counts.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reprocess existing videos through the pipeline stages')
+    parser.add_argument('--stages', nargs='+', default=list(STAGES), choices=STAGES,
+                        help='Stages to run, always in pipeline order')
+    parser.add_argument('--force', nargs='*', default=[], choices=STAGES,
+                        help='Stages to redo even when their output is current')
+    parser.add_argument('--workers', type=int, default=4, help='Videos processed concurrently')
+    parser.add_argument('--per-minute', type=int, default=0, help='Cap on videos started per minute (0: none)')
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--limit', type=int, default=0, help='Stop after this many videos (0: all)')
+    parser.add_argument('--mode', default=None, choices=EXTRACTION_MODES,
+                        help='Extraction mode (default: AUDIO_EXTRACTION_MODE or single_pass)')
+    parser.add_argument('--profile', default=os.getenv('PIPELINE_AUDIO_PROFILE', 'transcription'),
+                        choices=list(AUDIO_PROFILES), help='Audio profile to convert to')
+    parser.add_argument('--previews', action='store_true', help='Also produce thumbnails, keyframes and sprites')
+    parser.add_argument('--state', default='backfill_state.json', help='Checkpoint file')
+    parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and start from the beginning')
+    args = parser.parse_args()
+    args.stages = [stage for stage in STAGES if stage in args.stages]
+    args.mode = get_extraction_mode(args.mode)
+
+    db = get_db()
+    state = None if args.restart else load_state(args.state)
+    if state and state.get('stages') != args.stages:
+        print(f"Checkpoint in {args.state} is for stages {state.get('stages')}, starting over")
+        state = None
+    state = state or {'stages': args.stages, 'lastVideoId': None, 'processed': 0, 'failed': {}}
+    print(f"Backfilling {', '.join(args.stages)} with {args.workers} workers"
+          + (f", resuming after video {state['lastVideoId']}" if state['lastVideoId'] else ''))
+
+    progress = Progress(count_videos(db), state['processed'])
+    limiter = RateLimiter(args.per_minute)
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        for page in iter_video_pages(db, state['lastVideoId'], args.page_size):
+            if args.limit:
+                page = page[:args.limit - progress.processed]
+            video_ids = [snapshot.id for snapshot in page]
+            for video_id, (outcomes, error) in zip(
+                    video_ids, pool.map(lambda video_id: process_video(db, video_id, args, limiter), video_ids)):
+                progress.record(outcomes)
+                if error:
+                    print(f"Video {video_id} failed at {error}")
+                    state['failed'][video_id] = error
+                else:
+                    state['failed'].pop(video_id, None)
+
+            # Only whole pages are checkpointed, so a resumed run never skips a video
+            state['lastVideoId'] = video_ids[-1]
+            state['processed'] += len(video_ids)
+            save_state(args.state, state)
+            progress.report()
+            if args.limit and progress.processed >= args.limit:
+                break
+
+    print(f"Backfill finished: {progress.processed} videos; {progress.summary() or 'nothing to do'}")
+    if state['failed']:
+        print(f"{len(state['failed'])} videos failed, listed in {args.state}")
+
+
+if __name__ == '__main__':
+    main()
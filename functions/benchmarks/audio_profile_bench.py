@@ -0,0 +1,105 @@
+"""Encode speed and output size of each audio profile.
+
+Run from the functions directory (needs ffmpeg and ffmpeg-python):
+
+    python benchmarks/audio_profile_bench.py --seconds 600
+    python benchmarks/audio_profile_bench.py --input talk.mp4 --profiles default transcription
+
+Each profile is encoded from the same source with extract_audio_single_pass,
+as convert_video does in single_pass mode. Without --input a clip is
+generated whose audio is a tone that pauses for --pause seconds every
+--every seconds. Reported per profile: silence detection and encode wall
+time, encode speed as a multiple of real time, CPU time including ffmpeg,
+output size and the share of the source duration kept after trimming.
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.converter import AUDIO_PROFILES, extract_audio_single_pass, get_audio_codec, get_video_duration  # noqa: E402
+from services.silence import TRIM_MIN_SILENCE_SECONDS, TRIM_NOISE, TimeMap, detect_silences  # noqa: E402
+
+
+def make_clip(path, seconds, every, pause):
+    """Small test pattern video whose audio pauses regularly."""
+    subprocess.run(
+        ['ffmpeg', '-hide_banner', '-loglevel', 'error',
+         '-f', 'lavfi', '-i', f'testsrc=size=320x240:rate=15:duration={seconds}',
+         '-f', 'lavfi', '-i', f'aevalsrc=0.3*sin(2*PI*440*t)*lt(mod(t\\,{every})\\,{every - pause}):s=44100:d={seconds}',
+         '-shortest', '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p',
+         '-c:a', 'aac', '-b:a', '128k', '-y', path],
+        check=True
+    )
+
+
+def cpu_seconds():
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def bench_profile(source, source_codec, duration, profile, out_dir):
+    settings = AUDIO_PROFILES[profile]
+    time_map = None
+    detect_seconds = 0.0
+    if settings['trim_silence']:
+        started = time.perf_counter()
+        time_map = TimeMap.plan(detect_silences(source, TRIM_NOISE, TRIM_MIN_SILENCE_SECONDS), duration)
+        detect_seconds = time.perf_counter() - started
+
+    output = os.path.join(out_dir, f"{profile}.{settings['extension']}")
+    cpu_before = cpu_seconds()
+    started = time.perf_counter()
+    extract_audio_single_pass(source, output, source_codec, profile=profile, time_map=time_map)
+    encode_seconds = time.perf_counter() - started
+    return {
+        'profile': profile,
+        'detect_s': detect_seconds,
+        'encode_s': encode_seconds,
+        'speed': duration / encode_seconds,
+        'cpu_s': cpu_seconds() - cpu_before,
+        'bytes': os.path.getsize(output),
+        'kept': time_map.trimmed_ms / 1000 / duration if time_map else 1.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--input', help='Video to encode (default: generate one)')
+    parser.add_argument('--seconds', type=int, default=300, help='Length of the generated clip')
+    parser.add_argument('--every', type=int, default=12, help='Generated audio pauses once per this many seconds')
+    parser.add_argument('--pause', type=int, default=3, help='Length of each generated pause')
+    parser.add_argument('--profiles', nargs='+', default=list(AUDIO_PROFILES), choices=list(AUDIO_PROFILES))
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='audio_profile_bench_')
+    try:
+        source = args.input
+        if not source:
+            source = os.path.join(work_dir, 'source.mp4')
+            make_clip(source, args.seconds, args.every, args.pause)
+        duration = get_video_duration(source)
+        source_codec = get_audio_codec(source)
+        print(f"Source: {duration:.0f}s, audio codec {source_codec}\n")
+
+        rows = [bench_profile(source, source_codec, duration, profile, work_dir) for profile in args.profiles]
+        baseline = next((row['bytes'] for row in rows if row['profile'] == 'default'), None)
+        print(f"{'profile':<15}{'detect':>9}{'encode':>9}{'speed':>9}{'cpu':>9}{'size':>11}{'kbit/s':>9}{'kept':>7}"
+              f"{'vs default':>12}")
+        for row in rows:
+            print(f"{row['profile']:<15}{row['detect_s']:>8.2f}s{row['encode_s']:>8.2f}s{row['speed']:>8.0f}x"
+                  f"{row['cpu_s']:>8.2f}s{row['bytes'] / 1024 / 1024:>9.2f}MB"
+                  f"{row['bytes'] * 8 / 1000 / duration:>9.1f}{row['kept']:>7.0%}"
+                  + (f"{row['bytes'] / baseline:>12.0%}" if baseline else ''))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""Benchmark the sharded BM25 transcript index on a synthetic corpus.
+
+Run from the functions directory:
+
+    python benchmarks/fulltext_bench.py --docs 20000 --queries 500
+
+Builds an index of --docs transcripts (Zipf-distributed vocabulary, one
+segment every few seconds), then reports build throughput, on-disk size,
+cold-open time, query latency percentiles, the cost of an incremental
+update and the effect of compaction.
+"""
+
+import argparse
+import itertools
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.fulltext import FulltextIndex  # noqa: E402
+
+
+def make_vocabulary(size, rng):
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(letters) for _ in range(rng.randint(3, 10))))
+    return sorted(words)
+
+
+def make_corpus(count, vocabulary, rng, start_id=0):
+    """[(video_id, [(start_ms, text)])] with Zipf-like word frequencies."""
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(vocabulary))))
+    docs = []
+    for number in range(start_id, start_id + count):
+        segments = []
+        start_ms = 0
+        for _ in range(rng.randint(20, 120)):
+            words = rng.choices(vocabulary, cum_weights=cum_weights, k=rng.randint(6, 14))
+            segments.append((start_ms, ' '.join(words)))
+            start_ms += rng.randint(2000, 6000)
+        docs.append((f'video{number:07d}', segments))
+    return docs
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def directory_size(root):
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(root) for f in files)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--docs', type=int, default=20000)
+    parser.add_argument('--vocabulary', type=int, default=30000)
+    parser.add_argument('--shards', type=int, default=16)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    vocabulary = make_vocabulary(args.vocabulary, rng)
+    root = tempfile.mkdtemp(prefix='fulltext_bench_')
+    try:
+        started = time.perf_counter()
+        corpus = make_corpus(args.docs, vocabulary, rng)
+        print(f"Generated {len(corpus)} transcripts in {time.perf_counter() - started:.1f}s")
+
+        index = FulltextIndex.create(root, args.shards)
+        started = time.perf_counter()
+        for offset in range(0, len(corpus), args.batch_size):
+            index.add(corpus[offset:offset + args.batch_size])
+        build_seconds = time.perf_counter() - started
+        del corpus
+        print(f"Build:    {args.docs / build_seconds:,.0f} transcripts/s ({build_seconds:.1f}s), "
+              f"{directory_size(root) / 1024 / 1024:.1f} MB on disk")
+
+        index.close()
+        started = time.perf_counter()
+        index = FulltextIndex(root)
+        print(f"Open:     {(time.perf_counter() - started) * 1000:.1f} ms")
+
+        def run_queries(label):
+            latencies = []
+            for _ in range(args.queries):
+                # Mix of common and rare words, 1-3 terms per query
+                query = ' '.join(rng.choice(vocabulary[:2000] if rng.random() < 0.5 else vocabulary)
+                                 for _ in range(rng.randint(1, 3)))
+                started = time.perf_counter()
+                index.search(query, limit=10)
+                latencies.append((time.perf_counter() - started) * 1000)
+            print(f"{label} p50 {statistics.median(latencies):.2f} ms, p95 {percentile(latencies, 0.95):.2f} ms, "
+                  f"p99 {percentile(latencies, 0.99):.2f} ms")
+
+        run_queries('Query:   ')
+
+        started = time.perf_counter()
+        index.add(make_corpus(100, vocabulary, rng, start_id=args.docs))
+        print(f"Update:   100 new transcripts in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+        started = time.perf_counter()
+        merged = index.compact()
+        print(f"Compact:  {merged} shards in {time.perf_counter() - started:.1f}s, "
+              f"{directory_size(root) / 1024 / 1024:.1f} MB on disk")
+        run_queries('Query:   ')
+        index.close()
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Measure module import cost of main.py and of each entry point's lazy imports.
+
+Run from the functions directory:
+
+    python benchmarks/import_time.py [--top 15]
+
+Every measurement runs in a fresh interpreter so nothing is already cached
+in sys.modules. The first table is the `python -X importtime` breakdown of
+`import main` (what every cold start pays), the second is the extra import
+time each endpoint pays on its first request.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+FUNCTIONS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules each entry point imports lazily on first use
+ENTRY_POINT_IMPORTS = {
+    'test': [],
+    'generate_info_card': ['openai'],
+    'create_transcript': ['firebase_admin.firestore', 'firebase_admin.storage', 'openai', 'services.cache'],
+    'convert_to_audio': ['ffmpeg', 'firebase_admin.firestore', 'firebase_admin.storage',
+                         'services.cache', 'services.converter', 'services.storage'],
+}
+
+
+def run_importtime(statement):
+    """Return [(cumulative_us, depth, module)] for statement in a fresh interpreter."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', statement],
+        cwd=FUNCTIONS_DIR, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise SystemExit(f"Import failed:\n{result.stderr[-2000:]}")
+
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative_us, module = line[len('import time:'):].split('|')
+        module = module[1:].rstrip()
+        depth = (len(module) - len(module.lstrip())) // 2
+        rows.append((int(cumulative_us), depth, module.strip()))
+    return rows
+
+
+def timed_import(statement):
+    """Total microseconds spent importing statement after `import main`."""
+    code = (
+        "import time, main\n"
+        "start = time.perf_counter()\n"
+        f"{statement}\n"
+        "print(int((time.perf_counter() - start) * 1e6))"
+    )
+    result = subprocess.run([sys.executable, '-c', code], cwd=FUNCTIONS_DIR, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise SystemExit(f"Import failed:\n{result.stderr[-2000:]}")
+    return int(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--top', type=int, default=15, help='Number of top-level packages to list')
+    args = parser.parse_args()
+
+    rows = run_importtime('import main')
+    main_total = next(cumulative for cumulative, _, module in rows if module == 'main')
+    top_level = sorted(
+        (row for row in rows if row[1] == 1 and row[2] != 'main'),
+        reverse=True
+    )
+    print(f"import main: {main_total / 1000:.1f} ms")
+    for cumulative, _, module in top_level[:args.top]:
+        print(f"  {cumulative / 1000:8.1f} ms  {module}")
+
+    print("\nFirst-request import cost per entry point:")
+    for entry_point, modules in ENTRY_POINT_IMPORTS.items():
+        statement = '; '.join(f'import {module}' for module in modules) or 'pass'
+        print(f"  {timed_import(statement) / 1000:8.1f} ms  {entry_point}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,354 @@
+"""End-to-end benchmark of audio conversion, transcription and VTT parsing.
+
+Run from the functions directory (needs requirements.txt installed and
+ffmpeg on PATH; no emulators, credentials or network):
+
+    python benchmarks/media_bench.py --durations 60 600 --video-bitrates 1M 4M \\
+        --modes single_pass parallel streaming --output bench.json
+    python benchmarks/media_bench.py --durations 60 600 --video-bitrates 1M 4M \\
+        --modes single_pass parallel streaming --compare bench.json
+
+Each synthetic clip (test pattern plus a tone with a two-second gap every
+ten seconds, so silence splitting has somewhere to cut) is uploaded to a
+FakeBucket and registered in a FakeFirestore from devtools/fake_gcp.py,
+and Whisper is answered by devtools/stub_openai.py. For every clip it runs
+convert_video in each mode, then transcribe_video and parse_vtt, and
+reports per stage (the top-level spans of each trace):
+
+    wall_s       elapsed time
+    cpu_s        CPU time of the stage's thread plus the ffmpeg processes it ran
+    peak_rss_mb  sampled peak RSS of this process
+    tmp_peak_mb  peak bytes in the functions' scratch directories
+
+--output writes the report as JSON. --compare reads a previous report and
+lists every stage whose metrics grew by more than --threshold, exiting 1 if
+any did, so it can gate a deploy.
+
+Timings only compare on the same machine, so no baseline is checked in.
+To check a change, write a baseline from the commit before it with
+--output, then run the same arguments with --compare on the change.
+
+A reference run (--durations 30 300 --video-bitrates 1M 4M, all five
+modes, --repeat 3) on 1 vCPU with ffmpeg 6.0 gave these conversion
+totals (median repeat) for the 300 s clips, 1M / 4M:
+
+    mode          wall s       tmp peak MB
+    single_pass   1.66 / 1.74   41 / 149
+    segmented     2.37 / 2.53   43 / 151
+    parallel      2.40 / 2.29   43 / 151
+    streaming     1.77 / 1.55    0 / 0
+    checkpointed  1.38 / 1.63   41 / 149
+
+Single pass beats the 15 s segment modes by about 30%. Streaming matches
+it on time and keeps nothing in scratch space, which is where the
+download and audio otherwise go. With one CPU the parallel pool is a
+single worker, so it shows no gain over segmented here; run on a
+multi-core machine to see the pool's effect. Transcription uses the
+Whisper stub, so its numbers only cover the download, parse and writes.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from datetime import datetime, timezone
+
+FUNCTIONS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, FUNCTIONS_DIR)
+
+from devtools import stub_openai  # noqa: E402
+from devtools.fake_gcp import FakeBucket, FakeFirestore  # noqa: E402
+
+# Temp directories created by convert_video and transcribe_video
+SCRATCH_PREFIXES = ('video_conversion_', 'transcription_')
+
+METRICS = ('wall_s', 'cpu_s', 'peak_rss_mb', 'tmp_peak_mb')
+# Growth below these is noise whatever the percentage
+NOISE_FLOOR = {'wall_s': 0.05, 'cpu_s': 0.05, 'peak_rss_mb': 5.0, 'tmp_peak_mb': 1.0}
+
+
+def make_clip(path, seconds, video_bitrate, size):
+    """Test pattern video at a fixed bitrate, with a gated tone as audio."""
+    subprocess.run(
+        ['ffmpeg', '-hide_banner', '-loglevel', 'error',
+         '-f', 'lavfi', '-i', f'testsrc2=size={size}:rate=30:duration={seconds}',
+         '-f', 'lavfi', '-i', f'aevalsrc=0.3*sin(2*PI*440*t)*lt(mod(t\\,10)\\,8):s=44100:d={seconds}',
+         '-shortest', '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p',
+         '-b:v', video_bitrate, '-maxrate', video_bitrate, '-bufsize', video_bitrate,
+         '-c:a', 'aac', '-b:a', '128k', '-movflags', '+faststart', '-y', path],
+        check=True
+    )
+
+
+def scratch_bytes(temp_root):
+    """Bytes currently held in the functions' temp directories."""
+    total = 0
+    try:
+        entries = [e for e in os.scandir(temp_root) if e.name.startswith(SCRATCH_PREFIXES) and e.is_dir()]
+    except OSError:
+        return 0
+    for entry in entries:
+        for root, _, files in os.walk(entry.path):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass  # Deleted between listing and stat
+    return total
+
+
+class ScratchSampler:
+    """Samples scratch disk usage in the background for the whole run."""
+
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        self.temp_root = tempfile.gettempdir()
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.samples.append((time.perf_counter(), scratch_bytes(self.temp_root)))
+            self._stop.wait(self.interval)
+
+    def peak_mb(self, start, end):
+        in_window = [size for at, size in self.samples if start <= at <= end]
+        return round(max(in_window, default=0) / 1024 / 1024, 1)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+class TraceCollector:
+    """Tracing emitter that keeps finished trace records instead of printing them."""
+
+    def __init__(self):
+        self.records = []
+
+    def __call__(self, record, severity='INFO'):
+        self.records.append(record)
+
+
+def measure(name, fn, collector, sampler):
+    """Run fn inside a trace; returns (result, {stage: metrics}, total metrics)."""
+    from services.tracing import trace
+
+    cpu_before = os.times()
+    with trace(name) as current:
+        trace_start = current.start
+        result = fn()
+    cpu_after = os.times()
+    record = collector.records[-1]
+    wall_end = trace_start + record['durationMs'] / 1000
+
+    stages = {}
+    for s in record['spans']:
+        if s['parent'] is not None:
+            continue
+        start = trace_start + s['startMs'] / 1000
+        stages[s['name']] = {
+            'wall_s': round(s['durationMs'] / 1000, 3),
+            'cpu_s': round(((s['cpuMs'] or 0) + s['childCpuMs']) / 1000, 3),
+            'peak_rss_mb': s['peakRssMb'],
+            'tmp_peak_mb': sampler.peak_mb(start, start + s['durationMs'] / 1000),
+        }
+    cpu = sum(getattr(cpu_after, f) - getattr(cpu_before, f)
+              for f in ('user', 'system', 'children_user', 'children_system'))
+    total = {
+        'wall_s': round(record['durationMs'] / 1000, 3),
+        'cpu_s': round(cpu, 3),
+        'peak_rss_mb': record['peakRssMb'],
+        'tmp_peak_mb': sampler.peak_mb(trace_start, wall_end),
+        'child_max_rss_mb': record['childMaxRssMb'],
+    }
+    return result, stages, total
+
+
+def reset_outputs(db, bucket, video_id, keep_audio=False):
+    """Forget derived output and cache entries so the next run does the work."""
+    for doc in db.collection('media_cache').stream():
+        doc.reference.delete()
+    db.collection('transcripts').document(video_id).delete()
+    audio = bucket.get_blob(f'audio/{video_id}.mp3')
+    if audio is not None and not keep_audio:
+        audio.delete()
+
+
+def median_run(runs):
+    """The repeat whose total wall time is the median."""
+    ordered = sorted(runs, key=lambda run: run['total']['wall_s'])
+    return ordered[(len(ordered) - 1) // 2]
+
+
+def run_benchmark(args):
+    import main
+    from services.clients import get_openai, set_client
+    from services.tracing import set_emitter
+
+    workspace = tempfile.mkdtemp(prefix='media_bench_')
+    clips_dir = args.clips_dir or os.path.join(workspace, 'clips')
+    os.makedirs(clips_dir, exist_ok=True)
+    bucket = FakeBucket(os.path.join(workspace, 'bucket'), latency=args.storage_latency)
+    db = FakeFirestore()
+    set_client('storage', bucket)
+    set_client('firestore', db)
+    get_openai().api_base = args.api_base
+
+    collector = TraceCollector()
+    set_emitter(collector)
+    results = []
+    try:
+        with ScratchSampler() as sampler:
+            for seconds in args.durations:
+                for video_bitrate in args.video_bitrates:
+                    clip = f'{seconds}s-{video_bitrate}'
+                    clip_path = os.path.join(clips_dir, f'{clip}-{args.size}.mp4')
+                    if not os.path.exists(clip_path):
+                        print(f"Generating {clip} clip...")
+                        make_clip(clip_path, seconds, video_bitrate, args.size)
+
+                    video_id = f'bench-{clip}'
+                    storage_path = f'videos/bench/{video_id}.mp4'
+                    bucket.blob(storage_path).upload_from_filename(clip_path, content_type='video/mp4')
+                    db.collection('videos').document(video_id).set({
+                        'videoUrl': (f'https://storage.local/v0/b/{bucket.name}/o/'
+                                     f'{urllib.parse.quote(storage_path, safe="")}?alt=media'),
+                        'userId': 'bench',
+                    })
+                    info = {'clip': clip, 'duration_s': seconds, 'video_bitrate': video_bitrate,
+                            'bytes': os.path.getsize(clip_path)}
+
+                    def benchmark(operation, fn, keep_audio=False):
+                        runs = []
+                        for _ in range(args.repeat):
+                            reset_outputs(db, bucket, video_id, keep_audio)
+                            _, stages, total = measure(operation, fn, collector, sampler)
+                            runs.append({'stages': stages, 'total': total})
+                        run = median_run(runs)
+                        results.append({**info, 'operation': operation, **run})
+                        print(f"{clip:<14}{operation:<24}{run['total']['wall_s']:>9.2f}s")
+
+                    for mode in args.modes:
+                        benchmark(f'convert:{mode}', lambda mode=mode: main.convert_video(video_id, mode))
+
+                    # Transcribes the audio left by the last conversion mode
+                    benchmark('transcribe', lambda: main.transcribe_video(video_id), keep_audio=True)
+
+                    vtt = stub_openai.synthetic_vtt(seconds)
+
+                    def parse():
+                        from services.tracing import span
+                        with span('parse_vtt', bytes=len(vtt)) as stage:
+                            stage.set(segments=len(main.parse_vtt(vtt)))
+                    benchmark('parse_vtt', parse, keep_audio=True)
+    finally:
+        set_emitter(None)
+        shutil.rmtree(workspace, ignore_errors=True)
+    return results
+
+
+def environment():
+    try:
+        ffmpeg_version = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True).stdout.split('\n')[0]
+    except OSError:
+        ffmpeg_version = None
+    return {
+        'created': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'ffmpeg': ffmpeg_version,
+    }
+
+
+def print_report(results):
+    print(f"\n{'clip':<14}{'operation':<24}{'stage':<18}" + ''.join(f'{m:>13}' for m in METRICS))
+    for run in results:
+        rows = list(run['stages'].items()) + [('total', run['total'])]
+        for stage, metrics in rows:
+            print(f"{run['clip']:<14}{run['operation']:<24}{stage:<18}"
+                  + ''.join(f'{metrics[m]:>13}' for m in METRICS))
+
+
+def compare(results, baseline, threshold):
+    """Print stages that regressed against baseline; returns their count."""
+    def index(runs):
+        return {
+            (run['clip'], run['operation'], stage): metrics
+            for run in runs
+            for stage, metrics in list(run['stages'].items()) + [('total', run['total'])]
+        }
+
+    before = index(baseline['results'])
+    regressions = 0
+    print(f"\nCompared with baseline from {baseline['environment'].get('created')} "
+          f"(threshold {threshold:.0%}):")
+    for key, metrics in index(results).items():
+        old = before.get(key)
+        if old is None:
+            continue
+        for metric in METRICS:
+            new_value, old_value = metrics.get(metric), old.get(metric)
+            if new_value is None or old_value is None:
+                continue
+            if new_value - old_value > max(NOISE_FLOOR[metric], old_value * threshold):
+                regressions += 1
+                print(f"  REGRESSION {' / '.join(key)} {metric}: {old_value} -> {new_value}")
+    if not regressions:
+        print("  no regressions")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--durations', type=int, nargs='+', default=[30, 300], help='Clip lengths in seconds')
+    parser.add_argument('--video-bitrates', nargs='+', default=['1M', '4M'])
+    parser.add_argument('--size', default='1280x720', help='Clip frame size')
+    parser.add_argument('--modes', nargs='+', default=['single_pass', 'parallel', 'streaming'],
+                        help='convert_video extraction modes to run')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per operation; the median is reported')
+    parser.add_argument('--whisper-latency', type=float, default=0.0, help='Stub Whisper/chat response delay (s)')
+    parser.add_argument('--storage-latency', type=float, default=0.0, help='Fake Storage per-request delay (s)')
+    parser.add_argument('--clips-dir', help='Keep generated clips here between runs')
+    parser.add_argument('--output', help='Write the JSON report here')
+    parser.add_argument('--compare', help='Baseline report to check for regressions')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Allowed growth before a stage is flagged')
+    args = parser.parse_args()
+
+    server, args.api_base = stub_openai.start_in_thread(latency=args.whisper_latency)
+    os.environ['OPENAI_API_BASE'] = args.api_base
+    os.environ.setdefault('OPENAI_API_KEY', 'stub')
+    os.environ['TRACING'] = '1'  # Stage metrics come from the traces
+    try:
+        results = run_benchmark(args)
+    finally:
+        server.shutdown()
+
+    print_report(results)
+    report = {'environment': environment(), 'args': {k: v for k, v in vars(args).items() if k != 'api_base'},
+              'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        sys.exit(1 if compare(results, baseline, args.threshold) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""Micro-benchmark of the streaming VTT parser against the original parse_vtt.
+
+Run from the functions directory:
+
+    python benchmarks/vtt_parser_bench.py --hours 1 3 6
+
+For each synthetic transcript length it reports parse throughput (best of
+--repeat runs) and, measured separately with tracemalloc, the peak memory
+while parsing and the memory retained by the parsed result.
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.vtt import format_timestamp, iter_segments, parse_timestamp  # noqa: E402
+
+WORDS = ('so', 'the', 'camera', 'light', 'frame', 'today', 'we', 'will', 'look', 'at', 'exposure',
+         'and', 'focus', 'because', 'it', 'matters', 'when', 'you', 'shoot', 'video')
+
+
+def legacy_parse_vtt(vtt_content):
+    """The original parse_vtt from main.py (comments dropped), for comparison."""
+    segments = []
+    lines = vtt_content.strip().split('\n')
+    current_segment = None
+
+    for line in lines:
+        if line == 'WEBVTT' or not line.strip():
+            continue
+
+        timestamp_match = re.match(r'(\d{2}:\d{2}:\d{2}\.\d{3}) --> (\d{2}:\d{2}:\d{2}\.\d{3})', line)
+        if timestamp_match:
+            if current_segment:
+                segments.append(current_segment)
+            current_segment = {
+                'start': timestamp_match.group(1),
+                'end': timestamp_match.group(2),
+                'text': ''
+            }
+        elif current_segment is not None:
+            if current_segment['text']:
+                current_segment['text'] += ' ' + line
+            else:
+                current_segment['text'] = line
+
+    if current_segment:
+        segments.append(current_segment)
+
+    return segments
+
+
+def legacy_parse_with_ms(vtt_content):
+    """Legacy output plus the timestamp conversion every consumer had to do."""
+    segments = legacy_parse_vtt(vtt_content)
+    for segment in segments:
+        segment['startMs'] = parse_timestamp(segment['start'])
+        segment['endMs'] = parse_timestamp(segment['end'])
+    return segments
+
+
+def streaming_parse(vtt_content):
+    """The new parser, materialized into a list like the legacy one."""
+    return list(iter_segments(vtt_content.splitlines()))
+
+
+def synthetic_vtt(hours, seed=1):
+    """Whisper-like VTT: ~4s cues, some multi-line, no cue identifiers."""
+    rng = random.Random(seed)
+    lines = ['WEBVTT', '']
+    start = 0
+    end_of_file = int(hours * 3600 * 1000)
+    while start < end_of_file:
+        end = start + rng.randint(2000, 6000)
+        lines.append(f'{format_timestamp(start)} --> {format_timestamp(end)}')
+        for _ in range(rng.choice((1, 1, 1, 2))):
+            lines.append(' '.join(rng.choice(WORDS) for _ in range(rng.randint(6, 14))))
+        lines.append('')
+        start = end
+    return '\n'.join(lines)
+
+
+def best_time(parse, content, repeat):
+    """Best wall time of repeat runs, and the segment count."""
+    best = float('inf')
+    count = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = len(parse(content))
+        best = min(best, time.perf_counter() - start)
+    return best, count
+
+
+def memory_profile(parse, content):
+    """(peak MB while parsing, MB retained by the result)."""
+    tracemalloc.start()
+    result = parse(content)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return peak / 1024 / 1024, retained / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--hours', type=float, nargs='+', default=[1, 3, 6])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    parsers = (('legacy', legacy_parse_vtt), ('legacy+ms', legacy_parse_with_ms), ('streaming', streaming_parse))
+    print(f"{'hours':>5} {'parser':>10} {'cues':>8} {'seconds':>9} {'MB/s':>8} {'peak MB':>8} {'kept MB':>8}")
+    for hours in args.hours:
+        content = synthetic_vtt(hours)
+        size_mb = len(content.encode()) / 1024 / 1024
+        for name, parse in parsers:
+            seconds, count = best_time(parse, content, args.repeat)
+            peak, retained = memory_profile(parse, content)
+            print(f"{hours:>5g} {name:>10} {count:>8} {seconds:>9.3f} {size_mb / seconds:>8.1f} {peak:>8.1f} {retained:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
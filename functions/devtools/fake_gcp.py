@@ -0,0 +1,487 @@
+"""In-process stand-ins for the Cloud Storage bucket and Firestore client.
+
+They implement the subset of the google-cloud-storage and firebase_admin
+Firestore APIs the functions use, so convert_video, transcribe_video and
+friends can run locally without emulators or credentials:
+
+    from services.clients import set_client
+    set_client('storage', FakeBucket('/tmp/fake-bucket'))
+    set_client('firestore', FakeFirestore())
+
+Objects are plain files under the bucket's root directory (keep it outside
+the temp directories the functions use, so benchmarks can tell the two
+apart). Documents live in memory. Neither aims to reproduce GCP latency or
+consistency; FakeBucket can add a fixed per-request latency.
+"""
+
+import base64
+import copy
+import hashlib
+import itertools
+import os
+import shutil
+import threading
+import time
+import urllib.parse
+import uuid
+import zlib
+from datetime import datetime, timezone
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _not_found(message):
+    try:
+        from google.api_core.exceptions import NotFound
+    except ImportError:
+        return FileNotFoundError(message)
+    return NotFound(message)
+
+
+# ---------------------------------------------------------------------------
+# Cloud Storage
+# ---------------------------------------------------------------------------
+
+class FakeBucket:
+    """A bucket backed by a local directory."""
+
+    def __init__(self, root, name='fake-bucket', latency=0.0):
+        self.root = root
+        self.name = name
+        self.latency = latency
+        self._props = {}
+        self._generations = itertools.count(int(time.time() * 1e6))
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(root, '.staging'), exist_ok=True)
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _path(self, name):
+        return os.path.join(self.root, urllib.parse.quote(name, safe=''))
+
+    def _finalize(self, name, staged_path, content_type=None, metadata=None, md5=True):
+        """Move a fully written file into place as a new generation."""
+        md5_hash = hashlib.md5()
+        crc = 0
+        with open(staged_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                if md5:
+                    md5_hash.update(chunk)
+                crc = zlib.crc32(chunk, crc)
+        os.replace(staged_path, self._path(name))
+        with self._lock:
+            self._props[name] = {
+                'size': os.path.getsize(self._path(name)),
+                # Composite objects have no MD5 in GCS; zlib's CRC-32 stands in for CRC32C
+                'md5_hash': base64.b64encode(md5_hash.digest()).decode() if md5 else None,
+                'crc32c': base64.b64encode(crc.to_bytes(4, 'big')).decode(),
+                'generation': next(self._generations),
+                'metageneration': 1,
+                'updated': _now(),
+                'content_type': content_type,
+                'metadata': dict(metadata) if metadata else None,
+            }
+
+    def _staging_path(self):
+        return os.path.join(self.root, '.staging', uuid.uuid4().hex)
+
+    def _get_props(self, name):
+        with self._lock:
+            props = self._props.get(name)
+            return dict(props) if props else None
+
+    def blob(self, name, chunk_size=None):
+        return FakeBlob(self, name, chunk_size)
+
+    def get_blob(self, name, **kwargs):
+        self._wait()
+        props = self._get_props(name)
+        if props is None:
+            return None
+        blob = FakeBlob(self, name)
+        blob._load(props)
+        return blob
+
+    def copy_blob(self, blob, destination_bucket, new_name=None, **kwargs):
+        self._wait()
+        source = self._get_props(blob.name)
+        if source is None:
+            raise _not_found(f'No such object: {self.name}/{blob.name}')
+        new_name = new_name or blob.name
+        staged = destination_bucket._staging_path()
+        shutil.copyfile(self._path(blob.name), staged)
+        destination_bucket._finalize(new_name, staged, source['content_type'], source['metadata'],
+                                     md5=source['md5_hash'] is not None)
+        return destination_bucket.get_blob(new_name)
+
+    def list_blobs(self, prefix=None, **kwargs):
+        self._wait()
+        with self._lock:
+            names = sorted(name for name in self._props if not prefix or name.startswith(prefix))
+        return [self.get_blob(name) for name in names]
+
+    def delete_blob(self, name, **kwargs):
+        self._wait()
+        with self._lock:
+            if self._props.pop(name, None) is None:
+                raise _not_found(f'No such object: {self.name}/{name}')
+        os.remove(self._path(name))
+
+
+class _BlobWriter:
+    """File-like writer whose object only appears once it is closed."""
+
+    def __init__(self, blob, content_type):
+        self._blob = blob
+        self._content_type = content_type
+        self._staged = blob.bucket._staging_path()
+        self._file = open(self._staged, 'wb')
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self._file.write(data)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._file.close()
+        self._blob._commit(self._staged, self._content_type)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class FakeBlob:
+    """An object in a FakeBucket; attributes are filled by reload() or get_blob()."""
+
+    def __init__(self, bucket, name, chunk_size=None):
+        self.bucket = bucket
+        self.name = name
+        self.chunk_size = chunk_size
+        self.content_type = None
+        self.metadata = None
+        self.size = None
+        self.md5_hash = None
+        self.crc32c = None
+        self.generation = None
+        self.metageneration = None
+        self.updated = None
+
+    def _load(self, props):
+        for key, value in props.items():
+            setattr(self, key, value)
+
+    def _commit(self, staged_path, content_type=None):
+        self.bucket._finalize(self.name, staged_path, content_type or self.content_type, self.metadata)
+        self._load(self.bucket._get_props(self.name))
+
+    def _require(self):
+        props = self.bucket._get_props(self.name)
+        if props is None:
+            raise _not_found(f'No such object: {self.bucket.name}/{self.name}')
+        return props
+
+    def reload(self, **kwargs):
+        self.bucket._wait()
+        self._load(self._require())
+
+    def exists(self, **kwargs):
+        self.bucket._wait()
+        return self.bucket._get_props(self.name) is not None
+
+    def patch(self, **kwargs):
+        self.bucket._wait()
+        self._require()
+        with self.bucket._lock:
+            props = self.bucket._props[self.name]
+            props['metadata'] = dict(self.metadata) if self.metadata else None
+            if self.content_type:
+                props['content_type'] = self.content_type
+            props['metageneration'] += 1
+            props['updated'] = _now()
+            self._load(dict(props))
+
+    def delete(self, **kwargs):
+        self.bucket.delete_blob(self.name)
+
+    def compose(self, sources, **kwargs):
+        self.bucket._wait()
+        staged = self.bucket._staging_path()
+        with open(staged, 'wb') as out:
+            for source in sources:
+                source._require()
+                with open(self.bucket._path(source.name), 'rb') as f:
+                    shutil.copyfileobj(f, out)
+        # Composite objects have a CRC32C but no MD5, as in GCS
+        self.bucket._finalize(self.name, staged, self.content_type, self.metadata, md5=False)
+        self._load(self.bucket._get_props(self.name))
+
+    def open(self, mode='r', chunk_size=None, content_type=None, **kwargs):
+        self.bucket._wait()
+        if mode == 'rb':
+            self._require()
+            return open(self.bucket._path(self.name), 'rb')
+        if mode == 'wb':
+            return _BlobWriter(self, content_type)
+        raise ValueError(f'Unsupported mode {mode!r}')
+
+    def upload_from_file(self, file_obj, content_type=None, **kwargs):
+        self.bucket._wait()
+        staged = self.bucket._staging_path()
+        with open(staged, 'wb') as f:
+            shutil.copyfileobj(file_obj, f, self.chunk_size or 1024 * 1024)
+        self._commit(staged, content_type)
+
+    def upload_from_filename(self, filename, content_type=None, **kwargs):
+        with open(filename, 'rb') as f:
+            self.upload_from_file(f, content_type=content_type)
+
+    def upload_from_string(self, data, content_type=None, **kwargs):
+        self.bucket._wait()
+        staged = self.bucket._staging_path()
+        with open(staged, 'wb') as f:
+            f.write(data.encode() if isinstance(data, str) else data)
+        self._commit(staged, content_type)
+
+    def download_to_file(self, file_obj, **kwargs):
+        self.bucket._wait()
+        self._require()
+        with open(self.bucket._path(self.name), 'rb') as f:
+            shutil.copyfileobj(f, file_obj, 1024 * 1024)
+
+    def download_to_filename(self, filename, **kwargs):
+        with open(filename, 'wb') as f:
+            self.download_to_file(f)
+
+    def download_as_bytes(self, start=None, end=None, **kwargs):
+        """Ranged read; like GCS, end is inclusive."""
+        self.bucket._wait()
+        self._require()
+        with open(self.bucket._path(self.name), 'rb') as f:
+            f.seek(start or 0)
+            return f.read() if end is None else f.read(end - (start or 0) + 1)
+
+
+# ---------------------------------------------------------------------------
+# Firestore
+# ---------------------------------------------------------------------------
+
+def _transforms():
+    from google.cloud.firestore_v1 import transforms
+    return transforms
+
+
+def _get_path(data, path):
+    for part in path.split('.'):
+        if not isinstance(data, dict) or part not in data:
+            return None
+        data = data[part]
+    return data
+
+
+def _apply(document, parts, value, merge_maps):
+    """Write value at the field path parts, resolving Firestore sentinels and transforms.
+
+    Maps replace what was there unless merge_maps, as with set(merge=True).
+    """
+    transforms = _transforms()
+    *parents, leaf = parts
+    target = document
+    for part in parents:
+        if not isinstance(target.get(part), dict):
+            target[part] = {}
+        target = target[part]
+    if value is transforms.DELETE_FIELD:
+        target.pop(leaf, None)
+    elif value is transforms.SERVER_TIMESTAMP:
+        target[leaf] = _now()
+    elif isinstance(value, transforms.Increment):
+        target[leaf] = (target.get(leaf) or 0) + value.value
+    elif isinstance(value, transforms.ArrayUnion):
+        current = list(target.get(leaf) or [])
+        target[leaf] = current + [item for item in value.values if item not in current]
+    elif isinstance(value, dict):
+        # Nested maps may themselves carry sentinels (e.g. {'suppressed': {kind: Increment(1)}})
+        if not merge_maps or not isinstance(target.get(leaf), dict):
+            target[leaf] = {}
+        for key, item in value.items():
+            _apply(target[leaf], [key], item, merge_maps)
+    else:
+        target[leaf] = copy.deepcopy(value)
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path):
+        return copy.deepcopy(_get_path(self._data or {}, field_path))
+
+
+class FakeDocumentReference:
+    def __init__(self, db, path):
+        self._db = db
+        self.path = path
+        self.id = path.rsplit('/', 1)[-1]
+
+    def collection(self, name):
+        return FakeCollectionReference(self._db, f'{self.path}/{name}')
+
+    def get(self, transaction=None, **kwargs):
+        return self._db._read(self)
+
+    def set(self, data, merge=False):
+        self._db._write([('set', self, data, merge)])
+
+    def update(self, data):
+        self._db._write([('update', self, data, None)])
+
+    def delete(self):
+        self._db._write([('delete', self, None, None)])
+
+
+class FakeCollectionReference:
+    def __init__(self, db, path):
+        self._db = db
+        self.path = path
+        self.id = path.rsplit('/', 1)[-1]
+
+    def document(self, document_id=None):
+        return FakeDocumentReference(self._db, f'{self.path}/{document_id or uuid.uuid4().hex[:20]}')
+
+    def stream(self, **kwargs):
+        prefix = f'{self.path}/'
+        with self._db._lock:
+            paths = sorted(path for path in self._db._documents if path.startswith(prefix) and '/' not in path[len(prefix):])
+        return [self._db._read(FakeDocumentReference(self._db, path)) for path in paths]
+
+
+class FakeWriteBatch:
+    def __init__(self, db):
+        self._db = db
+        self._writes = []
+
+    def set(self, reference, data, merge=False):
+        self._writes.append(('set', reference, data, merge))
+
+    def update(self, reference, data):
+        self._writes.append(('update', reference, data, None))
+
+    def delete(self, reference):
+        self._writes.append(('delete', reference, None, None))
+
+    def commit(self):
+        writes, self._writes = self._writes, []
+        self._db._write(writes)
+
+
+class FakeTransaction(FakeWriteBatch):
+    """Serializes transactional functions behind one lock.
+
+    Implements the hooks firestore.transactional drives (_begin, _commit,
+    _rollback, ...), so the real decorator can be used unchanged. Nothing
+    ever conflicts, so functions run exactly once.
+    """
+
+    def __init__(self, db):
+        super().__init__(db)
+        self._max_attempts = 1
+        self._read_only = False
+        self._id = None
+
+    @property
+    def in_progress(self):
+        return self._id is not None
+
+    def _clean_up(self):
+        self._writes = []
+        self._id = None
+
+    def _begin(self, retry_id=None):
+        self._db._transaction_lock.acquire()
+        self._id = uuid.uuid4().bytes
+
+    def _commit(self):
+        try:
+            self.commit()
+        finally:
+            self._end()
+        return []
+
+    def _rollback(self):
+        self._writes = []
+        self._end()
+
+    def _end(self):
+        if self._id is not None:
+            self._id = None
+            self._db._transaction_lock.release()
+
+
+class FakeFirestore:
+    """An in-memory Firestore client."""
+
+    def __init__(self):
+        self._documents = {}
+        self._lock = threading.Lock()
+        self._transaction_lock = threading.Lock()
+
+    def collection(self, name):
+        return FakeCollectionReference(self, name)
+
+    def document(self, path):
+        return FakeDocumentReference(self, path)
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def transaction(self, **kwargs):
+        return FakeTransaction(self)
+
+    def get_all(self, references, **kwargs):
+        return [self._read(reference) for reference in references]
+
+    def _read(self, reference):
+        with self._lock:
+            data = copy.deepcopy(self._documents.get(reference.path))
+        return FakeSnapshot(reference, data)
+
+    def _write(self, writes):
+        with self._lock:
+            for kind, reference, data, merge in writes:
+                if kind == 'delete':
+                    self._documents.pop(reference.path, None)
+                    continue
+                if kind == 'update' and reference.path not in self._documents:
+                    raise _not_found(f'No document to update: {reference.path}')
+                if kind == 'set' and not merge:
+                    document = {}
+                else:
+                    document = copy.deepcopy(self._documents.get(reference.path, {}))
+                for key, value in data.items():
+                    # update() takes dotted field paths; set() keys are literal
+                    parts = key.split('.') if kind == 'update' else [key]
+                    _apply(document, parts, value, merge_maps=kind == 'set' and merge)
+                self._documents[reference.path] = document
@@ -0,0 +1,156 @@
+"""Drive the upload -> audio -> transcript -> info card pipeline on the emulators.
+
+Start the emulators and the OpenAI stub, then run the harness from the
+functions directory:
+
+    # functions/.env.local (read by the functions emulator only)
+    OPENAI_API_BASE=http://127.0.0.1:8089/v1
+    OPENAI_API_KEY=stub
+
+    python devtools/stub_openai.py --port 8089 &
+    firebase emulators:start --only functions,firestore,storage
+    python devtools/pipeline_harness.py [--video clip.mp4] [--count 3]
+
+The harness uploads the video to the Storage emulator, creates its videos
+document like the app does, then follows processing_jobs/{video_id} until
+every job is done or failed, printing each stage transition and the
+per-stage durations. Without --video a short test clip is generated with
+ffmpeg. Exits non-zero if any job fails or times out.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+
+FUNCTIONS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault('FIRESTORE_EMULATOR_HOST', '127.0.0.1:8080')
+os.environ.setdefault('STORAGE_EMULATOR_HOST', 'http://127.0.0.1:9199')
+
+sys.path.insert(0, FUNCTIONS_DIR)
+
+from services.jobs import DONE, FAILED, JOB_COLLECTION, STAGES  # noqa: E402
+
+
+def default_project():
+    try:
+        with open(os.path.join(os.path.dirname(FUNCTIONS_DIR), '.firebaserc')) as f:
+            return json.load(f)['projects']['default']
+    except (OSError, KeyError, ValueError):
+        return os.getenv('GCLOUD_PROJECT', 'demo-project')
+
+
+def make_test_clip(path, seconds):
+    """Test pattern video with a tone, faststart MP4."""
+    subprocess.run(
+        ['ffmpeg', '-hide_banner', '-loglevel', 'error',
+         '-f', 'lavfi', '-i', f'testsrc=size=320x240:rate=15:duration={seconds}',
+         '-f', 'lavfi', '-i', f'sine=frequency=440:duration={seconds}',
+         '-shortest', '-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-c:a', 'aac',
+         '-movflags', '+faststart', '-y', path],
+        check=True
+    )
+
+
+def upload_video(db, bucket, video_path, index):
+    """Upload like the app: storage object first, then the videos document."""
+    from google.cloud import firestore
+
+    storage_path = f'videos/pipeline-harness/{int(time.time() * 1000)}_{index}_{os.path.basename(video_path)}'
+    blob = bucket.blob(storage_path)
+    blob.upload_from_filename(video_path, content_type='video/mp4')
+    video_url = (f"{os.environ['STORAGE_EMULATOR_HOST']}/v0/b/{bucket.name}/o/"
+                 f"{urllib.parse.quote(storage_path, safe='')}?alt=media")
+
+    video_ref = db.collection('videos').document()
+    video_ref.set({
+        'userId': 'pipeline-harness',
+        'videoUrl': video_url,
+        'title': f'Pipeline harness {index}',
+        'description': '',
+        'isPrivate': True,
+        'createdAt': firestore.SERVER_TIMESTAMP,
+        'status': 'ready',
+        'size': os.path.getsize(video_path),
+    })
+    return video_ref.id
+
+
+def follow_jobs(db, video_ids, timeout):
+    """Poll the job documents until all finish; returns {video_id: job dict}."""
+    started = time.monotonic()
+    last_seen = {}
+    finished = {}
+    while len(finished) < len(video_ids) and time.monotonic() - started < timeout:
+        for video_id in video_ids:
+            if video_id in finished:
+                continue
+            doc = db.collection(JOB_COLLECTION).document(video_id).get()
+            if not doc.exists:
+                continue
+            job = doc.to_dict()
+            state = (job.get('stage'), job.get('status'))
+            if state != last_seen.get(video_id):
+                print(f"{time.monotonic() - started:7.1f}s  {video_id}  {state[0]:<10} {state[1]}")
+                last_seen[video_id] = state
+            if job.get('status') in (DONE, FAILED):
+                finished[video_id] = job
+        time.sleep(0.5)
+    return finished
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--video', help='MP4 to upload (default: generate a test clip)')
+    parser.add_argument('--seconds', type=int, default=20, help='Length of the generated clip')
+    parser.add_argument('--count', type=int, default=1, help='Number of uploads to run at once')
+    parser.add_argument('--project', default=default_project())
+    parser.add_argument('--bucket', help='Storage bucket (default: <project>.appspot.com)')
+    parser.add_argument('--timeout', type=float, default=600)
+    args = parser.parse_args()
+
+    from google.auth.credentials import AnonymousCredentials
+    from google.cloud import firestore, storage
+
+    db = firestore.Client(project=args.project, credentials=AnonymousCredentials())
+    bucket = storage.Client(project=args.project, credentials=AnonymousCredentials()).bucket(
+        args.bucket or f'{args.project}.appspot.com'
+    )
+
+    with tempfile.TemporaryDirectory(prefix='pipeline_harness_') as temp_dir:
+        video_path = args.video
+        if not video_path:
+            video_path = os.path.join(temp_dir, 'harness.mp4')
+            make_test_clip(video_path, args.seconds)
+        video_ids = [upload_video(db, bucket, video_path, index) for index in range(args.count)]
+    print(f"Uploaded {len(video_ids)} video(s): {', '.join(video_ids)}")
+
+    finished = follow_jobs(db, video_ids, args.timeout)
+
+    print(f"\n{'video':<22}{'status':<8}" + ''.join(f'{stage:>12}' for stage in STAGES))
+    ok = True
+    for video_id in video_ids:
+        job = finished.get(video_id)
+        if job is None:
+            print(f"{video_id:<22}{'timeout':<8}")
+            ok = False
+            continue
+        stages = job.get('stages') or {}
+        seconds = ''.join(
+            f"{stages[stage]['seconds']:>11.1f}s" if (stages.get(stage) or {}).get('seconds') is not None else f"{'-':>12}"
+            for stage in STAGES
+        )
+        print(f"{video_id:<22}{job['status']:<8}{seconds}")
+        if job['status'] == FAILED:
+            print(f"  error: {job.get('error')}")
+            ok = False
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""Local stand-in for the OpenAI endpoints the functions call.
+
+Serves /v1/audio/transcriptions (VTT) and /v1/chat/completions (info card
+JSON) so transcription and info-card code can run without network access
+or API spend. Point the functions at it with:
+
+    python devtools/stub_openai.py --port 8089 --latency 0.5 --fail-rate 0.1
+    OPENAI_API_BASE=http://127.0.0.1:8089/v1 OPENAI_API_KEY=stub ...
+
+Transcripts are synthetic: one cue every CUE_SECONDS over the duration
+implied by the upload size at the conversion bitrate of its audio profile.
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CUE_SECONDS = 5
+ASSUMED_BITRATE = 64000  # Matches the default MP3 output of convert_to_audio
+# Bitrates of the other audio profiles, by uploaded file extension
+BITRATES_BY_EXTENSION = {b'.ogg': 24000}
+_UPLOAD_FILENAME = re.compile(rb'filename="[^"]*?(\.\w+)"')
+WORDS = ('video', 'today', 'we', 'look', 'at', 'how', 'the', 'camera', 'works', 'and', 'why', 'light', 'matters')
+
+
+def _timestamp(seconds):
+    hours, rest = divmod(int(seconds * 1000), 3600000)
+    minutes, rest = divmod(rest, 60000)
+    secs, millis = divmod(rest, 1000)
+    return f'{hours:02d}:{minutes:02d}:{secs:02d}.{millis:03d}'
+
+
+def synthetic_vtt(duration, seed=0):
+    """Build a VTT document with a cue every CUE_SECONDS."""
+    rng = random.Random(seed)
+    cues = ['WEBVTT', '']
+    start = 0.0
+    while start < duration:
+        end = min(start + CUE_SECONDS, duration)
+        cues.append(f'{_timestamp(start)} --> {_timestamp(end)}')
+        cues.append(' '.join(rng.choice(WORDS) for _ in range(12)))
+        cues.append('')
+        start = end
+    return '\n'.join(cues)
+
+
+class StubOpenAIHandler(BaseHTTPRequestHandler):
+    """Request handler; behaviour is configured on the server object."""
+
+    stats_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status, body, content_type='application/json'):
+        payload = body.encode() if isinstance(body, str) else body
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        with self.stats_lock:
+            self.server.request_count[self.path] = self.server.request_count.get(self.path, 0) + 1
+
+        time.sleep(self.server.latency)
+        if random.random() < self.server.fail_rate:
+            self._send(429, json.dumps({'error': {'message': 'Rate limit reached (stub)', 'type': 'rate_limit'}}))
+            return
+
+        if self.path.endswith('/audio/transcriptions'):
+            match = _UPLOAD_FILENAME.search(body[:4096])
+            bitrate = BITRATES_BY_EXTENSION.get(match.group(1) if match else None, ASSUMED_BITRATE)
+            duration = len(body) * 8 / bitrate
+            self._send(200, synthetic_vtt(duration, seed=len(body)), 'text/plain; charset=utf-8')
+        elif self.path.endswith('/chat/completions'):
+            request = json.loads(body or b'{}')
+            prompt = request.get('messages', [{}])[-1].get('content', '')
+            content = json.dumps({
+                'title': f'Stub title ({len(prompt)} prompt chars)',
+                'description': 'A stub description generated locally for testing.'
+            })
+            self._send(200, json.dumps({
+                'id': 'chatcmpl-stub',
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': request.get('model', 'gpt-3.5-turbo'),
+                'choices': [{'index': 0, 'finish_reason': 'stop',
+                             'message': {'role': 'assistant', 'content': content}}],
+                'usage': {'prompt_tokens': len(prompt) // 4, 'completion_tokens': 40,
+                          'total_tokens': len(prompt) // 4 + 40},
+            }))
+        else:
+            self._send(404, json.dumps({'error': {'message': f'Unknown path {self.path}'}}))
+
+
+def make_server(host='127.0.0.1', port=0, latency=0.0, fail_rate=0.0, verbose=False):
+    """Create (but do not start) a stub server; port 0 picks a free port."""
+    server = ThreadingHTTPServer((host, port), StubOpenAIHandler)
+    server.latency = latency
+    server.fail_rate = fail_rate
+    server.verbose = verbose
+    server.request_count = {}
+    return server
+
+
+def start_in_thread(**kwargs):
+    """Start a stub server in a daemon thread; returns (server, api_base)."""
+    server = make_server(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    return server, f'http://{host}:{port}/v1'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stub for the OpenAI API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds to wait before answering')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='Fraction of requests answered with 429')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.latency, args.fail_rate, args.verbose)
+    print(f"Stub OpenAI listening on http://{args.host}:{args.port}/v1")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""Batch indexer for cross-video transcript search.
+
+Pages through the transcripts collection in createdAt order, starting from
+the checkpoint stored in the index manifest, adds new or re-created
+transcripts to the sharded BM25 index (services/fulltext.py) and publishes
+it to Cloud Storage for the search_transcripts function.
+
+    python index_transcripts.py                 # incremental update + publish
+    python index_transcripts.py --rebuild       # index everything from scratch
+    python index_transcripts.py --no-upload --root ./search_index
+
+Run it on a schedule (or after backfills); each run only reads transcripts
+created since the previous one.
+"""
+
+import argparse
+import time
+from datetime import datetime
+
+from services.clients import get_bucket, get_db
+from services.fulltext import (
+    DEFAULT_SHARDS,
+    INDEX_PREFIX,
+    FulltextIndex,
+    download_index,
+    upload_index,
+)
+from services.transcript_store import load_segments
+
+
+def transcript_segments(db, video_id, data):
+    """[(start_ms, text)] of a transcript, from its header (or legacy) document."""
+    return [(segment['startMs'], segment['text']) for segment in load_segments(db, video_id, data) or []]
+
+
+def iter_new_transcripts(db, since, page_size):
+    """Yield transcript snapshots created at or after since, oldest first.
+
+    Re-reading the boundary timestamp is harmless: re-adding a video
+    replaces its previous copy.
+    """
+    from google.cloud.firestore_v1.base_query import FieldFilter
+
+    query = db.collection('transcripts').order_by('createdAt')
+    if since:
+        query = query.where(filter=FieldFilter('createdAt', '>=', since))
+    last = None
+    while True:
+        page_query = query.limit(page_size)
+        if last is not None:
+            page_query = page_query.start_after(last)
+        page = list(page_query.stream())
+        if not page:
+            return
+        yield from page
+        last = page[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the cross-video transcript search index')
+    parser.add_argument('--root', default='search_index_build', help='Local index directory')
+    parser.add_argument('--prefix', default=INDEX_PREFIX, help='Storage prefix to publish to')
+    parser.add_argument('--shards', type=int, default=DEFAULT_SHARDS, help='Shard count for a new index')
+    parser.add_argument('--page-size', type=int, default=500)
+    parser.add_argument('--batch-size', type=int, default=5000, help='Transcripts per new segment batch')
+    parser.add_argument('--compact-threshold', type=int, default=8,
+                        help='Merge a shard once it has more segment files than this')
+    parser.add_argument('--rebuild', action='store_true', help='Ignore the existing index and start over')
+    parser.add_argument('--no-upload', action='store_true', help='Only update the local index')
+    args = parser.parse_args()
+
+    bucket = None if args.no_upload else get_bucket()
+    if args.rebuild:
+        index = FulltextIndex.create(args.root, args.shards)
+    else:
+        if bucket is not None:
+            download_index(bucket, args.prefix, args.root)
+        index = FulltextIndex.open_or_create(args.root, args.shards)
+
+    checkpoint = index.checkpoint
+    since = datetime.fromisoformat(checkpoint['createdAt']) if checkpoint else None
+    print(f"Indexing transcripts created since {since or 'the beginning'} into {index.shards} shards")
+
+    started = time.perf_counter()
+    indexed = 0
+    batch = []
+    newest = since
+    db = get_db()
+    for snapshot in iter_new_transcripts(db, since, args.page_size):
+        data = snapshot.to_dict()
+        batch.append((snapshot.id, transcript_segments(db, snapshot.id, data)))
+        newest = data.get('createdAt') or newest
+        if len(batch) >= args.batch_size:
+            index.add(batch, checkpoint={'createdAt': newest.isoformat()})
+            indexed += len(batch)
+            batch = []
+            print(f"  {indexed} transcripts indexed ({indexed / (time.perf_counter() - started):.0f}/s)")
+    if batch:
+        index.add(batch, checkpoint={'createdAt': newest.isoformat()})
+        indexed += len(batch)
+
+    merged = index.compact(max_segments=args.compact_threshold)
+    print(f"Indexed {indexed} transcripts in {time.perf_counter() - started:.1f}s; "
+          f"{index.doc_count} videos searchable, {merged} shards compacted")
+
+    if bucket is not None:
+        upload_index(index, bucket, args.prefix)
+        print(f"Published index to gs://{bucket.name}/{args.prefix}/")
+
+
+if __name__ == '__main__':
+    main()
@@ -3,335 +3,464 @@
 # Deploy with `firebase deploy`
 
 import json
-import ffmpeg
-from firebase_admin import initialize_app, storage, firestore
-from firebase_functions import https_fn
+from firebase_functions import firestore_fn, https_fn, options
 import urllib.parse
 import os
 import tempfile
 import shutil
-import subprocess
-from datetime import timedelta
-import openai
-from dotenv import load_dotenv
-import pkg_resources
-import psutil
-import gc
-import re
+import time
+from contextlib import contextmanager
 
-# Load environment variables
-load_dotenv()
-
-# Initialize Firebase Admin and OpenAI
-initialize_app()
+# Heavy SDKs (ffmpeg, openai, Firebase Admin) are imported inside the
+# handlers that need them and clients come from services.clients, so cold
+# starts only pay for what the invoked endpoint uses.
+from services.clients import get_bucket, get_db, get_openai
+from services.tracing import span, trace
+from services.vtt import iter_segments
 
 def parse_vtt(vtt_content):
     """Parse VTT content into segments with timestamps."""
-    segments = []
-    lines = vtt_content.strip().split('\n')
-    current_segment = None
-    
-    for line in lines:
-        # Skip WebVTT header and empty lines
-        if line == 'WEBVTT' or not line.strip():
-            continue
-            
-        # Check for timestamp line (e.g., "00:00:00.000 --> 00:00:05.000")
-        timestamp_match = re.match(r'(\d{2}:\d{2}:\d{2}\.\d{3}) --> (\d{2}:\d{2}:\d{2}\.\d{3})', line)
-        if timestamp_match:
-            if current_segment:
-                segments.append(current_segment)
-            current_segment = {
-                'start': timestamp_match.group(1),
-                'end': timestamp_match.group(2),
-                'text': ''
-            }
-        # If we have a current segment and this isn't a timestamp line, it's text
-        elif current_segment is not None:
-            if current_segment['text']:
-                current_segment['text'] += ' ' + line
-            else:
-                current_segment['text'] = line
-
-    # Add the last segment if exists
-    if current_segment:
-        segments.append(current_segment)
-    
-    return segments
-
-# Add version check and initialization
-try:
-    print("Starting OpenAI initialization and version checks...")
-    
-    import pkg_resources
-    openai_version = pkg_resources.get_distribution('openai').version
-    print(f"Detected OpenAI version: {openai_version}")
-    
-    if not openai_version.startswith('0.28'):
-        print(f"Version mismatch: Found {openai_version}, need 0.28.x")
-        raise ImportError(f"OpenAI version {openai_version} is not compatible. Required version: 0.28.x")
-    print("✓ Version check passed")
-    
-    # Set API key if available
-    openai.api_key = os.getenv('OPENAI_API_KEY')
-    if not openai.api_key:
-        print("⚠️ OpenAI API key not found in environment - will need to be set before using OpenAI functions")
-    else:
-        print("✓ API key configured")
-    
-    print("OpenAI initialization completed successfully")
-        
-except Exception as e:
-    print(f"Critical initialization error: {str(e)}")
-    print(f"Error type: {type(e)}")
-    print("Available OpenAI attributes:", dir(openai))
-    raise
-
-def process_audio_segment(input_path, output_path, start_time, duration):
-    """Process a segment of the video to audio."""
-    try:
-        print(f"Processing segment: input={input_path}, output={output_path}, start={start_time}, duration={duration}")
-        print(f"Checking input file exists: {os.path.exists(input_path)}")
-        print(f"Input file size: {os.path.getsize(input_path) if os.path.exists(input_path) else 'file not found'}")
-        
-        stream = ffmpeg.input(input_path, ss=start_time, t=duration)
-        stream = ffmpeg.output(
-            stream,
-            output_path,
-            acodec='libmp3lame',
-            ac=1,  # Mono audio to reduce memory usage
-            ar='22050',  # Lower sample rate
-            audio_bitrate='64k',  # Lower bitrate
-            **{
-                'threads': 1,
-                'loglevel': 'info',
-                'f': 'mp3'
-            }
-        )
-        
-        # Get the ffmpeg command for logging
-        cmd = ffmpeg.compile(stream)
-        print(f"FFmpeg command: {' '.join(cmd)}")
-        
-        # Run with stderr capture
-        out, err = ffmpeg.run(stream, capture_stdout=True, capture_stderr=True)
-        print(f"FFmpeg stderr output: {err.decode() if err else 'None'}")
-        
-        # Verify output
-        if os.path.exists(output_path):
-            print(f"Output file created successfully. Size: {os.path.getsize(output_path)}")
-            return True
-        else:
-            print("Output file was not created")
-            return False
-            
-    except ffmpeg.Error as e:
-        print(f"FFmpeg error: {str(e)}")
-        print(f"FFmpeg stderr: {e.stderr.decode() if e.stderr else 'None'}")
-        return False
-    except Exception as e:
-        print(f"General error in process_audio_segment: {str(e)}")
-        print(f"Error type: {type(e)}")
-        return False
+    return [segment.to_dict() for segment in iter_segments(vtt_content.splitlines())]
 
-def get_video_duration(video_path):
-    """Get the duration of a video file."""
+@contextmanager
+def stage_timer(timings, stage, **attributes):
+    """Record the wall time of a pipeline stage in seconds, and trace it as a span."""
+    start = time.perf_counter()
     try:
-        probe = ffmpeg.probe(video_path)
-        duration = float(probe['streams'][0]['duration'])
-        return duration
-    except Exception as e:
-        print(f"Error getting video duration: {str(e)}")
-        return None
-
-def stream_blob_to_file(blob, destination_path, chunk_size=2*1024*1024):  # 2MB chunks
-    """Stream a blob to a file in chunks to minimize memory usage."""
-    with open(destination_path, 'wb') as f:
-        blob.download_to_file(f)
-
-def stream_file_to_blob(source_path, blob, chunk_size=2*1024*1024):  # 2MB chunks
-    """Stream a file to a blob in chunks to minimize memory usage."""
-    with open(source_path, 'rb') as f:
-        blob.upload_from_file(f)
-
-def get_process_memory():
-    """Get current process memory usage in MB."""
-    process = psutil.Process(os.getpid())
-    mem = process.memory_info()
-    return {
-        'rss': mem.rss / 1024 / 1024,  # Resident Set Size
-        'vms': mem.vms / 1024 / 1024,  # Virtual Memory Size
-        'shared': getattr(mem, 'shared', 0) / 1024 / 1024,  # Shared memory
-        'data': getattr(mem, 'data', 0) / 1024 / 1024  # Data segment memory
-    }
-
-def log_memory(label):
-    """Log current memory usage with a label."""
-    gc.collect()  # Force garbage collection
-    mem = get_process_memory()
-    print(f"MEMORY[{label}]:")
-    print(f"  RSS: {mem['rss']:.2f}MB")
-    print(f"  VMS: {mem['vms']:.2f}MB")
-    print(f"  Shared: {mem['shared']:.2f}MB")
-    print(f"  Data: {mem['data']:.2f}MB")
-    
-    # Log Python's memory allocator stats
-    import sys
-    print(f"  Python malloc stats:")
-    for key, value in sys.getallocators()[0].get_stats().items():
-        print(f"    {key}: {value}")
+        with span(stage, **attributes) as current:
+            yield current
+    finally:
+        timings[stage] = round(time.perf_counter() - start, 3)
+
+class NotFoundError(Exception):
+    """A document or file the requested work depends on does not exist."""
+
+class NoAudioError(Exception):
+    """The source video has no audio track to convert or transcribe."""
+
+def run_deduplicated(kind, video_id, work):
+    """Run work() under the video's lease for kind, waiting out any in-flight duplicate.
+
+    Results of calls that waited are marked "deduplicated" with the time spent waiting.
+    A holder turned away by admission control yields the lease, so a waiter,
+    possibly on an instance with room, runs the work rather than failing with it.
+    """
+    from services.admission import AdmissionRejected
+    from services.leases import run_exclusive
+
+    result, waited_seconds = run_exclusive(get_db(), kind, video_id, work, yield_on=(AdmissionRejected,))
+    if waited_seconds is not None:
+        result = {**result, "deduplicated": True, "waited_seconds": waited_seconds}
+    return result
+
+def convert_video(video_id, mode, max_workers=None, profile='default', previews=False, force=False,
+                  admission_wait=None):
+    """Convert a video's MP4 to audio in the given profile in storage and return a result summary.
+
+    With previews, the same download and ffmpeg run also produce the
+    thumbnail, keyframes and sprite sheet (services.previews). force
+    converts even when current output exists, e.g. after encoding settings
+    change. The download and transcode only start once the instance has
+    room for them (services.admission); admission_wait overrides how long
+    to queue for it. Shared by the convert_to_audio endpoint, the processing
+    pipeline and backfill.py.
+    """
+    import ffmpeg
+    from services import admission
+    from services.cache import find_cached_audio, get_source_fingerprint, is_audio_current, record_audio
+    from services.checkpoint import finalize_checkpointed, supports_profile, transcode_checkpointed
+    from services.converter import (
+        AUDIO_PROFILES,
+        audio_storage_path,
+        concat_segments,
+        extract_audio_single_pass,
+        extract_audio_streaming,
+        get_segment_concurrency,
+        transcode_segments,
+        transcode_segments_parallel,
+    )
+    from services.media_info import get_media_info, probe_file, save_media_info
+    from services.previews import PreviewPlan, extract_previews, previews_current, save_previews, upload_previews
+    from services.storage import (
+        is_streamable_mp4,
+        open_blob_reader,
+        staged_blob_writer,
+        stream_blob_to_file,
+        stream_file_to_blob,
+    )
+    from services.silence import TIME_MAP_KEY, TRIM_MIN_SILENCE_SECONDS, TRIM_NOISE, TimeMap, detect_silences
 
-@https_fn.on_request()
-def convert_to_audio(request: https_fn.Request) -> https_fn.Response:
-    """Convert MP4 video to MP3 audio."""
     temp_dir = None
+    ticket = None
+    timings = {}
     try:
         # Create a temporary directory for our files
         temp_dir = tempfile.mkdtemp(prefix='video_conversion_')
-        
-        # Get video_id from request
-        data = request.get_json()
-        video_id = data.get('video_id')
-        if not video_id:
-            return https_fn.Response(
-                response=json.dumps({"error": "No video_id provided"}),
-                status=400
-            )
-
-        # Check if audio file already exists
-        bucket = storage.bucket()
-        audio_path = f'audio/{video_id}.mp3'
-        audio_blob = bucket.blob(audio_path)
-        
-        if audio_blob.exists():
-            print(f"Audio file already exists at {audio_path}, skipping conversion")
-            return https_fn.Response(
-                response=json.dumps({
-                    "success": True,
-                    "audio_path": audio_path,
-                    "audio_size": audio_blob.size,
-                    "skipped_conversion": True
-                })
-            )
 
         # Get video document from Firestore
-        db = firestore.client()
+        db = get_db()
         video_doc = db.collection('videos').document(video_id).get()
         
         if not video_doc.exists:
-            return https_fn.Response(
-                response=json.dumps({"error": f"Video document {video_id} not found"}),
-                status=404
-            )
+            raise NotFoundError(f"Video document {video_id} not found")
             
         video_data = video_doc.to_dict()
         video_url = video_data.get('videoUrl')
         
         if not video_url:
-            return https_fn.Response(
-                response=json.dumps({"error": f"Video URL not found in document {video_id}"}),
-                status=404
-            )
+            raise NotFoundError(f"Video URL not found in document {video_id}")
 
         # Extract storage path from URL
         storage_path = video_url.split('/o/')[1].split('?')[0]
         storage_path = urllib.parse.unquote(storage_path)
 
         # Get video from storage
-        bucket = storage.bucket()
+        bucket = get_bucket()
         video_blob = bucket.blob(storage_path)
-        audio_blob = bucket.blob(f'audio/{video_id}.mp3')  # Simple path with just video ID
+        audio_path = audio_storage_path(video_id, profile)
+        settings = AUDIO_PROFILES[profile]
+        with stage_timer(timings, 'fingerprint'):
+            fingerprint = get_source_fingerprint(video_blob)
+
+            # Check if audio for this exact source already exists
+            existing_audio = bucket.get_blob(audio_path)
+        need_previews = previews and (force or not previews_current(video_data, fingerprint['generation']))
+        skipped = None  # Result when the audio needs no conversion
+        if existing_audio is not None:
+            if force:
+                print(f"Re-converting {audio_path} as requested")
+            elif is_audio_current(existing_audio, fingerprint):
+                print(f"Audio file already exists at {audio_path}, skipping conversion")
+                skipped = {
+                    "success": True,
+                    "audio_path": audio_path,
+                    "audio_size": existing_audio.size,
+                    "skipped_conversion": True
+                }
+            else:
+                print(f"Audio at {audio_path} is stale for generation {fingerprint['generation']}, re-converting")
+
+        if skipped is None and not force:
+            # Identical content uploaded under another video: copy instead of converting
+            with stage_timer(timings, 'cache_lookup'):
+                cached_audio = find_cached_audio(db, bucket, fingerprint, audio_path, profile)
+            if cached_audio is not None:
+                print(f"Reusing {cached_audio.name} for {audio_path} (source {fingerprint['key']})")
+                audio_blob = bucket.copy_blob(cached_audio, bucket, audio_path)
+                record_audio(db, audio_blob, fingerprint, video_id, profile)
+                skipped = {
+                    "success": True,
+                    "audio_path": audio_path,
+                    "audio_size": audio_blob.size,
+                    "skipped_conversion": True,
+                    "cache_hit": True
+                }
+        if skipped is not None and not need_previews:
+            return skipped
+
+        # Probed once per source generation; MP4s from their header alone, so a
+        # video without audio is turned away before anything is downloaded
+        with stage_timer(timings, 'probe') as stage:
+            media_info, probed_from = get_media_info(
+                db, video_id, video_data, video_blob, fingerprint['generation'], temp_dir
+            )
+            stage.set(source=probed_from)
+        if media_info is not None and not media_info['hasAudio']:
+            raise NoAudioError(f"Video {video_id} has no audio track")
+        if need_previews and media_info is not None and not media_info['videoCodec']:
+            print(f"Video {video_id} has no video stream, skipping previews")
+            need_previews = False
+            if skipped is not None:
+                return skipped
+
+        audio_blob = bucket.blob(audio_path)
+
+        if need_previews and mode == 'streaming':
+            # Previews decode the video from the downloaded file
+            mode = 'single_pass'
+        if mode == 'streaming':
+            streamable = media_info.get('faststart') if media_info else None
+            if streamable is None:
+                with stage_timer(timings, 'layout_check'):
+                    streamable = is_streamable_mp4(video_blob)
+            if not streamable:
+                # ffmpeg needs to seek to the trailing moov atom, which a pipe cannot do
+                print(f"{storage_path} is not faststart, falling back to single_pass")
+                mode = 'single_pass'
+        if mode == 'checkpointed' and not supports_profile(profile):
+            # Staged segments are joined by byte concatenation, which only some formats survive
+            print(f"Profile {profile} cannot be composed from segments, using parallel mode")
+            mode = 'parallel'
+        if settings['trim_silence'] and mode != 'single_pass':
+            print(f"Silence trimming needs single_pass mode, keeping pauses in {mode} mode")
+
+        # Wait for room on this instance before downloading or starting ffmpeg
+        cost = admission.estimate_cost(
+            mode, settings['bitrate'], media_info['duration'] if media_info else None, video_blob.size,
+            workers=get_segment_concurrency(max_workers) if mode in ('parallel', 'checkpointed') else 1,
+            previews=need_previews
+        )
+        with stage_timer(timings, 'admission', **cost.as_dict()) as stage:
+            try:
+                ticket, waited = admission.controller.acquire(
+                    cost, admission.MAX_WAIT_SECONDS if admission_wait is None else admission_wait
+                )
+            except admission.AdmissionRejected:
+                admission.record_metrics(db, 'rejected')
+                raise
+            stage.set(waited_ms=round(waited * 1000), queue_depth=admission.ADMISSION_STATS['queueDepth'])
+        if waited >= admission.POLL_SECONDS:
+            print(f"Conversion of video {video_id} waited {waited:.1f}s for room ({admission.ADMISSION_STATS})")
+            admission.record_metrics(db, 'delayed')
+
+        if mode == 'streaming':
+            # Download, transcode and upload overlap; nothing is written to tmpfs
+            with stage_timer(timings, 'stream') as stage:
+                with open_blob_reader(video_blob) as reader, \
+                        staged_blob_writer(audio_blob, settings['content_type']) as writer:
+                    bytes_in, audio_size = extract_audio_streaming(
+                        reader, writer, profile=profile, audio_index=media_info['audioIndex'] if media_info else 0
+                    )
+                stage.set(bytes_in=bytes_in, bytes_out=audio_size)
+            if audio_size == 0:
+                raise Exception("Audio file is empty")
+            with stage_timer(timings, 'firestore_write'):
+                record_audio(db, audio_blob, fingerprint, video_id, profile, {'audioProfile': profile})
+            return {
+                "success": True,
+                "audio_path": audio_path,
+                "audio_size": audio_size,
+                "mode": mode,
+                "profile": profile,
+                "stream_copy": False,
+                "timings": timings
+            }
 
         # Download video to temp file using streaming
         video_path = os.path.join(temp_dir, f'{video_id}.mp4')
-        stream_blob_to_file(video_blob, video_path)
+        with stage_timer(timings, 'download', bytes=video_blob.size):
+            stream_blob_to_file(video_blob, video_path)
+
+        if media_info is None:
+            # Not something the header probe understands: probe the downloaded file
+            with stage_timer(timings, 'probe_file'):
+                media_info = save_media_info(db, video_id, probe_file(video_path), fingerprint['generation'])
+            if not media_info['hasAudio']:
+                raise NoAudioError(f"Video {video_id} has no audio track")
+            if need_previews and not media_info['videoCodec']:
+                print(f"Video {video_id} has no video stream, skipping previews")
+                need_previews = False
+                if skipped is not None:
+                    return skipped
+
+        preview_plan = PreviewPlan(os.path.join(temp_dir, 'previews'), media_info['duration']) if need_previews else None
+
+        def publish_previews():
+            with stage_timer(timings, 'previews_upload'):
+                summary = upload_previews(bucket, video_id, preview_plan)
+                save_previews(db, video_id, video_data, summary, fingerprint['generation'])
+            return {"thumbnail_path": summary['thumbnailPath'], "keyframes": len(summary['keyframes'])}
+
+        if skipped is not None:
+            # Only the previews were missing
+            with stage_timer(timings, 'previews'):
+                extract_previews(video_path, preview_plan)
+            return {**skipped, "previews": publish_previews(), "timings": timings}
 
         try:
-            # Get video duration
-            duration = get_video_duration(video_path)
-            if not duration:
-                raise Exception("Could not determine video duration")
-
-            # Process video in shorter segments to reduce memory usage
-            segment_duration = 15  # Reduced from 30 to 15 seconds
-            segments = []
-            
-            # Create segments directory
-            segments_dir = os.path.join(temp_dir, 'segments')
-            os.makedirs(segments_dir)
-            
-            # Process each segment
-            for start_time in range(0, int(duration), segment_duration):
-                segment_path = os.path.join(segments_dir, f'segment_{start_time}.mp3')
-                if process_audio_segment(video_path, segment_path, start_time, segment_duration):
-                    segments.append(segment_path)
+            audio_path = os.path.join(temp_dir, f"{video_id}.{settings['extension']}")
+            stream_copy = False
+            time_map = None
+            resumed = None
+
+            duration = media_info['duration']
+            if mode == 'single_pass':
+                # Decode the audio track once, copying it when the codec allows
+                if settings['trim_silence']:
+                    with stage_timer(timings, 'silence_detect') as stage:
+                        silences = detect_silences(video_path, TRIM_NOISE, TRIM_MIN_SILENCE_SECONDS)
+                        time_map = TimeMap.plan(silences, duration) if duration else None
+                        stage.set(silences=len(silences),
+                                  trimmed_ms=round(duration * 1000) - time_map.trimmed_ms if time_map else 0)
+                with stage_timer(timings, 'extract', profile=profile, previews=need_previews):
+                    try:
+                        stream_copy = extract_audio_single_pass(
+                            video_path, audio_path, media_info['audioCodec'], profile=profile, time_map=time_map,
+                            audio_index=media_info['audioIndex'], previews=preview_plan
+                        )
+                    except Exception as e:
+                        if preview_plan is None:
+                            raise
+                        # A video stream ffmpeg cannot decode must not cost the audio
+                        print(f"Extraction with previews failed, retrying audio only: {str(e)}")
+                        need_previews = False
+                        stream_copy = extract_audio_single_pass(
+                            video_path, audio_path, media_info['audioCodec'], profile=profile, time_map=time_map,
+                            audio_index=media_info['audioIndex']
+                        )
+            else:
+                if not duration:
+                    raise Exception("Could not determine video duration")
+                if need_previews:
+                    # Segments each decode a slice of the audio only; previews get their own run
+                    try:
+                        with stage_timer(timings, 'previews'):
+                            extract_previews(video_path, preview_plan)
+                    except Exception as e:
+                        print(f"Preview extraction failed, converting audio only: {str(e)}")
+                        need_previews = False
+
+                # Process video in shorter segments to reduce memory usage
+                segments_dir = os.path.join(temp_dir, 'segments')
+                os.makedirs(segments_dir)
+                if mode == 'checkpointed':
+                    # Finished segments are staged in Storage, so a retry picks up where this one stops
+                    with stage_timer(timings, 'transcode', mode=mode, duration_seconds=duration):
+                        staged, resumed = transcode_checkpointed(
+                            db, bucket, video_path, segments_dir, video_id, profile, fingerprint['generation'],
+                            duration, max_workers=max_workers, audio_index=media_info['audioIndex']
+                        )
+                    with stage_timer(timings, 'compose', segments=len(staged)):
+                        finalize_checkpointed(db, bucket, staged, audio_blob, video_id, profile,
+                                              fingerprint['generation'])
                 else:
-                    raise Exception(f"Failed to process segment at {start_time} seconds")
-
-            # Concatenate segments
-            audio_path = os.path.join(temp_dir, f'{video_id}.mp3')
-            with open(os.path.join(temp_dir, 'segments.txt'), 'w') as f:
-                for segment in segments:
-                    f.write(f"file '{segment}'\n")
-
-            # Use FFmpeg to concatenate with minimal memory usage
-            concat_cmd = [
-                'ffmpeg', '-f', 'concat', '-safe', '0',
-                '-i', os.path.join(temp_dir, 'segments.txt'),
-                '-c', 'copy', 
-                '-y',  # Overwrite output file
-                audio_path
-            ]
-            subprocess.run(concat_cmd, check=True)
-
-            # Verify the audio file exists and is valid
-            if not os.path.exists(audio_path):
-                raise Exception("Final audio file was not created")
-                
-            # Check file size
-            audio_size = os.path.getsize(audio_path)
-            print(f"Audio file size: {audio_size} bytes")
-            
-            if audio_size == 0:
-                raise Exception("Audio file is empty")
-            
-            # Set proper content type for the audio blob
-            audio_blob.content_type = 'audio/mpeg'
-            
-            # Upload audio file using streaming
-            print(f"Starting upload of audio file to {audio_blob.name}")
-            stream_file_to_blob(audio_path, audio_blob)
-            print(f"Successfully uploaded audio file to {audio_blob.name}")
+                    with stage_timer(timings, 'transcode', mode=mode, duration_seconds=duration):
+                        if mode == 'parallel':
+                            segments = transcode_segments_parallel(
+                                video_path, segments_dir, duration,
+                                max_workers=max_workers, profile=profile, audio_index=media_info['audioIndex']
+                            )
+                        else:
+                            segments = transcode_segments(
+                                video_path, segments_dir, duration, profile=profile,
+                                audio_index=media_info['audioIndex']
+                            )
+
+                    # Concatenate segments
+                    with stage_timer(timings, 'concat', segments=len(segments)):
+                        concat_segments(segments, os.path.join(temp_dir, 'segments.txt'), audio_path)
+
+            if mode == 'checkpointed':
+                # Composed in place from the staged segments
+                audio_size = audio_blob.size
+                if not audio_size:
+                    raise Exception("Audio file is empty")
+            else:
+                # Verify the audio file exists and is valid
+                if not os.path.exists(audio_path):
+                    raise Exception("Final audio file was not created")
+
+                # Check file size
+                audio_size = os.path.getsize(audio_path)
+                if audio_size == 0:
+                    raise Exception("Audio file is empty")
 
-            # Verify the upload
-            if not audio_blob.exists():
-                raise Exception("Audio file failed to upload to storage")
+                # Set proper content type for the audio blob
+                audio_blob.content_type = settings['content_type']
+
+                # Upload audio file using streaming
+                with stage_timer(timings, 'upload', bytes=audio_size):
+                    stream_file_to_blob(audio_path, audio_blob)
+
+                    # Verify the upload
+                    if not audio_blob.exists():
+                        raise Exception("Audio file failed to upload to storage")
+            metadata = {'audioProfile': profile}
+            if time_map is not None:
+                metadata[TIME_MAP_KEY] = time_map.encode()
+            with stage_timer(timings, 'firestore_write'):
+                record_audio(db, audio_blob, fingerprint, video_id, profile, metadata)
 
             # Instead of signed URL, return the storage path
-            audio_path = f"audio/{video_id}.mp3"
-            
-            return https_fn.Response(
-                response=json.dumps({
-                    "success": True,
-                    "audio_path": audio_path,
-                    "audio_size": audio_size
-                })
-            )
+            result = {
+                "success": True,
+                "audio_path": audio_blob.name,
+                "audio_size": audio_size,
+                "mode": mode,
+                "profile": profile,
+                "stream_copy": stream_copy,
+                "silence_trimmed": time_map is not None,
+                "timings": timings
+            }
+            if resumed is not None:
+                result["resumed_segments"] = resumed
+            if need_previews:
+                result["previews"] = publish_previews()
+            return result
         except ffmpeg.Error as e:
             print(f"FFmpeg error output: {e.stderr.decode() if e.stderr else str(e)}")
             raise Exception(f"FFmpeg conversion failed: {str(e)}")
         except Exception as e:
             print(f"Error during audio processing: {str(e)}")
             raise
+    finally:
+        # Clean up temporary directory and all its contents
+        if temp_dir and os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        if ticket is not None:
+            admission.controller.release(ticket)
+
+@https_fn.on_request()
+def convert_to_audio(request: https_fn.Request) -> https_fn.Response:
+    """Convert MP4 video to audio (MP3 unless another profile is requested)."""
+    from services.admission import ADMISSION_STATS, AdmissionRejected
+    from services.converter import get_audio_profile, get_extraction_mode
+
+    try:
+        # Get video_id from request
+        data = request.get_json()
+        video_id = data.get('video_id')
+        if not video_id:
+            return https_fn.Response(
+                response=json.dumps({"error": "No video_id provided"}),
+                status=400
+            )
+
+        # Extraction mode can be overridden per request to compare paths
+        try:
+            mode = get_extraction_mode(data.get('mode'))
+            profile = get_audio_profile(data.get('profile'))
+        except ValueError as e:
+            return https_fn.Response(
+                response=json.dumps({"error": str(e)}),
+                status=400
+            )
+
+        max_workers = data.get('max_workers')
+        previews = bool(data.get('previews'))
+        with trace('convert_to_audio', video_id=video_id, mode=mode, profile=profile, previews=previews):
+            result = run_deduplicated('convert', video_id, lambda: convert_video(
+                video_id, mode, max_workers=int(max_workers) if max_workers else None, profile=profile,
+                previews=previews
+            ))
+        return https_fn.Response(response=json.dumps(result))
+    except NotFoundError as e:
+        return https_fn.Response(
+            response=json.dumps({"error": str(e)}),
+            status=404
+        )
+    except NoAudioError as e:
+        return https_fn.Response(
+            response=json.dumps({"error": str(e), "no_audio": True}),
+            status=422
+        )
+    except AdmissionRejected as e:
+        print(f"Rejected conversion: {str(e)} ({ADMISSION_STATS})")
+        return https_fn.Response(
+            response=json.dumps({
+                "error": str(e),
+                "retry_after": e.retry_after,
+                "queue_depth": ADMISSION_STATS['queueDepth'],
+                "rejected": ADMISSION_STATS['rejected'],
+            }),
+            status=503,
+            headers={"Content-Type": "application/json", "Retry-After": str(e.retry_after)}
+        )
     except Exception as e:
         return https_fn.Response(
             response=json.dumps({"error": str(e)}),
             status=500
         )
-    finally:
-        # Clean up temporary directory and all its contents
-        if temp_dir and os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir, ignore_errors=True)
 
 @https_fn.on_request()
 def test(request: https_fn.Request) -> https_fn.Response:
@@ -344,141 +473,359 @@ def test(request: https_fn.Request) -> https_fn.Response:
         headers={"Content-Type": "application/json"}
     )
 
-@https_fn.on_request()
-def create_transcript(request: https_fn.Request) -> https_fn.Response:
-    """Create transcript from MP3 using OpenAI Whisper."""
+def transcribe_video(video_id, force=False):
+    """Create a video's transcript from its audio using OpenAI Whisper; returns a result summary.
+
+    force transcribes even when a current transcript, or one of identical
+    audio, exists, e.g. after a Whisper or parsing change. Shared by the
+    create_transcript endpoint, the processing pipeline and backfill.py.
+    """
+    from firebase_admin import firestore
+    from services.cache import (
+        find_cached_transcript,
+        get_audio_source_hash,
+        is_transcript_current,
+        record_transcript,
+    )
+    from services.converter import TRANSCRIPTION_PROFILES, audio_storage_path
+    from services.search_index import index_transcript
+    from services.silence import TIME_MAP_KEY, TimeMap
+    from services.transcriber import transcribe_audio
+    from services.transcript_store import load_content, load_header, load_segments, save_transcript
+
     temp_dir = None
     try:
         # Create temporary directory
         temp_dir = tempfile.mkdtemp(prefix='transcription_')
-        
-        # Get video_id from request
-        data = request.get_json()
-        video_id = data.get('video_id')
-        if not video_id:
-            return https_fn.Response(
-                response=json.dumps({"error": "No video_id provided"}),
-                status=400
-            )
 
-        # Check if transcript already exists in Firestore
-        db = firestore.client()
-        transcript_ref = db.collection('transcripts').document(video_id)
-        transcript_doc = transcript_ref.get()
+        # Get audio file metadata from storage, preferring the smallest profile
+        bucket = get_bucket()
+        for profile in TRANSCRIPTION_PROFILES:
+            audio_path = audio_storage_path(video_id, profile)
+            audio_blob = bucket.get_blob(audio_path)
+            if audio_blob is not None:
+                break
+
+        # Check if a transcript of the current audio already exists in Firestore
+        db = get_db()
+        previous = transcript_data = load_header(db, video_id)
         
-        if transcript_doc.exists:
+        if transcript_data and force:
+            print(f"Re-transcribing video {video_id} as requested")
+            transcript_data = None
+        elif transcript_data and audio_blob is not None and not is_transcript_current(transcript_data, audio_blob):
+            print(f"Transcript for video {video_id} is stale, re-transcribing")
+            transcript_data = None
+
+        if transcript_data:
             print(f"Transcript already exists for video {video_id}")
-            transcript_data = transcript_doc.to_dict()
-            return https_fn.Response(
-                response=json.dumps({
-                    "success": True,
-                    "transcript": {
-                        "content": transcript_data.get('content'),
-                        "videoId": video_id,
-                        "audioFileSize": transcript_data.get('audioFileSize'),
-                        "transcriptLength": transcript_data.get('transcriptLength')
-                    },
-                    "skipped_transcription": True
-                })
-            )
+            return {
+                "success": True,
+                "transcript": {
+                    "content": load_content(db, video_id, transcript_data),
+                    "videoId": video_id,
+                    "audioFileSize": transcript_data.get('audioFileSize'),
+                    "transcriptLength": transcript_data.get('transcriptLength'),
+                    "segmentCount": transcript_data.get('segmentCount', len(transcript_data.get('segments') or []))
+                },
+                "skipped_transcription": True
+            }
 
-        # Get audio file from storage
-        bucket = storage.bucket()
-        audio_path = f'audio/{video_id}.mp3'
-        audio_blob = bucket.blob(audio_path)
-        
-        if not audio_blob.exists():
-            return https_fn.Response(
-                response=json.dumps({"error": f"Audio file not found: {audio_path}"}),
-                status=404
-            )
+        if audio_blob is None:
+            raise NotFoundError(f"Audio file not found: {audio_storage_path(video_id)}")
 
-        # Reload blob to get latest metadata
-        audio_blob.reload()
+        # Identical audio was already transcribed for another video: copy it
+        source_hash = get_audio_source_hash(audio_blob)
+        cached_transcript = None if force else find_cached_transcript(db, source_hash, video_id)
+        if cached_transcript:
+            print(f"Reusing transcript of video {cached_transcript.get('videoId')} (source {source_hash})")
+            segments = load_segments(db, cached_transcript.get('videoId'), cached_transcript) or []
+            header = save_transcript(db, video_id, segments, {
+                'createdAt': firestore.SERVER_TIMESTAMP,
+                'audioFileSize': cached_transcript.get('audioFileSize'),
+                'transcriptLength': cached_transcript.get('transcriptLength'),
+                'sourceHash': source_hash,
+            }, previous=previous)
+            index_transcript(db, video_id, segments, header)
+            return {
+                "success": True,
+                "transcript": {
+                    "content": ' '.join(segment['text'] for segment in segments),
+                    "segments": segments,
+                    "videoId": video_id,
+                    "audioFileSize": cached_transcript.get('audioFileSize'),
+                    "transcriptLength": cached_transcript.get('transcriptLength'),
+                    "segmentCount": len(segments)
+                },
+                "skipped_transcription": True,
+                "cache_hit": True
+            }
         
         # Get file size before downloading
         file_size = audio_blob.size
-        print(f"Audio file size: {file_size} bytes ({file_size/1024/1024:.2f}MB)")
         
         # Download audio to temp file using streaming
-        audio_file_path = os.path.join(temp_dir, f'{video_id}.mp3')
-        
-        # Stream download in chunks
-        chunk_size = 1024 * 1024  # 1MB chunks
-        with open(audio_file_path, 'wb') as f:
-            audio_blob.download_to_file(f)
-            f.flush()
-            os.fsync(f.fileno())  # Ensure all data is written to disk
+        audio_file_path = os.path.join(temp_dir, os.path.basename(audio_path))
+        with span('download', bytes=file_size):
+            with open(audio_file_path, 'wb') as f:
+                audio_blob.download_to_file(f)
+                f.flush()
+                os.fsync(f.fileno())  # Ensure all data is written to disk
         
         # Verify downloaded file size
         downloaded_size = os.path.getsize(audio_file_path)
-        print(f"Downloaded file size: {downloaded_size} bytes ({downloaded_size/1024/1024:.2f}MB)")
-        
         if downloaded_size != file_size:
             raise Exception(f"File size mismatch. Expected: {file_size}, Got: {downloaded_size}")
         
-        print("Starting OpenAI transcription...")
-        
-        # Open and send to Whisper API directly
-        with open(audio_file_path, 'rb') as audio_file:
-            response = openai.Audio.transcribe(
-                model="whisper-1",
-                file=audio_file,
-                response_format="vtt",
-                timestamp_granularities=["word", "segment"]
-            )
-        print("OpenAI transcription completed")
+        # Long audio is split on silences and transcribed in parallel chunks
+        with span('whisper', bytes=file_size) as stage:
+            response, chunk_count = transcribe_audio(get_openai(), audio_file_path, temp_dir)
+            stage.set(chunks=chunk_count)
         
         # Parse VTT content to get segments with timestamps
-        segments = parse_vtt(response)
+        with span('parse', bytes=len(response)) as stage:
+            segments = parse_vtt(response)
+            stage.set(segments=len(segments))
+
+        # Audio with pauses cut out: put cue times back on the video's timeline
+        time_map = TimeMap.decode((audio_blob.metadata or {}).get(TIME_MAP_KEY))
+        if time_map is not None:
+            with span('time_map', intervals=len(time_map.intervals)):
+                segments = time_map.restore_segments(segments)
         
         # Extract full text content from segments
         full_text = ' '.join(segment['text'] for segment in segments)
-        
-        # Get transcript length for logging
         transcript_length = len(full_text) if full_text else 0
-        print(f"Transcript length: {transcript_length} characters")
-        print(f"Number of segments: {len(segments)}")
-        print(f"First few segments: {segments[:2]}")  # Log first few segments for debugging
-
-        # Save transcript to Firestore
-        transcript_ref.set({
-            'content': full_text,
-            'segments': segments,  # Make sure segments are included
-            'videoId': video_id,
-            'createdAt': firestore.SERVER_TIMESTAMP,
-            'audioFileSize': file_size,
-            'transcriptLength': transcript_length
-        })
+
+        # Save transcript to Firestore: a header plus the segments in time-window pages
+        with span('firestore_write', segments=len(segments)) as stage:
+            header = save_transcript(db, video_id, segments, {
+                'createdAt': firestore.SERVER_TIMESTAMP,
+                'audioFileSize': file_size,
+                'transcriptLength': transcript_length,
+                'sourceHash': source_hash
+            }, previous=previous)
+            stage.set(pages=header['pageCount'])
+            record_transcript(db, source_hash, video_id)
+
+        # Build the search index while the segments are in memory
+        with span('index'):
+            index_transcript(db, video_id, segments, header)
+
+        return {
+            "success": True,
+            "transcript": {
+                "content": full_text,
+                "segments": segments,
+                "videoId": video_id,
+                "audioFileSize": file_size,
+                "transcriptLength": transcript_length,
+                "segmentCount": len(segments)
+            }
+        }
+    finally:
+        # Clean up
+        if temp_dir and os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+@https_fn.on_request()
+def create_transcript(request: https_fn.Request) -> https_fn.Response:
+    """Create transcript from MP3 using OpenAI Whisper."""
+    try:
+        # Get video_id from request
+        data = request.get_json()
+        video_id = data.get('video_id')
+        if not video_id:
+            return https_fn.Response(
+                response=json.dumps({"error": "No video_id provided"}),
+                status=400
+            )
+
+        with trace('create_transcript', video_id=video_id):
+            result = run_deduplicated('transcribe', video_id, lambda: transcribe_video(video_id))
+        # Segments are read a window at a time from get_transcript_range unless asked for
+        if not data.get('include_segments'):
+            result = {**result, "transcript": {
+                key: value for key, value in result['transcript'].items() if key != 'segments'
+            }}
+        return https_fn.Response(response=json.dumps(result))
+    except NotFoundError as e:
+        return https_fn.Response(
+            response=json.dumps({"error": str(e)}),
+            status=404
+        )
+    except Exception as e:
+        print(f"Error in create_transcript: {str(e)}")
+        print(f"Error type: {type(e)}")
+        return https_fn.Response(
+            response=json.dumps({"error": str(e)}),
+            status=500
+        )
+
+@https_fn.on_request()
+def search_transcript(request: https_fn.Request) -> https_fn.Response:
+    """Search one video's transcript, or find the segment playing at a timestamp."""
+    from services.search_index import lookup
+
+    try:
+        started = time.perf_counter()
+        data = request.get_json(silent=True) or request.args
+        video_id = data.get('video_id')
+        query = data.get('q', '')
+        at_ms = data.get('at_ms')
+        if not video_id:
+            return https_fn.Response(
+                response=json.dumps({"error": "No video_id provided"}),
+                status=400
+            )
+        if not query and at_ms is None:
+            return https_fn.Response(
+                response=json.dumps({"error": "Provide a query 'q' or a timestamp 'at_ms'"}),
+                status=400
+            )
+        try:
+            at_ms = int(at_ms) if at_ms is not None else None
+            limit = int(data.get('limit', 50))
+        except (TypeError, ValueError):
+            return https_fn.Response(
+                response=json.dumps({"error": "at_ms and limit must be integers"}),
+                status=400
+            )
+        if limit < 0:
+            return https_fn.Response(
+                response=json.dumps({"error": "limit must not be negative"}),
+                status=400
+            )
+
+        found = lookup(get_db(), video_id, query=query, at_ms=at_ms, limit=limit)
+        if found is None:
+            return https_fn.Response(
+                response=json.dumps({"error": f"Transcript not found for video {video_id}"}),
+                status=404
+            )
+
+        result = {"success": True, "videoId": video_id, **found}
+        result["took_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+        return https_fn.Response(
+            response=json.dumps(result),
+            headers={"Content-Type": "application/json"}
+        )
+    except Exception as e:
+        print(f"Error in search_transcript: {str(e)}")
+        return https_fn.Response(
+            response=json.dumps({"error": str(e)}),
+            status=500
+        )
+
+@https_fn.on_request()
+def get_transcript_range(request: https_fn.Request) -> https_fn.Response:
+    """Segments of a video's transcript overlapping [start_ms, end_ms), reading only the pages that cover it."""
+    from services.transcript_store import load_segments
+
+    try:
+        started = time.perf_counter()
+        data = request.get_json(silent=True) or request.args
+        video_id = data.get('video_id')
+        if not video_id:
+            return https_fn.Response(
+                response=json.dumps({"error": "No video_id provided"}),
+                status=400
+            )
+        try:
+            start_ms = int(data['start_ms']) if data.get('start_ms') is not None else None
+            end_ms = int(data['end_ms']) if data.get('end_ms') is not None else None
+        except ValueError:
+            return https_fn.Response(
+                response=json.dumps({"error": "start_ms and end_ms must be integers"}),
+                status=400
+            )
+        if start_ms is not None and end_ms is not None and end_ms <= start_ms:
+            return https_fn.Response(
+                response=json.dumps({"error": "end_ms must be greater than start_ms"}),
+                status=400
+            )
+
+        segments = load_segments(get_db(), video_id, start_ms=start_ms, end_ms=end_ms)
+        if segments is None:
+            return https_fn.Response(
+                response=json.dumps({"error": f"Transcript not found for video {video_id}"}),
+                status=404
+            )
 
         return https_fn.Response(
             response=json.dumps({
                 "success": True,
-                "transcript": {
-                    "content": full_text,
-                    "segments": segments,  # Include segments in response
-                    "videoId": video_id,
-                    "audioFileSize": file_size,
-                    "transcriptLength": transcript_length
-                }
-            })
+                "videoId": video_id,
+                "startMs": start_ms,
+                "endMs": end_ms,
+                "segments": segments,
+                "took_ms": round((time.perf_counter() - started) * 1000, 2),
+            }),
+            headers={"Content-Type": "application/json"}
         )
+    except Exception as e:
+        print(f"Error in get_transcript_range: {str(e)}")
+        return https_fn.Response(
+            response=json.dumps({"error": str(e)}),
+            status=500
+        )
+
+@https_fn.on_request()
+def search_transcripts(request: https_fn.Request) -> https_fn.Response:
+    """Rank videos across all transcripts for a query (BM25 over the published index)."""
+    from services.fulltext import load_shared_index
 
+    try:
+        started = time.perf_counter()
+        data = request.get_json(silent=True) or request.args
+        query = data.get('q', '')
+        if not query:
+            return https_fn.Response(
+                response=json.dumps({"error": "No query 'q' provided"}),
+                status=400
+            )
+        try:
+            limit = int(data.get('limit', 20))
+        except (TypeError, ValueError):
+            return https_fn.Response(
+                response=json.dumps({"error": "limit must be an integer"}),
+                status=400
+            )
+        if limit < 0:
+            return https_fn.Response(
+                response=json.dumps({"error": "limit must not be negative"}),
+                status=400
+            )
+
+        index = load_shared_index(get_bucket())
+        if index is None:
+            return https_fn.Response(
+                response=json.dumps({"error": "Search index has not been built yet"}),
+                status=503
+            )
+
+        hits = index.search(query, limit=limit)
+        return https_fn.Response(
+            response=json.dumps({
+                "success": True,
+                "hits": hits,
+                "took_ms": round((time.perf_counter() - started) * 1000, 2)
+            }),
+            headers={"Content-Type": "application/json"}
+        )
     except Exception as e:
-        print(f"Error in create_transcript: {str(e)}")
-        print(f"Error type: {type(e)}")
+        print(f"Error in search_transcripts: {str(e)}")
         return https_fn.Response(
             response=json.dumps({"error": str(e)}),
             status=500
         )
-    finally:
-        # Clean up
-        if temp_dir and os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir, ignore_errors=True)
 
 @https_fn.on_request()
 def generate_info_card(request: https_fn.Request) -> https_fn.Response:
     """Generate title and description for an info card based on a transcript."""
+    from services.info_cards import generate_info_cards
+
     try:
         # Get transcript from request
         data = request.get_json()
@@ -491,70 +838,30 @@ def generate_info_card(request: https_fn.Request) -> https_fn.Response:
             )
 
         print("Starting OpenAI title and description generation...")
-
-        # Create the prompt for GPT-3.5
-        prompt = f"""Based on the following transcript, generate a title and description for a video info card.
-        Keep the title under 100 characters and the description under 500 characters.
-        Format the response as JSON with 'title' and 'description' fields.
-        
-        Transcript:
-        {transcript}"""
-
-        # Call OpenAI API
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that generates concise and engaging video titles and descriptions."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens=300
-        )
-        print("OpenAI generation completed")
-
-        # Parse the response
-        try:
-            content = response.choices[0].message.content
-            info_card = json.loads(content)
-            
-            # Validate the response format
-            if not isinstance(info_card, dict) or 'title' not in info_card or 'description' not in info_card:
-                raise ValueError("Invalid response format")
-                
+        with trace('generate_info_card', video_id=data.get('video_id')):
+            results, _ = generate_info_cards(
+                get_db(), get_openai(), [{'videoId': data.get('video_id'), 'transcript': transcript}]
+            )
+        card = results[0]
+        if 'error' in card:
             return https_fn.Response(
-                response=json.dumps({
-                    "success": True,
-                    "title": info_card['title'],
-                    "description": info_card['description']
-                }),
-                status=200
+                response=json.dumps({"error": f"Failed to generate info card: {card['error']}"}),
+                status=502
             )
-            
-        except (json.JSONDecodeError, ValueError) as e:
-            # If JSON parsing fails, try to extract title and description using string manipulation
-            content = response.choices[0].message.content
-            try:
-                # Attempt to parse the content as a string
-                lines = content.split('\n')
-                title = next(line.split(': ', 1)[1].strip(' "\'') for line in lines if 'title' in line.lower())
-                description = next(line.split(': ', 1)[1].strip(' "\'') for line in lines if 'description' in line.lower())
-                
-                return https_fn.Response(
-                    response=json.dumps({
-                        "success": True,
-                        "title": title,
-                        "description": description
-                    }),
-                    status=200
-                )
-            except Exception as inner_e:
-                return https_fn.Response(
-                    response=json.dumps({
-                        "error": f"Failed to parse OpenAI response: {str(inner_e)}",
-                        "raw_response": content
-                    }),
-                    status=500
-                )
+        print(f"OpenAI generation completed{' (cached)' if card['cached'] else ''}: "
+              f"{card['promptTokens']} transcript tokens, {card['tokensSaved']} saved by condensation")
+
+        return https_fn.Response(
+            response=json.dumps({
+                "success": True,
+                "title": card['title'],
+                "description": card['description'],
+                "cached": card['cached'],
+                "prompt_tokens": card['promptTokens'],
+                "tokens_saved": card['tokensSaved']
+            }),
+            status=200
+        )
                 
     except Exception as e:
         print(f"Error in generate_info_card: {str(e)}")
@@ -566,6 +873,180 @@ def generate_info_card(request: https_fn.Request) -> https_fn.Response:
             status=500
         )
 
+@https_fn.on_request()
+def generate_info_cards(request: https_fn.Request) -> https_fn.Response:
+    """Generate info cards for many videos at once, reusing cached cards.
+
+    Body: {"items": [{"video_id": ..., "transcript": ...}], "force": false}
+    or {"video_ids": [...]} to use the stored transcripts.
+    """
+    from services import info_cards
+
+    try:
+        started = time.perf_counter()
+        data = request.get_json(silent=True) or {}
+        items = [
+            {'videoId': item.get('video_id'), 'transcript': item.get('transcript')}
+            for item in data.get('items', [])
+        ] + [{'videoId': video_id, 'transcript': None} for video_id in data.get('video_ids', [])]
+
+        if not items:
+            return https_fn.Response(
+                response=json.dumps({"error": "Provide 'items' or 'video_ids'"}),
+                status=400
+            )
+        if len(items) > info_cards.MAX_BATCH_SIZE:
+            return https_fn.Response(
+                response=json.dumps({"error": f"At most {info_cards.MAX_BATCH_SIZE} items per request"}),
+                status=400
+            )
+        if any(not item['videoId'] and not item['transcript'] for item in items):
+            return https_fn.Response(
+                response=json.dumps({"error": "Every item needs a video_id or a transcript"}),
+                status=400
+            )
+
+        with trace('generate_info_cards', items=len(items)):
+            results, stats = info_cards.generate_info_cards(
+                get_db(), get_openai(), items, force=bool(data.get('force'))
+            )
+        print(f"Info card batch: {stats}")
+        return https_fn.Response(
+            response=json.dumps({
+                "success": stats['failed'] == 0,
+                "cards": results,
+                "stats": stats,
+                "took_ms": round((time.perf_counter() - started) * 1000, 2)
+            }),
+            status=200,
+            headers={"Content-Type": "application/json"}
+        )
+    except Exception as e:
+        print(f"Error in generate_info_cards: {str(e)}")
+        return https_fn.Response(
+            response=json.dumps({"error": f"Error generating info cards: {str(e)}"}),
+            status=500
+        )
+
+def run_pipeline_stage(video_id, stage):
+    """Run one pipeline stage for a video; returns the summary stored on its job."""
+    if stage == 'convert':
+        from services.converter import get_audio_profile, get_extraction_mode
+
+        # The pipeline's audio only feeds the transcript
+        profile = get_audio_profile(os.getenv('PIPELINE_AUDIO_PROFILE', 'transcription'))
+        # Thumbnails and keyframes come out of the same download and decode
+        previews = os.getenv('PIPELINE_PREVIEWS', '1') != '0'
+        # Nobody is waiting on a response, so queue for room longer than a request would
+        admission_wait = float(os.getenv('PIPELINE_ADMISSION_WAIT_SECONDS', '300'))
+        result = run_deduplicated('convert', video_id, lambda: convert_video(
+            video_id, get_extraction_mode(None), profile=profile, previews=previews, admission_wait=admission_wait
+        ))
+        return {key: result[key] for key in ('audio_path', 'audio_size', 'mode', 'profile', 'silence_trimmed',
+                                             'skipped_conversion', 'cache_hit', 'deduplicated', 'previews')
+                if key in result}
+    if stage == 'transcribe':
+        result = run_deduplicated('transcribe', video_id, lambda: transcribe_video(video_id))
+        return {
+            'segmentCount': result['transcript'].get('segmentCount'),
+            'transcriptLength': result['transcript'].get('transcriptLength'),
+            'skippedTranscription': result.get('skipped_transcription', False),
+            'deduplicated': result.get('deduplicated', False),
+        }
+    if stage == 'info_card':
+        from services import info_cards
+        results, _ = info_cards.generate_info_cards(get_db(), get_openai(), [{'videoId': video_id, 'transcript': None}])
+        card = results[0]
+        if 'error' in card:
+            raise Exception(card['error'])
+        return {'title': card['title'], 'description': card['description'], 'cached': card['cached']}
+    raise ValueError(f"Unknown pipeline stage: {stage}")
+
+@firestore_fn.on_document_created(document="videos/{videoId}")
+def on_video_created(event: firestore_fn.Event[firestore_fn.DocumentSnapshot | None]) -> None:
+    """Queue processing for a newly uploaded video.
+
+    The app writes the video document once the storage upload has finished,
+    and it is the first point at which the video id exists.
+    """
+    from services.jobs import enqueue_job
+
+    video_id = event.params['videoId']
+    if event.data is None or not (event.data.to_dict() or {}).get('videoUrl'):
+        print(f"Video {video_id} has no videoUrl, not queuing processing")
+        return
+    enqueue_job(get_db(), video_id)
+    print(f"Queued processing for video {video_id}")
+
+@firestore_fn.on_document_written(
+    document="processing_jobs/{videoId}",
+    memory=options.MemoryOption.GB_2,
+    timeout_sec=540
+)
+def process_job(event: firestore_fn.Event[firestore_fn.Change[firestore_fn.DocumentSnapshot | None]]) -> None:
+    """Run the stage a processing job has just queued; finishing it queues the next."""
+    from services import jobs
+
+    before = event.data.before.to_dict() if event.data.before else None
+    after = event.data.after.to_dict() if event.data.after else None
+    if not jobs.became_queued(before, after):
+        return
+
+    video_id = event.params['videoId']
+    stage = after['stage']
+    db = get_db()
+    print(f"Starting {stage} for video {video_id}")
+    started = jobs.start_stage(db, video_id, stage)
+    try:
+        with trace(f'pipeline.{stage}', video_id=video_id):
+            result = run_pipeline_stage(video_id, stage)
+    except Exception as e:
+        print(f"Error in {stage} for video {video_id}: {str(e)}")
+        jobs.fail_stage(db, video_id, stage, started, e)
+        return
+    jobs.complete_stage(db, video_id, stage, started, result)
+    print(f"Finished {stage} for video {video_id}")
+
+@https_fn.on_request()
+def retry_job(request: https_fn.Request) -> https_fn.Response:
+    """Re-queue a video's processing job, from a given stage or the one that failed."""
+    from services import jobs
+
+    try:
+        data = request.get_json(silent=True) or {}
+        video_id = data.get('video_id')
+        if not video_id:
+            return https_fn.Response(
+                response=json.dumps({"error": "No video_id provided"}),
+                status=400
+            )
+
+        db = get_db()
+        job_doc = jobs.job_ref(db, video_id).get()
+        stage = data.get('stage') or (job_doc.get('stage') if job_doc.exists else jobs.STAGES[0])
+        if stage not in jobs.STAGES:
+            return https_fn.Response(
+                response=json.dumps({"error": f"Unknown stage '{stage}'. Expected one of: {', '.join(jobs.STAGES)}"}),
+                status=400
+            )
+        if job_doc.exists and job_doc.get('status') in (jobs.QUEUED, jobs.RUNNING) and not data.get('stage'):
+            return https_fn.Response(
+                response=json.dumps({"error": f"Job for {video_id} is already {job_doc.get('status')}"}),
+                status=409
+            )
+
+        jobs.enqueue_job(db, video_id, stage)
+        return https_fn.Response(
+            response=json.dumps({"success": True, "videoId": video_id, "stage": stage}),
+            headers={"Content-Type": "application/json"}
+        )
+    except Exception as e:
+        print(f"Error in retry_job: {str(e)}")
+        return https_fn.Response(
+            response=json.dumps({"error": str(e)}),
+            status=500
+        )
+
 if __name__ == "__main__":
     from functions_framework import create_app
     target_function = os.environ.get("FUNCTION_TARGET", "convert_to_audio")
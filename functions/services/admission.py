@@ -0,0 +1,193 @@
+"""Per-instance admission control for conversions.
+
+Concurrent requests on one instance each start ffmpeg and fill /tmp,
+which is memory-backed in Cloud Functions. Enough of them at once and the
+instance runs out of memory, taking every in-flight request with it.
+convert_video therefore asks the instance's controller for room before it
+downloads or transcodes anything.
+
+A job's cost is estimated from the source size and duration, the
+extraction mode and the audio profile (estimate_cost). A job is admitted
+when the live psutil/cgroup reading of free memory, minus what recently
+admitted jobs have not allocated yet, minus MEMORY_RESERVE_MB, still
+covers it, and the CPUs are not saturated. Otherwise it waits in a FIFO
+queue. A job that cannot get in within its wait budget, or that finds
+the queue full, is rejected with AdmissionRejected. That exception
+carries a retry-after estimate, which the endpoint turns into a 503 with
+Retry-After.
+
+ADMISSION_STATS holds the instance's counters and queue depth. Delays
+and rejections are also counted across instances in metrics/admission.
+"""
+
+import math
+import os
+import threading
+import time
+from collections import deque
+
+import psutil
+
+from services.resources import get_available_memory_mb, get_cpu_count
+
+METRICS_DOCUMENT = ('metrics', 'admission')
+
+MEMORY_RESERVE_MB = int(os.getenv('ADMISSION_MEMORY_RESERVE_MB', '128'))
+MAX_QUEUE = int(os.getenv('ADMISSION_MAX_QUEUE', '8'))
+MAX_WAIT_SECONDS = float(os.getenv('ADMISSION_MAX_WAIT_SECONDS', '20'))
+CPU_BUSY_PERCENT = 90
+# Until a job has run this long its estimate is still held against the
+# headroom: the live reading does not show what it is about to allocate.
+RAMP_SECONDS = 10
+POLL_SECONDS = 0.25
+MIN_RETRY_AFTER_SECONDS = 5
+
+# Resident memory of one ffmpeg process extracting audio, and extra for
+# decoding the video as well (previews)
+FFMPEG_MEMORY_MB = 60
+VIDEO_DECODE_MEMORY_MB = 150
+
+# Per-instance counters
+ADMISSION_STATS = {'admitted': 0, 'delayed': 0, 'rejected': 0, 'running': 0, 'queueDepth': 0}
+
+
+class AdmissionRejected(Exception):
+    """There is no room for the job on this instance; retry after retry_after seconds."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class JobCost:
+    """Estimated peak memory (MB, /tmp included) and CPUs of one job."""
+
+    def __init__(self, memory_mb, cpus):
+        self.memory_mb = memory_mb
+        self.cpus = cpus
+
+    def as_dict(self):
+        return {'memoryMb': round(self.memory_mb), 'cpus': self.cpus}
+
+
+def estimate_cost(mode, bitrate, duration=None, size_bytes=None, workers=1, previews=False):
+    """Estimate a conversion's cost from its source and settings.
+
+    bitrate is the profile's ffmpeg bitrate ('64k'). Streaming keeps
+    nothing in /tmp; the other modes hold the download and the audio, and
+    the segmented ones their segments as well.
+    """
+    source_mb = (size_bytes or 0) / 1024 / 1024
+    audio_mb = (duration or 0) * int(bitrate.rstrip('k')) * 1000 / 8 / 1024 / 1024
+    processes = workers if mode in ('parallel', 'checkpointed') else 1
+    memory = FFMPEG_MEMORY_MB * processes + (VIDEO_DECODE_MEMORY_MB if previews else 0)
+    if mode != 'streaming':
+        memory += source_mb + audio_mb
+    if mode in ('segmented', 'parallel'):
+        memory += audio_mb
+    return JobCost(memory, processes + (1 if previews else 0))
+
+
+class _Ticket:
+    def __init__(self, cost):
+        self.cost = cost
+        self.queued_at = time.monotonic()
+        self.started = None
+
+
+class AdmissionController:
+    """FIFO admission of jobs against the instance's live memory and CPU headroom."""
+
+    def __init__(self, memory_reserve_mb=MEMORY_RESERVE_MB, max_queue=MAX_QUEUE):
+        self.memory_reserve_mb = memory_reserve_mb
+        self.max_queue = max_queue
+        self._condition = threading.Condition()
+        self._queue = deque()
+        self._running = set()
+        self._job_seconds = None  # Moving average of admitted job durations
+
+    def _fits(self, cost):
+        if not self._running:
+            # Alone on the instance: waiting would not free anything up
+            return True
+        now = time.monotonic()
+        ramping = sum(t.cost.memory_mb for t in self._running if now - t.started < RAMP_SECONDS)
+        if get_available_memory_mb() - ramping - self.memory_reserve_mb < cost.memory_mb:
+            return False
+        if sum(t.cost.cpus for t in self._running) + cost.cpus > get_cpu_count():
+            return False
+        return psutil.cpu_percent(interval=None) < CPU_BUSY_PERCENT
+
+    def retry_after(self):
+        """Seconds until a queue slot should free up, from recent job durations."""
+        per_job = self._job_seconds or 30.0
+        waves = (len(self._queue) + 1) / max(len(self._running), 1)
+        return max(MIN_RETRY_AFTER_SECONDS, math.ceil(per_job * waves))
+
+    def _update_stats(self):
+        ADMISSION_STATS['running'] = len(self._running)
+        ADMISSION_STATS['queueDepth'] = len(self._queue)
+
+    def acquire(self, cost, max_wait=MAX_WAIT_SECONDS):
+        """Wait for room for a job of cost; returns a ticket for release().
+
+        Returns (ticket, seconds waited). Raises AdmissionRejected if the
+        queue is full or no room frees up within max_wait seconds.
+        """
+        ticket = _Ticket(cost)
+        deadline = ticket.queued_at + max_wait
+        with self._condition:
+            if len(self._queue) >= self.max_queue:
+                ADMISSION_STATS['rejected'] += 1
+                raise AdmissionRejected(
+                    f"Instance busy: {len(self._queue)} conversions already queued", self.retry_after()
+                )
+            self._queue.append(ticket)
+            self._update_stats()
+            try:
+                while not (self._queue[0] is ticket and self._fits(cost)):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        ADMISSION_STATS['rejected'] += 1
+                        raise AdmissionRejected(
+                            f"Instance busy: no room for a {round(cost.memory_mb)}MB conversion "
+                            f"within {max_wait:g}s", self.retry_after()
+                        )
+                    # Memory frees up without notice too, so re-check periodically
+                    self._condition.wait(min(POLL_SECONDS, remaining))
+            finally:
+                self._queue.remove(ticket)
+                self._update_stats()
+                self._condition.notify_all()
+
+            ticket.started = time.monotonic()
+            self._running.add(ticket)
+            ADMISSION_STATS['admitted'] += 1
+            waited = ticket.started - ticket.queued_at
+            if waited >= POLL_SECONDS:
+                ADMISSION_STATS['delayed'] += 1
+            self._update_stats()
+        return ticket, waited
+
+    def release(self, ticket):
+        with self._condition:
+            self._running.discard(ticket)
+            seconds = time.monotonic() - ticket.started
+            self._job_seconds = seconds if self._job_seconds is None else 0.8 * self._job_seconds + 0.2 * seconds
+            self._update_stats()
+            self._condition.notify_all()
+
+
+controller = AdmissionController()
+
+
+def record_metrics(db, outcome):
+    """Count a delayed or rejected conversion in metrics/admission."""
+    from firebase_admin import firestore
+
+    try:
+        db.collection(METRICS_DOCUMENT[0]).document(METRICS_DOCUMENT[1]).set(
+            {outcome: firestore.Increment(1)}, merge=True
+        )
+    except Exception as e:
+        print(f"Could not record admission metrics: {str(e)}")
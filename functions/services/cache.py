@@ -0,0 +1,139 @@
+"""Content-addressed cache of derived audio and transcripts.
+
+Artifacts are keyed by the source video's content hash from Storage
+metadata, so re-uploads of the same clip reuse existing output, while a
+new generation of a video with different content is re-processed.
+"""
+
+import base64
+
+from firebase_admin import firestore
+
+CACHE_COLLECTION = 'media_cache'
+
+# Custom metadata written on audio blobs to tie them to their source
+SOURCE_HASH_KEY = 'sourceHash'
+SOURCE_GENERATION_KEY = 'sourceGeneration'
+
+
+def get_source_fingerprint(blob):
+    """Return the cache key and generation of a source blob.
+
+    MD5 is used when Storage has one; composite objects only carry CRC32C,
+    so the size is folded into the key to make collisions unlikely.
+    """
+    blob.reload()
+    if blob.md5_hash:
+        key = 'md5-' + base64.b64decode(blob.md5_hash).hex()
+    else:
+        key = f"crc32c-{base64.b64decode(blob.crc32c).hex()}-{blob.size}"
+    return {
+        'key': key,
+        'generation': str(blob.generation),
+        'updated': blob.updated,
+    }
+
+
+def _audio_path_field(profile):
+    """Cache entry field holding the audio path for an output profile."""
+    return 'audioPath' if profile == 'default' else f'{profile}AudioPath'
+
+
+def audio_metadata(fingerprint):
+    """Custom metadata recording which source an audio blob came from."""
+    return {
+        SOURCE_HASH_KEY: fingerprint['key'],
+        SOURCE_GENERATION_KEY: fingerprint['generation'],
+    }
+
+
+def is_audio_current(audio_blob, fingerprint):
+    """Check an existing audio blob was produced from the current source."""
+    metadata = audio_blob.metadata or {}
+    if SOURCE_HASH_KEY in metadata:
+        return metadata[SOURCE_HASH_KEY] == fingerprint['key']
+    # Audio converted before the cache existed: trust it only if it is newer
+    # than the video it would have been converted from.
+    return bool(audio_blob.updated and fingerprint['updated'] and audio_blob.updated >= fingerprint['updated'])
+
+
+def find_cached_audio(db, bucket, fingerprint, exclude_path, profile='default'):
+    """Return an existing audio blob converted from identical content to profile, if any."""
+    entry_ref = db.collection(CACHE_COLLECTION).document(fingerprint['key'])
+    entry = entry_ref.get()
+    if not entry.exists:
+        return None
+
+    field = _audio_path_field(profile)
+    audio_path = entry.to_dict().get(field)
+    if not audio_path or audio_path == exclude_path:
+        return None
+
+    cached_blob = bucket.get_blob(audio_path)
+    if cached_blob is None or (cached_blob.metadata or {}).get(SOURCE_HASH_KEY) != fingerprint['key']:
+        # The cached audio was deleted or re-converted from other content
+        entry_ref.update({field: firestore.DELETE_FIELD})
+        return None
+    return cached_blob
+
+
+def record_audio(db, audio_blob, fingerprint, video_id, profile='default', metadata=None):
+    """Tag an uploaded audio blob with its source and register it in the cache.
+
+    metadata is extra custom metadata for the blob; what a cache-hit copy
+    already carries (e.g. its silence time map) is kept.
+    """
+    audio_blob.metadata = {**(audio_blob.metadata or {}), **audio_metadata(fingerprint), **(metadata or {})}
+    audio_blob.patch()
+    db.collection(CACHE_COLLECTION).document(fingerprint['key']).set({
+        _audio_path_field(profile): audio_blob.name,
+        'audioVideoId': video_id,
+        'sourceGeneration': fingerprint['generation'],
+        'updatedAt': firestore.SERVER_TIMESTAMP,
+    }, merge=True)
+
+
+def get_audio_source_hash(audio_blob):
+    """Return the source hash recorded on an audio blob, if any."""
+    return (audio_blob.metadata or {}).get(SOURCE_HASH_KEY)
+
+
+def is_transcript_current(transcript_data, audio_blob):
+    """Check a stored transcript was made from the current audio."""
+    source_hash = get_audio_source_hash(audio_blob)
+    if transcript_data.get('sourceHash') and source_hash:
+        return transcript_data['sourceHash'] == source_hash
+    # Pre-cache transcripts: valid if written after the audio was last updated
+    created_at = transcript_data.get('createdAt')
+    return not (created_at and audio_blob.updated and created_at < audio_blob.updated)
+
+
+def find_cached_transcript(db, source_hash, exclude_video_id):
+    """Return transcript data produced from identical content, if any."""
+    if not source_hash:
+        return None
+    entry = db.collection(CACHE_COLLECTION).document(source_hash).get()
+    if not entry.exists:
+        return None
+
+    transcript_video_id = entry.to_dict().get('transcriptVideoId')
+    if not transcript_video_id or transcript_video_id == exclude_video_id:
+        return None
+
+    transcript_doc = db.collection('transcripts').document(transcript_video_id).get()
+    if not transcript_doc.exists:
+        return None
+    transcript_data = transcript_doc.to_dict()
+    if transcript_data.get('sourceHash') != source_hash:
+        return None
+    return transcript_data
+
+
+def record_transcript(db, source_hash, video_id):
+    """Register a transcript in the cache under its source hash."""
+    if not source_hash:
+        return
+    db.collection(CACHE_COLLECTION).document(source_hash).set({
+        'transcriptVideoId': video_id,
+        'updatedAt': firestore.SERVER_TIMESTAMP,
+    }, merge=True)
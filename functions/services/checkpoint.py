@@ -0,0 +1,150 @@
+"""Checkpointed segment conversion that a retry can resume.
+
+Long videos are transcoded in CHECKPOINT_SEGMENT_SECONDS windows. Each
+finished window is uploaded to a staging prefix in Storage and its index
+is added to a checkpoint document:
+
+    conversion_checkpoints/{video_id}:{profile}
+        videoId, profile, generation, segmentSeconds, segmentCount,
+        stagingPrefix, completed (segment indexes), updatedAt
+
+An attempt that dies (instance timeout, OOM) leaves both in place. The
+next attempt for the same source generation only transcodes the missing
+windows. Once every window is staged, they are concatenated server-side
+with a compose into the final audio object. Then the staging objects and
+the checkpoint are removed.
+
+Byte concatenation is only a valid stream for formats made of
+self-contained frames, so this mode is limited to COMPOSABLE_FORMATS.
+Segments are written without the Xing/Info and ID3 headers. Otherwise
+those headers would end up in the middle of the file, and the first one
+would report the first segment's length as the whole file's.
+"""
+
+import os
+import threading
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+
+from services.converter import AUDIO_PROFILES, get_segment_concurrency, process_audio_segment, segment_starts
+from services.storage import compose_blobs
+from services.tracing import current_span, propagate
+
+CHECKPOINT_COLLECTION = 'conversion_checkpoints'
+CHECKPOINT_STAGING_PREFIX = 'staging/audio'
+CHECKPOINT_SEGMENT_SECONDS = int(os.getenv('CHECKPOINT_SEGMENT_SECONDS', '300'))
+COMPOSABLE_FORMATS = ('mp3',)
+SEGMENT_OUTPUT_OPTIONS = {'write_xing': 0, 'id3v2_version': 0}
+
+
+def supports_profile(profile):
+    return AUDIO_PROFILES[profile]['format'] in COMPOSABLE_FORMATS
+
+
+def checkpoint_ref(db, video_id, profile):
+    return db.collection(CHECKPOINT_COLLECTION).document(f'{video_id}:{profile}')
+
+
+def staging_prefix(video_id, profile, generation):
+    return f'{CHECKPOINT_STAGING_PREFIX}/{video_id}/{profile}/{generation}'
+
+
+def segment_name(prefix, index, profile):
+    return f"{prefix}/{index:05d}.{AUDIO_PROFILES[profile]['extension']}"
+
+
+def _delete_prefix(bucket, prefix):
+    for blob in bucket.list_blobs(prefix=f'{prefix}/'):
+        try:
+            blob.delete()
+        except Exception as e:
+            print(f"Could not delete staged object {blob.name}: {str(e)}")
+
+
+def load_checkpoint(db, bucket, video_id, profile, generation, segment_count):
+    """Indexes of the segments already staged for this source generation.
+
+    A checkpoint for another generation or segment layout is discarded
+    along with its staged objects, and a fresh one is started.
+    """
+    from firebase_admin import firestore
+
+    ref = checkpoint_ref(db, video_id, profile)
+    doc = ref.get()
+    data = doc.to_dict() if doc.exists else None
+    prefix = staging_prefix(video_id, profile, generation)
+    if data and (data.get('generation'), data.get('segmentSeconds'), data.get('segmentCount')) == (
+            generation, CHECKPOINT_SEGMENT_SECONDS, segment_count):
+        # Recorded and still present: a staging object may have been cleaned up since
+        staged = {blob.name for blob in bucket.list_blobs(prefix=f'{prefix}/')}
+        return {index for index in data.get('completed') or [] if segment_name(prefix, index, profile) in staged}
+
+    if data:
+        print(f"Discarding checkpoint of video {video_id} for generation {data.get('generation')}")
+        _delete_prefix(bucket, data.get('stagingPrefix') or prefix)
+    ref.set({
+        'videoId': video_id,
+        'profile': profile,
+        'generation': generation,
+        'segmentSeconds': CHECKPOINT_SEGMENT_SECONDS,
+        'segmentCount': segment_count,
+        'stagingPrefix': prefix,
+        'completed': [],
+        'updatedAt': firestore.SERVER_TIMESTAMP,
+    })
+    return set()
+
+
+def transcode_checkpointed(db, bucket, video_path, segments_dir, video_id, profile, generation, duration,
+                           max_workers=None, audio_index=0):
+    """Stage every segment of the video's audio, skipping those a previous attempt finished.
+
+    Returns (staged segment names in timeline order, number resumed).
+    """
+    from firebase_admin import firestore
+
+    starts = segment_starts(duration, CHECKPOINT_SEGMENT_SECONDS)
+    completed = load_checkpoint(db, bucket, video_id, profile, generation, len(starts))
+    prefix = staging_prefix(video_id, profile, generation)
+    names = [segment_name(prefix, index, profile) for index in range(len(starts))]
+    pending = [index for index in range(len(starts)) if index not in completed]
+    workers = min(get_segment_concurrency(max_workers), len(pending)) or 1
+    current_span().set(segments=len(starts), resumed=len(completed), workers=workers)
+
+    ref = checkpoint_ref(db, video_id, profile)
+    extension = AUDIO_PROFILES[profile]['extension']
+    abort = threading.Event()
+
+    def work(index):
+        if abort.is_set():
+            return
+        local_path = os.path.join(segments_dir, f'segment_{index:05d}.{extension}')
+        if not process_audio_segment(video_path, local_path, starts[index], CHECKPOINT_SEGMENT_SECONDS,
+                                     profile, audio_index, output_options=SEGMENT_OUTPUT_OPTIONS):
+            abort.set()
+            raise Exception(f"Failed to process segment at {starts[index]} seconds")
+        bucket.blob(names[index]).upload_from_filename(
+            local_path, content_type=AUDIO_PROFILES[profile]['content_type']
+        )
+        os.remove(local_path)
+        ref.update({'completed': firestore.ArrayUnion([index]), 'updatedAt': firestore.SERVER_TIMESTAMP})
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(propagate(work), index) for index in pending]
+        done, not_started = wait(futures, return_when=FIRST_EXCEPTION)
+        for future in not_started:
+            future.cancel()
+        for future in futures:
+            if future.done() and not future.cancelled() and future.exception():
+                raise future.exception()
+
+    return names, len(completed)
+
+
+def finalize_checkpointed(db, bucket, names, audio_blob, video_id, profile, generation):
+    """Compose the staged segments into audio_blob, then drop the staging objects and checkpoint."""
+    prefix = staging_prefix(video_id, profile, generation)
+    compose_blobs([bucket.blob(name) for name in names], audio_blob,
+                  AUDIO_PROFILES[profile]['content_type'], f'{prefix}/compose')
+    _delete_prefix(bucket, prefix)
+    checkpoint_ref(db, video_id, profile).delete()
+    return audio_blob
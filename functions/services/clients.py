@@ -0,0 +1,111 @@
+"""Lazily initialized Firebase and OpenAI clients.
+
+Each client is created on first use and cached for the lifetime of the
+instance, so endpoints only pay for the SDKs they actually touch. The time
+spent initializing each one is kept in INIT_TIMINGS and logged once.
+"""
+
+import os
+import threading
+import time
+
+REQUIRED_OPENAI_VERSION = '0.28'
+
+INIT_TIMINGS = {}  # client name -> seconds spent on first initialization
+
+_clients = {}
+# Reentrant: factories initialize their dependencies (env, app) through _get_or_init
+_lock = threading.RLock()
+
+
+def _get_or_init(name, factory):
+    """Return the cached client, creating it on first use."""
+    client = _clients.get(name)
+    if client is not None:
+        return client
+    with _lock:
+        if name not in _clients:
+            start = time.perf_counter()
+            _clients[name] = factory()
+            INIT_TIMINGS[name] = round(time.perf_counter() - start, 3)
+            print(f"Initialized {name} in {INIT_TIMINGS[name]}s")
+        return _clients[name]
+
+
+def set_client(name, client):
+    """Install a client instance, e.g. a local stand-in from devtools/fake_gcp.py."""
+    with _lock:
+        _clients[name] = client
+
+
+def load_env():
+    """Load environment variables from .env once."""
+    def factory():
+        from dotenv import load_dotenv
+        load_dotenv()
+        return True
+    return _get_or_init('dotenv', factory)
+
+
+def get_firebase_app():
+    """Initialize Firebase Admin on first use."""
+    def factory():
+        load_env()
+        import firebase_admin
+        try:
+            # Event triggers initialize the default app before the handler runs
+            return firebase_admin.get_app()
+        except ValueError:
+            return firebase_admin.initialize_app()
+    return _get_or_init('firebase_app', factory)
+
+
+def get_bucket():
+    """Default Cloud Storage bucket."""
+    def factory():
+        from firebase_admin import storage
+        get_firebase_app()
+        return storage.bucket()
+    return _get_or_init('storage', factory)
+
+
+def get_db():
+    """Firestore client."""
+    def factory():
+        from firebase_admin import firestore
+        get_firebase_app()
+        return firestore.client()
+    return _get_or_init('firestore', factory)
+
+
+def get_openai():
+    """The openai module, version-checked and configured with the API key."""
+    def factory():
+        load_env()
+        from importlib.metadata import version
+
+        import openai
+
+        openai_version = version('openai')
+        if not openai_version.startswith(REQUIRED_OPENAI_VERSION):
+            raise ImportError(f"OpenAI version {openai_version} is not compatible. Required version: {REQUIRED_OPENAI_VERSION}.x")
+
+        openai.api_key = os.getenv('OPENAI_API_KEY')
+        if not openai.api_key:
+            print("⚠️ OpenAI API key not found in environment - will need to be set before using OpenAI functions")
+        return openai
+    return _get_or_init('openai', factory)
+
+
+def is_retryable_error(openai, error):
+    """Rate limits, timeouts and server-side OpenAI failures are worth retrying."""
+    retryable = (
+        openai.error.RateLimitError,
+        openai.error.ServiceUnavailableError,
+        openai.error.APIConnectionError,
+        openai.error.Timeout,
+        openai.error.TryAgain,
+    )
+    if isinstance(error, retryable):
+        return True
+    return isinstance(error, openai.error.APIError) and (error.http_status or 500) >= 500
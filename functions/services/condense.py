@@ -0,0 +1,139 @@
+"""Token-budgeted extractive digests of transcripts for LLM prompts.
+
+Long transcripts are reduced to the segments that carry the most content,
+kept in timeline order with their timestamps, until the digest fills a
+token budget. Selection is SumBasic-style: a segment scores by the average
+frequency of its content words across the transcript, and once a segment
+is picked the weights of its words are squared so later picks favour
+material not covered yet.
+
+Tokens are counted locally with tiktoken (cl100k_base, the gpt-3.5-turbo
+encoding). If tiktoken or its encoding file is unavailable the count falls
+back to a characters/4 estimate.
+"""
+
+import heapq
+import math
+import re
+
+from services.search_index import tokenize
+
+TOKEN_ENCODING = 'cl100k_base'
+CHARS_PER_TOKEN = 4  # Estimate used when tiktoken is unavailable
+MIN_WORD_LENGTH = 3
+OPENING_FRACTION = 0.1  # Openings usually state the topic...
+OPENING_BOOST = 1.25  # ...so segments there score a little higher
+
+STOPWORDS = frozenset("""
+about above after again against all also and any are because been before being below between both but
+can could did does doing down during each few for from further had has have having her here hers him his
+how into its itself just like more most not now off once only other our out over own really same she
+should some such than that the their them then there these they this those through too under until very
+was were what when where which while who whom why will with would you your yeah okay gonna going know
+right well get got thing things kind sort
+""".split())
+
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+        except Exception as e:
+            print(f"tiktoken unavailable ({str(e)}), estimating tokens from length")
+        _encoding_loaded = True
+    return _encoding
+
+
+def count_tokens(text):
+    """Number of model tokens in text."""
+    encoding = _get_encoding()
+    if encoding is None:
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def split_sentences(text):
+    """Split untimed transcript text into sentence-sized pieces."""
+    return [sentence for sentence in _SENTENCE_END.split(text.strip()) if sentence]
+
+
+def _format_line(start_ms, text):
+    if start_ms is None:
+        return text
+    minutes, seconds = divmod(start_ms // 1000, 60)
+    return f'[{minutes:02d}:{seconds:02d}] {text}'
+
+
+def _content_words(text):
+    return [word for word in tokenize(text) if len(word) >= MIN_WORD_LENGTH and word not in STOPWORDS]
+
+
+def condense(pieces, budget):
+    """Select pieces of a transcript that fit in budget tokens.
+
+    pieces is a list of (start_ms or None, text) in timeline order. Returns
+    (digest, stats); the digest is one line per kept piece, prefixed with
+    its [mm:ss] start when known.
+    """
+    lines = [_format_line(start_ms, ' '.join(text.split())) for start_ms, text in pieces if text.strip()]
+    costs = [count_tokens(line) + 1 for line in lines]  # +1 for the newline
+    total = sum(costs)
+    stats = {
+        'originalTokens': total,
+        'segmentsTotal': len(lines),
+        'budget': budget,
+    }
+
+    if total <= budget:
+        keep = range(len(lines))
+    else:
+        words = [set(_content_words(line)) for line in lines]
+        counts = {}
+        for segment_words in words:
+            for word in segment_words:
+                counts[word] = counts.get(word, 0) + 1
+        vocabulary_size = sum(counts.values()) or 1
+        weights = {word: count / vocabulary_size for word, count in counts.items()}
+        opening = max(1, int(len(lines) * OPENING_FRACTION))
+
+        def score(position):
+            segment_words = words[position]
+            if not segment_words:
+                return 0.0
+            value = sum(weights[word] for word in segment_words) / len(segment_words)
+            return value * OPENING_BOOST if position < opening else value
+
+        # Lazy greedy: scores only ever drop, so a re-scored entry that still
+        # beats the next best on the heap is the true maximum.
+        heap = [(-score(position), position) for position in range(len(lines))]
+        heapq.heapify(heap)
+        chosen = []
+        remaining = budget
+        while heap and remaining > 0:
+            _, position = heapq.heappop(heap)
+            if costs[position] > remaining:
+                continue
+            current = score(position)
+            if heap and current < -heap[0][0]:
+                heapq.heappush(heap, (-current, position))
+                continue
+            chosen.append(position)
+            remaining -= costs[position]
+            for word in words[position]:
+                weights[word] *= weights[word]
+        keep = sorted(chosen)
+
+    digest = '\n'.join(lines[position] for position in keep)
+    stats.update({
+        'digestTokens': sum(costs[position] for position in keep),
+        'segmentsKept': len(keep),
+    })
+    stats['tokensSaved'] = total - stats['digestTokens']
+    return digest, stats
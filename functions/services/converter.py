@@ -0,0 +1,381 @@
+"""MP4 to audio conversion helpers used by convert_to_audio."""
+
+import math
+import os
+import subprocess
+import threading
+from collections import deque
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+
+import ffmpeg
+
+from services.media_info import probe_file
+from services.resources import get_available_memory_mb, get_cpu_count
+from services.tracing import current_span, propagate, run_process, wait_process
+
+# Output profiles, chosen per request. 'default' is the original output and
+# keeps the audio/{video_id}.mp3 path; the others are stored next to it.
+AUDIO_PROFILES = {
+    'default': {
+        'codec': 'libmp3lame',
+        'channels': 1,  # Mono audio to reduce memory usage
+        'sample_rate': '22050',
+        'bitrate': '64k',
+        'format': 'mp3',
+        'extension': 'mp3',
+        'content_type': 'audio/mpeg',
+        'copy_codecs': ('mp3',),  # Source codecs written out without re-encoding
+        'trim_silence': False,
+    },
+    # Whisper resamples to 16 kHz mono anyway. Opus in speech mode stays
+    # intelligible at a third of the default bitrate and encodes faster
+    # than LAME; long pauses are cut out (see services/silence.py).
+    'transcription': {
+        'codec': 'libopus',
+        'channels': 1,
+        'sample_rate': '16000',
+        'bitrate': '24k',
+        'format': 'ogg',
+        'extension': 'ogg',
+        'content_type': 'audio/ogg',
+        'copy_codecs': (),
+        'trim_silence': True,
+        'extra': {'application': 'voip'},
+    },
+    'playback': {
+        'codec': 'libmp3lame',
+        'channels': 2,
+        'sample_rate': '44100',
+        'bitrate': '128k',
+        'format': 'mp3',
+        'extension': 'mp3',
+        'content_type': 'audio/mpeg',
+        'copy_codecs': (),
+        'trim_silence': False,
+    },
+}
+DEFAULT_AUDIO_PROFILE = 'default'
+
+# Audio looked for, in order, when transcribing a video
+TRANSCRIPTION_PROFILES = ('transcription', 'default', 'playback')
+
+# single_pass decodes the audio track once; segmented is the legacy
+# per-window path kept for comparison and memory-capped instances;
+# parallel runs the segmented path on a bounded worker pool; streaming
+# pipes the blob through ffmpeg without touching local disk; checkpointed
+# stages finished segments in Storage so a retry resumes where a timed-out
+# attempt stopped (services/checkpoint.py).
+EXTRACTION_MODES = ('single_pass', 'segmented', 'parallel', 'streaming', 'checkpointed')
+DEFAULT_EXTRACTION_MODE = 'single_pass'
+
+SEGMENT_DURATION = 15  # Seconds per window in segmented mode
+
+# Approximate peak RSS of one single-threaded segment encode, and the share
+# of the free memory the segment workers are allowed to take.
+SEGMENT_WORKER_MEMORY_MB = 48
+SEGMENT_MEMORY_FRACTION = 0.5
+
+def get_extraction_mode(requested=None):
+    """Resolve the extraction mode from the request or AUDIO_EXTRACTION_MODE."""
+    mode = requested or os.getenv('AUDIO_EXTRACTION_MODE', DEFAULT_EXTRACTION_MODE)
+    if mode not in EXTRACTION_MODES:
+        raise ValueError(f"Unknown extraction mode '{mode}', expected one of {EXTRACTION_MODES}")
+    return mode
+
+
+def get_audio_profile(requested=None):
+    """Resolve the output profile from the request or AUDIO_PROFILE."""
+    profile = requested or os.getenv('AUDIO_PROFILE', DEFAULT_AUDIO_PROFILE)
+    if profile not in AUDIO_PROFILES:
+        raise ValueError(f"Unknown audio profile '{profile}', expected one of {tuple(AUDIO_PROFILES)}")
+    return profile
+
+
+def audio_storage_path(video_id, profile=DEFAULT_AUDIO_PROFILE):
+    """Storage path of a video's audio in the given profile."""
+    suffix = '' if profile == 'default' else f'.{profile}'
+    return f"audio/{video_id}{suffix}.{AUDIO_PROFILES[profile]['extension']}"
+
+
+def encode_options(profile=DEFAULT_AUDIO_PROFILE):
+    """ffmpeg output options for a profile, keyed without the leading dash."""
+    settings = AUDIO_PROFILES[profile]
+    return {
+        'acodec': settings['codec'],
+        'ac': settings['channels'],
+        'ar': settings['sample_rate'],
+        'b:a': settings['bitrate'],
+        **settings.get('extra', {}),
+        'f': settings['format'],
+    }
+
+
+def _stderr_tail(error, lines=20):
+    """Return the last few lines of ffmpeg stderr for error messages."""
+    if not getattr(error, 'stderr', None):
+        return str(error)
+    return '\n'.join(error.stderr.decode(errors='replace').strip().splitlines()[-lines:])
+
+
+def run_ffmpeg(stream, overwrite_output=False):
+    """ffmpeg.run(stream) with output captured, measured as a child process of the current span.
+
+    Raises ffmpeg.Error with the captured stderr on failure.
+    """
+    result = run_process(ffmpeg.compile(stream, overwrite_output=overwrite_output))
+    if result.returncode != 0:
+        raise ffmpeg.Error('ffmpeg', result.stdout, result.stderr)
+
+
+def get_video_duration(video_path):
+    """Duration of a video file: its audio stream's, else the container's.
+
+    convert_video uses services.media_info directly so a file is probed once;
+    this is for callers that only need the one value.
+    """
+    try:
+        return probe_file(video_path)['duration']
+    except Exception as e:
+        print(f"Error getting video duration: {str(e)}")
+        return None
+
+
+def get_audio_codec(video_path):
+    """Return the codec name of the audio stream to extract, or None if there is none."""
+    return probe_file(video_path)['audioCodec']
+
+
+def extract_audio_single_pass(input_path, output_path, source_codec=None, threads=1,
+                              profile=DEFAULT_AUDIO_PROFILE, time_map=None, audio_index=0, previews=None):
+    """Extract the audio track in one ffmpeg process.
+
+    Only the first audio stream is demuxed, so the video track is never
+    decoded. When the source codec already matches the output it is stream
+    copied; otherwise it goes through a single encoder. ffmpeg works frame by
+    frame, so memory stays bounded regardless of the video length. With a
+    silence.TimeMap only its intervals are kept. audio_index picks the audio
+    stream (see media_info.select_audio_stream). A previews.PreviewPlan adds
+    its image outputs to the same process, which then also decodes the video.
+
+    Returns True if the audio was stream copied, False if it was re-encoded.
+    """
+    stream_copy = time_map is None and source_codec in AUDIO_PROFILES[profile]['copy_codecs']
+    source = ffmpeg.input(input_path)
+    audio = source[f'a:{audio_index}']
+
+    if stream_copy:
+        output_args = {'acodec': 'copy', 'f': AUDIO_PROFILES[profile]['format']}
+    else:
+        output_args = encode_options(profile)
+        if time_map is not None:
+            output_args['af'] = time_map.select_filter()
+
+    stream = ffmpeg.output(
+        audio,
+        output_path,
+        vn=None,
+        **output_args,
+        **{
+            'threads': threads,
+            'loglevel': 'error',
+        }
+    )
+    if previews is not None:
+        stream = ffmpeg.merge_outputs(stream, *previews.outputs(source['v:0']))
+
+    try:
+        run_ffmpeg(stream, overwrite_output=True)
+    except ffmpeg.Error as e:
+        raise Exception(f"Single-pass extraction failed: {_stderr_tail(e)}")
+
+    if not os.path.exists(output_path):
+        raise Exception("Final audio file was not created")
+    return stream_copy
+
+
+def extract_audio_streaming(source, sink, chunk_size=2*1024*1024, threads=1, profile=DEFAULT_AUDIO_PROFILE,
+                            audio_index=0):
+    """Pipe source through ffmpeg into sink without temporary files.
+
+    source and sink are file-like objects (e.g. blob readers/writers). A
+    feeder thread writes source into ffmpeg's stdin while this thread copies
+    ffmpeg's stdout into sink, so download, transcode and upload overlap and
+    at most a few chunks are held in memory. Only the tail of stderr is kept.
+
+    Returns (bytes_in, bytes_out).
+    """
+    cmd = [
+        'ffmpeg', '-hide_banner', '-loglevel', 'error',
+        '-i', 'pipe:0',
+        '-map', f'0:a:{audio_index}', '-vn',
+        *(arg for key, value in encode_options(profile).items() for arg in (f'-{key}', str(value))),
+        '-threads', str(threads),
+        'pipe:1'
+    ]
+    process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stderr_tail = deque(maxlen=20)
+    bytes_in = 0
+    feed_error = []
+
+    def feed():
+        nonlocal bytes_in
+        try:
+            while True:
+                chunk = source.read(chunk_size)
+                if not chunk:
+                    break
+                process.stdin.write(chunk)
+                bytes_in += len(chunk)
+        except BrokenPipeError:
+            pass  # ffmpeg exited early; its exit code reports why
+        except Exception as e:
+            feed_error.append(e)
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    def drain_stderr():
+        for line in process.stderr:
+            stderr_tail.append(line.decode(errors='replace').rstrip())
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    stderr_reader = threading.Thread(target=drain_stderr, daemon=True)
+    feeder.start()
+    stderr_reader.start()
+
+    bytes_out = 0
+    try:
+        while True:
+            chunk = process.stdout.read(chunk_size)
+            if not chunk:
+                break
+            sink.write(chunk)
+            bytes_out += len(chunk)
+    except Exception:
+        process.kill()
+        raise
+    finally:
+        returncode = wait_process(process)
+        feeder.join()
+        stderr_reader.join()
+
+    if feed_error:
+        raise Exception(f"Reading source failed: {str(feed_error[0])}")
+    if returncode != 0:
+        raise Exception(f"Streaming extraction failed: {chr(10).join(stderr_tail)}")
+    return bytes_in, bytes_out
+
+
+def process_audio_segment(input_path, output_path, start_time, duration, profile=DEFAULT_AUDIO_PROFILE,
+                          audio_index=0, output_options=None):
+    """Process a segment of the video to audio; output_options are extra muxer/encoder options."""
+    stream = ffmpeg.input(input_path, ss=start_time, t=duration)[f'a:{audio_index}']
+    stream = ffmpeg.output(
+        stream,
+        output_path,
+        **encode_options(profile),
+        **(output_options or {}),
+        **{
+            'threads': 1,
+            'loglevel': 'error',
+        }
+    )
+
+    try:
+        run_ffmpeg(stream)
+    except ffmpeg.Error as e:
+        # Only failures are logged; the tail of stderr carries the reason
+        print(f"FFmpeg failed on segment at {start_time}s: {_stderr_tail(e)}")
+        return False
+    return os.path.exists(output_path)
+
+
+def segment_starts(duration, segment_duration=SEGMENT_DURATION):
+    """Start seconds of the fixed-length segments covering duration, the fractional tail included.
+
+    Always at least one segment, so sub-second sources still convert.
+    """
+    return list(range(0, math.ceil(duration), segment_duration)) or [0]
+
+
+def transcode_segments(video_path, segments_dir, duration, segment_duration=SEGMENT_DURATION,
+                       profile=DEFAULT_AUDIO_PROFILE, audio_index=0):
+    """Transcode the video into fixed-length audio segments, one ffmpeg process each."""
+    extension = AUDIO_PROFILES[profile]['extension']
+    segments = []
+    for start_time in segment_starts(duration, segment_duration):
+        segment_path = os.path.join(segments_dir, f'segment_{start_time}.{extension}')
+        if process_audio_segment(video_path, segment_path, start_time, segment_duration, profile, audio_index):
+            segments.append(segment_path)
+        else:
+            raise Exception(f"Failed to process segment at {start_time} seconds")
+    return segments
+
+
+def get_segment_concurrency(max_workers=None):
+    """Size the segment worker pool from CPU and memory headroom.
+
+    The result is capped by max_workers (or SEGMENT_MAX_WORKERS) when given.
+    """
+    cap = max_workers or int(os.getenv('SEGMENT_MAX_WORKERS', '0'))
+    by_memory = int(get_available_memory_mb() * SEGMENT_MEMORY_FRACTION // SEGMENT_WORKER_MEMORY_MB)
+    workers = max(1, min(get_cpu_count(), by_memory))
+    if cap:
+        workers = min(workers, cap)
+    return workers
+
+
+def transcode_segments_parallel(video_path, segments_dir, duration,
+                                segment_duration=SEGMENT_DURATION, max_workers=None, profile=DEFAULT_AUDIO_PROFILE,
+                                audio_index=0):
+    """Transcode segments concurrently on a bounded pool.
+
+    Segment paths are returned in timeline order for the concat step. The
+    first failed segment cancels everything that has not started yet.
+    """
+    starts = segment_starts(duration, segment_duration)
+    extension = AUDIO_PROFILES[profile]['extension']
+    paths = [os.path.join(segments_dir, f'segment_{start_time}.{extension}') for start_time in starts]
+    workers = min(get_segment_concurrency(max_workers), len(starts)) or 1
+    abort = threading.Event()
+    current_span().set(segments=len(starts), workers=workers)
+
+    def work(start_time, segment_path):
+        if abort.is_set():
+            return
+        if not process_audio_segment(video_path, segment_path, start_time, segment_duration, profile, audio_index):
+            abort.set()
+            raise Exception(f"Failed to process segment at {start_time} seconds")
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(propagate(work), start_time, path) for start_time, path in zip(starts, paths)]
+        done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+        for future in pending:
+            future.cancel()
+        for future in futures:
+            if future.done() and not future.cancelled() and future.exception():
+                raise future.exception()
+
+    return paths
+
+
+def concat_segments(segments, list_path, output_path):
+    """Concatenate audio segments without re-encoding."""
+    with open(list_path, 'w') as f:
+        for segment in segments:
+            f.write(f"file '{segment}'\n")
+
+    # Use FFmpeg to concatenate with minimal memory usage
+    concat_cmd = [
+        'ffmpeg', '-hide_banner', '-loglevel', 'error',
+        '-f', 'concat', '-safe', '0',
+        '-i', list_path,
+        '-c', 'copy',
+        '-y',  # Overwrite output file
+        output_path
+    ]
+    result = run_process(concat_cmd)
+    if result.returncode != 0:
+        raise Exception(f"Concatenating segments failed: {_stderr_tail(result)}")
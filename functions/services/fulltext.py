@@ -0,0 +1,448 @@
+"""Cross-video BM25 transcript index stored as sharded, memory-mapped files.
+
+Layout under the index root:
+
+    manifest.json                     shard count, build id, segment files per shard, live docs, checkpoint
+    shard-XX/seg-BBBBBBBB-NNNNNN.bin  immutable segment files
+
+Segment names are never reused: NNNNNN counts up within an index and
+BBBBBBBB is a random id given to each index when it is created, so a
+rebuild publishes new files rather than overwriting the ones instances
+already mirror. (Indexes created before build ids have seg-NNNNNN.bin.)
+
+Videos are assigned to shards by CRC32 of the video_id. Each indexing run
+writes one new segment per touched shard, so updates never rewrite existing
+files. A re-indexed video lives in its newest segment, and the manifest's
+live map hides its older copies until compact() merges the shard.
+
+Segment file (little-endian):
+
+    header    magic, doc/term counts, total doc length, section offsets
+    doc ids   newline-joined UTF-8 video ids
+    doc lens  uint32 per doc
+    terms     concatenated UTF-8 terms, sorted by bytes
+    term tab  (term offset, term length, df, postings offset) per term
+    postings  (doc, tf, first_ms) per doc containing the term
+
+Term lookups binary-search the term table straight from the mmap, so only
+the postings of query terms are ever touched.
+"""
+
+import heapq
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+import uuid
+import zlib
+from array import array
+
+from services.search_index import tokenize
+
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 1
+DEFAULT_SHARDS = 16
+
+_MAGIC = b'RBM25v1\0'
+_HEADER = struct.Struct('<8sIIQQQQQQ')
+_TERM_ENTRY = struct.Struct('<IIIQ')
+_POSTING = struct.Struct('<III')
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Where the indexer publishes the index and where instances mirror it
+INDEX_PREFIX = 'search_index'
+LOCAL_INDEX_ROOT = os.path.join('/tmp', 'search_index')
+REFRESH_SECONDS = 60
+
+
+def shard_for(video_id, shards):
+    """Shard number of a video."""
+    return zlib.crc32(video_id.encode()) % shards
+
+
+def _write_atomic(path, data):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def analyze(segments):
+    """Tokenize a transcript: ({term_bytes: (tf, first_ms)}, length)."""
+    terms = {}
+    length = 0
+    for start_ms, text in segments:
+        for token in tokenize(text):
+            length += 1
+            entry = terms.get(token)
+            terms[token] = (entry[0] + 1, entry[1]) if entry else (1, start_ms)
+    return {token.encode(): entry for token, entry in terms.items()}, length
+
+
+def write_segment(path, docs):
+    """Write a segment file for analyzed docs [(video_id, terms, length)]."""
+    doc_ids = []
+    doc_lens = array('I')
+    postings = {}
+    for doc, (video_id, terms, length) in enumerate(docs):
+        doc_ids.append(video_id)
+        doc_lens.append(length)
+        for term, (tf, first_ms) in terms.items():
+            postings.setdefault(term, []).append((doc, tf, first_ms))
+
+    terms = sorted(postings)
+    term_table = bytearray()
+    posting_blob = bytearray()
+    term_offset = 0
+    for term in terms:
+        entries = postings[term]
+        term_table += _TERM_ENTRY.pack(term_offset, len(term), len(entries), len(posting_blob))
+        for entry in entries:
+            posting_blob += _POSTING.pack(*entry)
+        term_offset += len(term)
+
+    total_length = sum(doc_lens)
+    if sys.byteorder != 'little':
+        doc_lens.byteswap()
+    sections = ['\n'.join(doc_ids).encode(), doc_lens.tobytes(), b''.join(terms), bytes(term_table)]
+    offsets = [_HEADER.size]
+    for section in sections:
+        offsets.append(offsets[-1] + len(section))
+    header = _HEADER.pack(_MAGIC, len(doc_ids), len(terms), total_length, *offsets)
+    _write_atomic(path, b''.join([header, *sections, bytes(posting_blob)]))
+
+
+class SegmentReader:
+    """Read-only, memory-mapped view of one segment file."""
+
+    def __init__(self, path):
+        self.name = os.path.basename(path)
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.doc_count, self.term_count, self.total_length,
+         doc_off, len_off, term_off, table_off, self._postings_off) = _HEADER.unpack_from(self._mm, 0)
+        if magic != _MAGIC:
+            raise ValueError(f"{path} is not a transcript index segment")
+
+        self.doc_ids = self._mm[doc_off:len_off].decode().split('\n') if self.doc_count else []
+        self.doc_lens = array('I')
+        self.doc_lens.frombytes(self._mm[len_off:term_off])
+        if sys.byteorder != 'little':
+            self.doc_lens.byteswap()
+        self._term_off = term_off
+        self._table_off = table_off
+        self.alive = None  # Per-doc liveness, set by the index from the manifest
+
+    def close(self):
+        self._mm.close()
+
+    def _term_at(self, index):
+        offset, length, df, postings_offset = _TERM_ENTRY.unpack_from(self._mm, self._table_off + index * _TERM_ENTRY.size)
+        start = self._term_off + offset
+        return self._mm[start:start + length], df, postings_offset
+
+    def lookup(self, term):
+        """(df, postings offset) of a term, or None; binary search over the mmap."""
+        key = term.encode()
+        low, high = 0, self.term_count
+        while low < high:
+            mid = (low + high) // 2
+            candidate, df, postings_offset = self._term_at(mid)
+            if candidate < key:
+                low = mid + 1
+            elif candidate > key:
+                high = mid
+            else:
+                return df, postings_offset
+        return None
+
+    def postings(self, term):
+        """Yield (doc, tf, first_ms) for a term."""
+        found = self.lookup(term)
+        if found is None:
+            return
+        df, postings_offset = found
+        start = self._postings_off + postings_offset
+        yield from _POSTING.iter_unpack(self._mm[start:start + df * _POSTING.size])
+
+    def iter_docs(self):
+        """Yield analyzed (video_id, terms, length) for live docs; used by compaction."""
+        docs = [{} for _ in range(self.doc_count)]
+        for index in range(self.term_count):
+            term, df, postings_offset = self._term_at(index)
+            start = self._postings_off + postings_offset
+            for doc, tf, first_ms in _POSTING.iter_unpack(self._mm[start:start + df * _POSTING.size]):
+                docs[doc][term] = (tf, first_ms)
+        for doc, terms in enumerate(docs):
+            if self.alive is None or self.alive[doc]:
+                yield self.doc_ids[doc], terms, self.doc_lens[doc]
+
+
+class FulltextIndex:
+    """A sharded BM25 index rooted at a local directory."""
+
+    def __init__(self, root):
+        self.root = root
+        with open(os.path.join(root, MANIFEST_NAME)) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('version') != MANIFEST_VERSION:
+            raise ValueError(f"Unsupported index version {self.manifest.get('version')}")
+        self.shards = self.manifest['shards']
+        self._readers = {}
+        self._load_readers()
+
+    @classmethod
+    def create(cls, root, shards=DEFAULT_SHARDS):
+        """Create an empty index at root (replacing any manifest there)."""
+        os.makedirs(root, exist_ok=True)
+        manifest = {
+            'version': MANIFEST_VERSION,
+            'shards': shards,
+            'build': uuid.uuid4().hex[:8],
+            'nextSegment': 1,
+            'segments': {str(shard): [] for shard in range(shards)},
+            'live': {str(shard): {} for shard in range(shards)},
+            'checkpoint': None,
+        }
+        _write_atomic(os.path.join(root, MANIFEST_NAME), json.dumps(manifest).encode())
+        return cls(root)
+
+    @classmethod
+    def open_or_create(cls, root, shards=DEFAULT_SHARDS):
+        if os.path.exists(os.path.join(root, MANIFEST_NAME)):
+            return cls(root)
+        return cls.create(root, shards)
+
+    def _new_segment_name(self):
+        number = self.manifest['nextSegment']
+        self.manifest['nextSegment'] += 1
+        build = self.manifest.get('build')
+        return f'seg-{build}-{number:06d}.bin' if build else f'seg-{number:06d}.bin'
+
+    def _segment_path(self, shard, name):
+        return os.path.join(self.root, f'shard-{int(shard):02d}', name)
+
+    def _load_readers(self):
+        """(Re)open segment readers and recompute liveness and corpus stats."""
+        for readers in self._readers.values():
+            for reader in readers:
+                reader.close()
+        self._readers = {}
+        self.doc_count = 0
+        total_length = 0
+        for shard, names in self.manifest['segments'].items():
+            live = self.manifest['live'][shard]
+            readers = []
+            for name in names:
+                reader = SegmentReader(self._segment_path(shard, name))
+                reader.alive = bytearray(live.get(video_id) == name for video_id in reader.doc_ids)
+                for doc, alive in enumerate(reader.alive):
+                    if alive:
+                        self.doc_count += 1
+                        total_length += reader.doc_lens[doc]
+                readers.append(reader)
+            self._readers[shard] = readers
+        self.avg_doc_length = total_length / self.doc_count if self.doc_count else 0.0
+
+    def close(self):
+        for readers in self._readers.values():
+            for reader in readers:
+                reader.close()
+        self._readers = {}
+
+    def _save_manifest(self):
+        _write_atomic(os.path.join(self.root, MANIFEST_NAME), json.dumps(self.manifest).encode())
+
+    @property
+    def checkpoint(self):
+        return self.manifest.get('checkpoint')
+
+    def add(self, docs, checkpoint=None):
+        """Index docs [(video_id, [(start_ms, text), ...])], one new segment per shard.
+
+        A video already in the index is replaced by its new copy.
+        """
+        by_shard = {}
+        for video_id, segments in docs:
+            by_shard.setdefault(str(shard_for(video_id, self.shards)), {})[video_id] = segments
+
+        for shard, shard_docs in by_shard.items():
+            name = self._new_segment_name()
+            path = self._segment_path(shard, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_segment(path, [(video_id, *analyze(segments)) for video_id, segments in shard_docs.items()])
+            self.manifest['segments'][shard].append(name)
+            for video_id in shard_docs:
+                self.manifest['live'][shard][video_id] = name
+
+        if checkpoint is not None:
+            self.manifest['checkpoint'] = checkpoint
+        self._save_manifest()
+        self._load_readers()
+
+    def compact(self, max_segments=1):
+        """Merge shards holding more than max_segments files, dropping dead copies."""
+        compacted = []
+        for shard, names in self.manifest['segments'].items():
+            if len(names) <= max_segments:
+                continue
+            merged = []
+            for reader in self._readers[shard]:
+                merged.extend(reader.iter_docs())
+            name = self._new_segment_name()
+            write_segment(self._segment_path(shard, name), merged)
+            self.manifest['segments'][shard] = [name]
+            self.manifest['live'][shard] = {video_id: name for video_id, _, _ in merged}
+            compacted.append((shard, names))
+
+        if compacted:
+            self._save_manifest()
+            self._load_readers()
+            for shard, names in compacted:
+                for name in names:
+                    os.remove(self._segment_path(shard, name))
+        return len(compacted)
+
+    def search(self, query, limit=20):
+        """Top videos for query by BM25: [{videoId, score, startMs}].
+
+        startMs is the first occurrence of the query term contributing most
+        to that video's score.
+        """
+        terms = set(tokenize(query))
+        if not terms or not self.doc_count:
+            return []
+
+        scores = {}
+        best = {}  # video_id -> (best term contribution, first_ms)
+        for term in terms:
+            matches = []
+            for readers in self._readers.values():
+                for reader in readers:
+                    alive = reader.alive
+                    for doc, tf, first_ms in reader.postings(term):
+                        if alive[doc]:
+                            matches.append((reader.doc_ids[doc], tf, first_ms, reader.doc_lens[doc]))
+            if not matches:
+                continue
+
+            df = len(matches)
+            idf = math.log(1 + (self.doc_count - df + 0.5) / (df + 0.5))
+            for video_id, tf, first_ms, length in matches:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * length / self.avg_doc_length)
+                contribution = idf * tf * (BM25_K1 + 1) / (tf + norm)
+                scores[video_id] = scores.get(video_id, 0.0) + contribution
+                if contribution > best.get(video_id, (0.0, 0))[0]:
+                    best[video_id] = (contribution, first_ms)
+
+        top = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+        return [
+            {'videoId': video_id, 'score': round(score, 4), 'startMs': best[video_id][1]}
+            for video_id, score in top
+        ]
+
+    def files(self):
+        """Paths of the manifest and all live segment files, relative to root."""
+        paths = [MANIFEST_NAME]
+        for shard, names in self.manifest['segments'].items():
+            paths.extend(os.path.relpath(self._segment_path(shard, name), self.root) for name in names)
+        return paths
+
+
+def _manifest_files(manifest, prefix):
+    """Storage names of the segment files a manifest references."""
+    return {
+        f"{prefix}/shard-{int(shard):02d}/{name}"
+        for shard, names in manifest['segments'].items()
+        for name in names
+    }
+
+
+def upload_index(index, bucket, prefix):
+    """Upload new segment files, then the manifest, then prune segments no longer referenced.
+
+    Segments of the manifest being replaced are kept until the next
+    upload: instances that loaded it may still be downloading them.
+    """
+    remote = {blob.name for blob in bucket.list_blobs(prefix=f'{prefix}/')}
+    previous_blob = bucket.get_blob(f'{prefix}/{MANIFEST_NAME}')
+    wanted = _manifest_files(json.loads(previous_blob.download_as_bytes()), prefix) if previous_blob else set()
+    for relative in index.files():
+        name = f'{prefix}/{relative}'
+        wanted.add(name)
+        # Segment files are immutable, so only new ones need uploading
+        if relative != MANIFEST_NAME and name not in remote:
+            bucket.blob(name).upload_from_filename(os.path.join(index.root, relative))
+    bucket.blob(f'{prefix}/{MANIFEST_NAME}').upload_from_filename(os.path.join(index.root, MANIFEST_NAME))
+    for name in remote - wanted:
+        bucket.blob(name).delete()
+
+
+def download_index(bucket, prefix, root):
+    """Mirror the index at prefix into root, fetching only segments not present locally.
+
+    Returns the manifest blob generation, or None if there is no index.
+    """
+    manifest_blob = bucket.get_blob(f'{prefix}/{MANIFEST_NAME}')
+    if manifest_blob is None:
+        return None
+    manifest = json.loads(manifest_blob.download_as_bytes(if_generation_match=manifest_blob.generation))
+    wanted = set()
+    for shard, names in manifest['segments'].items():
+        for name in names:
+            relative = os.path.join(f'shard-{int(shard):02d}', name)
+            path = os.path.join(root, relative)
+            wanted.add(path)
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                bucket.blob(f'{prefix}/{relative}').download_to_filename(f'{path}.tmp')
+                os.replace(f'{path}.tmp', path)
+    os.makedirs(root, exist_ok=True)
+    _write_atomic(os.path.join(root, MANIFEST_NAME), json.dumps(manifest).encode())
+
+    # Drop segments merged away by compaction; an index still open on them
+    # keeps its mappings, which stay valid on Linux after the unlink
+    for directory, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(directory, name)
+            if name.endswith('.bin') and path not in wanted:
+                os.remove(path)
+    return manifest_blob.generation
+
+
+_shared = {'index': None, 'generation': None, 'checked_at': 0.0}
+_shared_lock = threading.Lock()
+
+
+def load_shared_index(bucket, prefix=INDEX_PREFIX, root=LOCAL_INDEX_ROOT):
+    """Per-instance index mirrored from Storage, re-synced when the manifest changes.
+
+    The manifest generation is checked at most every REFRESH_SECONDS.
+    Returns None until the indexer has published an index.
+
+    A re-sync swaps in a new FulltextIndex and leaves the old one open:
+    requests that got it may still be searching its mappings. It is closed
+    when the last of them drops it.
+    """
+    now = time.monotonic()
+    if _shared['index'] is not None and now - _shared['checked_at'] < REFRESH_SECONDS:
+        return _shared['index']
+
+    with _shared_lock:
+        if _shared['index'] is not None and now - _shared['checked_at'] < REFRESH_SECONDS:
+            return _shared['index']  # Another request re-synced while we waited
+        manifest_blob = bucket.get_blob(f'{prefix}/{MANIFEST_NAME}')
+        _shared['checked_at'] = time.monotonic()
+        if manifest_blob is None:
+            return None
+        if manifest_blob.generation != _shared['generation']:
+            generation = download_index(bucket, prefix, root)
+            _shared['index'] = FulltextIndex(root)
+            _shared['generation'] = generation
+        return _shared['index']
@@ -0,0 +1,293 @@
+"""Info-card generation with a shared result cache and validated output.
+
+A card is a title and description generated from a transcript. Transcripts
+are condensed to a TOKEN_BUDGET digest of their most informative segments
+(services.condense) and the digest is hashed together with PROMPT_VERSION
+and the model; that hash keys the info_card_cache collection, so identical
+transcripts are only ever sent to the model once per prompt revision. Generated cards are also stored per
+video in info_cards/{video_id}.
+
+Model calls run concurrently under a shared requests-per-minute limit, and
+responses that are not a valid card are retried instead of being guessed at.
+"""
+
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from services.clients import is_retryable_error
+from services.condense import condense, split_sentences
+from services.tracing import propagate, span
+from services.transcript_store import is_paged, load_segments
+from services.vtt import Segment, iter_segments
+
+CACHE_COLLECTION = 'info_card_cache'
+CARD_COLLECTION = 'info_cards'
+
+MODEL = 'gpt-3.5-turbo'
+PROMPT_VERSION = 2  # Bump whenever the prompt or condensation changes
+TOKEN_BUDGET = int(os.getenv('INFO_CARD_TOKEN_BUDGET', '3000'))
+MAX_TITLE_CHARS = 100
+MAX_DESCRIPTION_CHARS = 500
+
+MAX_BATCH_SIZE = 200
+MAX_CONCURRENCY = int(os.getenv('INFO_CARD_CONCURRENCY', '8'))
+REQUESTS_PER_MINUTE = int(os.getenv('INFO_CARD_RPM', '300'))
+MAX_ATTEMPTS = 3
+BACKOFF_SECONDS = 1.0
+FIRESTORE_BATCH_SIZE = 400  # Under Firestore's 500 writes per batch
+
+SYSTEM_PROMPT = "You are a helpful assistant that generates concise and engaging video titles and descriptions."
+USER_PROMPT = """Based on the following transcript, generate a title and description for a video info card.
+Keep the title under {title_chars} characters and the description under {description_chars} characters.
+Respond with a JSON object with exactly two string fields: "title" and "description".
+
+Transcript excerpts in timeline order, prefixed with their [mm:ss] start time where known:
+{transcript}"""
+
+_WHITESPACE = re.compile(r'\s+')
+_CODE_FENCE = re.compile(r'^```(?:json)?\s*|\s*```$')
+
+
+class InfoCardError(ValueError):
+    """The model response is not a usable info card."""
+
+
+class RateLimiter:
+    """Spaces calls evenly so no more than per_minute start in any minute."""
+
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+_limiter = RateLimiter(REQUESTS_PER_MINUTE)
+
+
+def transcript_pieces(transcript):
+    """(start_ms or None, text) pieces from VTT, plain text or segment dicts."""
+    if isinstance(transcript, list):
+        segments = (Segment.from_dict(segment) for segment in transcript)
+    elif '-->' in transcript:
+        segments = iter_segments(transcript.splitlines())
+    else:
+        return [(None, sentence) for sentence in split_sentences(transcript)]
+    return [(segment.start_ms, segment.text) for segment in segments]
+
+
+def prepare_transcript(transcript, budget=TOKEN_BUDGET):
+    """Token-budgeted digest of a transcript, and the condensation stats."""
+    return condense(transcript_pieces(transcript), budget)
+
+
+def transcript_source(db, video_id, transcript_data):
+    """Segments (or the raw content) of a stored transcript."""
+    if is_paged(transcript_data):
+        return load_segments(db, video_id, transcript_data) or ''
+    return transcript_data.get('segments') or transcript_data.get('content') or ''
+
+
+def cache_key(digest):
+    """Cache key for a transcript digest under the current prompt and model."""
+    return hashlib.sha256(f'{PROMPT_VERSION}\0{MODEL}\0{digest}'.encode('utf-8')).hexdigest()
+
+
+def _clip(value, limit):
+    value = _WHITESPACE.sub(' ', value).strip()
+    if len(value) <= limit:
+        return value
+    return value[:limit - 1].rsplit(' ', 1)[0].rstrip(' ,.;:-') + '…'
+
+
+def parse_info_card(content):
+    """Validate a model response and return {'title', 'description'}.
+
+    Accepts the object wrapped in a code fence or surrounding prose; raises
+    InfoCardError when there is no object with non-empty string fields.
+    """
+    text = _CODE_FENCE.sub('', (content or '').strip())
+    try:
+        card = json.loads(text)
+    except json.JSONDecodeError:
+        start, end = text.find('{'), text.rfind('}')
+        try:
+            card = json.loads(text[start:end + 1]) if 0 <= start < end else None
+        except json.JSONDecodeError:
+            card = None
+    if not isinstance(card, dict):
+        raise InfoCardError("Response is not a JSON object")
+
+    fields = {}
+    for name, limit in (('title', MAX_TITLE_CHARS), ('description', MAX_DESCRIPTION_CHARS)):
+        value = card.get(name)
+        if not isinstance(value, str) or not value.strip():
+            raise InfoCardError(f"Response has no {name}")
+        fields[name] = _clip(value.strip(' "\''), limit)
+    return fields
+
+
+def generate_card(openai, digest):
+    """Ask the model for a card, retrying transient errors and invalid output."""
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": USER_PROMPT.format(
+            title_chars=MAX_TITLE_CHARS, description_chars=MAX_DESCRIPTION_CHARS, transcript=digest)},
+    ]
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        _limiter.acquire()
+        try:
+            with span('chat_completion', attempt=attempt) as stage:
+                response = openai.ChatCompletion.create(
+                    model=MODEL,
+                    messages=messages,
+                    temperature=0.7,
+                    max_tokens=300,
+                    response_format={"type": "json_object"},
+                )
+                usage = response.get('usage') or {}
+                stage.set(prompt_tokens=usage.get('prompt_tokens'), completion_tokens=usage.get('completion_tokens'))
+            return parse_info_card(response.choices[0].message.content)
+        except InfoCardError as e:
+            if attempt == MAX_ATTEMPTS:
+                raise
+            print(f"Invalid info card response ({str(e)}), retrying")
+        except Exception as e:
+            if attempt == MAX_ATTEMPTS or not is_retryable_error(openai, e):
+                raise
+            delay = BACKOFF_SECONDS * 2 ** (attempt - 1) * (1 + random.random())
+            print(f"Info card generation failed ({str(e)}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def _commit_in_batches(db, writes):
+    for offset in range(0, len(writes), FIRESTORE_BATCH_SIZE):
+        batch = db.batch()
+        for ref, data in writes[offset:offset + FIRESTORE_BATCH_SIZE]:
+            batch.set(ref, data)
+        batch.commit()
+
+
+def generate_info_cards(db, openai, items, force=False, max_concurrency=MAX_CONCURRENCY):
+    """Generate cards for [{'videoId', 'transcript'}] items.
+
+    Items without a transcript are read from the transcripts collection.
+    Every transcript is condensed to the token budget first; identical
+    digests share one cache lookup and at most one model call;
+    force skips the cache read (results are still written back). Returns
+    (results in item order, stats).
+    """
+    from firebase_admin import firestore
+
+    missing = [item['videoId'] for item in items if not item.get('transcript') and item.get('videoId')]
+    stored = {}
+    if missing:
+        refs = [db.collection('transcripts').document(video_id) for video_id in dict.fromkeys(missing)]
+        stored = {doc.id: transcript_source(db, doc.id, doc.to_dict()) for doc in db.get_all(refs) if doc.exists}
+
+    keys = []
+    texts = {}  # cache key -> transcript digest
+    condensed = {}  # cache key -> condensation stats
+    with span('condense') as stage:
+        for item in items:
+            transcript = item.get('transcript') or stored.get(item.get('videoId'), '')
+            digest, condense_stats = prepare_transcript(transcript) if transcript else ('', None)
+            key = cache_key(digest) if digest else None
+            keys.append(key)
+            if key and key not in texts:
+                texts[key] = digest
+                condensed[key] = condense_stats
+        stage.set(
+            transcripts=len(texts),
+            original_tokens=sum(c['originalTokens'] for c in condensed.values()),
+            digest_tokens=sum(c['digestTokens'] for c in condensed.values()),
+        )
+
+    cards = {}
+    if texts and not force:
+        refs = [db.collection(CACHE_COLLECTION).document(key) for key in texts]
+        with span('cache_lookup', keys=len(refs)):
+            for doc in db.get_all(refs):
+                if doc.exists:
+                    data = doc.to_dict()
+                    cards[doc.id] = {'title': data['title'], 'description': data['description']}
+    cache_hits = set(cards)
+
+    pending = [key for key in texts if key not in cards]
+    errors = {}
+
+    def run(key):
+        try:
+            return key, generate_card(openai, texts[key]), None
+        except Exception as e:
+            return key, None, e
+
+    if pending:
+        print(f"Generating {len(pending)} info cards with concurrency {max_concurrency}")
+        with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(pending)))) as pool:
+            for key, card, error in pool.map(propagate(run), pending):
+                if error is None:
+                    cards[key] = card
+                else:
+                    errors[key] = f"{type(error).__name__}: {str(error)}"
+
+    writes = []
+    for key in pending:
+        if key in cards:
+            writes.append((db.collection(CACHE_COLLECTION).document(key), {
+                **cards[key],
+                'promptVersion': PROMPT_VERSION,
+                'model': MODEL,
+                'createdAt': firestore.SERVER_TIMESTAMP,
+            }))
+
+    results = []
+    for item, key in zip(items, keys):
+        video_id = item.get('videoId')
+        if key is None:
+            results.append({'videoId': video_id, 'error': 'No transcript found'})
+        elif key in errors:
+            results.append({'videoId': video_id, 'error': errors[key]})
+        else:
+            results.append({
+                'videoId': video_id,
+                **cards[key],
+                'cached': key in cache_hits,
+                'promptTokens': condensed[key]['digestTokens'],
+                'tokensSaved': condensed[key]['tokensSaved'],
+            })
+            if video_id:
+                writes.append((db.collection(CARD_COLLECTION).document(video_id), {
+                    **cards[key],
+                    'videoId': video_id,
+                    'cacheKey': key,
+                    'promptVersion': PROMPT_VERSION,
+                    'createdAt': firestore.SERVER_TIMESTAMP,
+                }))
+    with span('firestore_write', documents=len(writes)):
+        _commit_in_batches(db, writes)
+
+    stats = {
+        'requested': len(items),
+        'unique': len(texts),
+        'cacheHits': len(cache_hits),
+        'generated': len(pending) - len(errors),
+        'failed': sum(1 for result in results if 'error' in result),
+        # Transcript tokens actually sent, and kept out of prompts by condensation
+        'promptTokens': sum(condensed[key]['digestTokens'] for key in pending),
+        'tokensSaved': sum(condensed[key]['tokensSaved'] for key in pending),
+    }
+    return results, stats
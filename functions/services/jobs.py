@@ -0,0 +1,119 @@
+"""Processing job state for the upload -> audio -> transcript -> info card pipeline.
+
+Each video has one job document, processing_jobs/{video_id}, that the app
+can watch:
+
+    status       queued | running | done | failed
+    stage        the stage that is queued, running or failed
+    stages       {stage: {status, startedAt, finishedAt, seconds, result}}
+    error        message of the failure, when status is failed
+
+Writing a stage as queued is what enqueues it: the document trigger in
+main.py runs whichever stage has just become queued, and completing a
+stage queues the next one.
+"""
+
+import time
+
+JOB_COLLECTION = 'processing_jobs'
+STAGES = ('convert', 'transcribe', 'info_card')
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def job_ref(db, video_id):
+    return db.collection(JOB_COLLECTION).document(video_id)
+
+
+def enqueue_job(db, video_id, stage=STAGES[0]):
+    """Create (or restart) the job for a video at stage.
+
+    A restart rewrites the job in full: stage from onwards starts over,
+    with nothing left of the previous attempt's results or timings. Stages
+    before it keep their entries, and createdAt keeps the first enqueue.
+    """
+    from firebase_admin import firestore
+
+    ref = job_ref(db, video_id)
+
+    @firestore.transactional
+    def enqueue(transaction):
+        snapshot = ref.get(transaction=transaction)
+        previous = snapshot.to_dict() if snapshot.exists else {}
+        first = STAGES.index(stage)
+        stages = {name: (previous.get('stages') or {}).get(name) for name in STAGES[:first]}
+        stages.update({name: {'status': QUEUED if name == stage else None} for name in STAGES[first:]})
+        transaction.set(ref, {
+            'videoId': video_id,
+            'status': QUEUED,
+            'stage': stage,
+            'stages': {name: entry for name, entry in stages.items() if entry is not None},
+            'error': None,
+            'createdAt': previous.get('createdAt') or firestore.SERVER_TIMESTAMP,
+            'updatedAt': firestore.SERVER_TIMESTAMP,
+        })
+
+    enqueue(db.transaction())
+
+
+def became_queued(before, after):
+    """True if a job write just queued a stage, i.e. there is work to start.
+
+    before/after are job dicts (None when the document did not exist).
+    Writes made while a stage runs or finishes leave the job unqueued, so
+    they do not start anything.
+    """
+    if not after or after.get('status') != QUEUED:
+        return False
+    return not before or before.get('status') != QUEUED or before.get('stage') != after.get('stage')
+
+
+def start_stage(db, video_id, stage):
+    """Mark stage running; returns the monotonic start time."""
+    from firebase_admin import firestore
+
+    job_ref(db, video_id).update({
+        'status': RUNNING,
+        'stage': stage,
+        f'stages.{stage}.status': RUNNING,
+        f'stages.{stage}.startedAt': firestore.SERVER_TIMESTAMP,
+        'updatedAt': firestore.SERVER_TIMESTAMP,
+    })
+    return time.monotonic()
+
+
+def complete_stage(db, video_id, stage, started, result=None):
+    """Record the stage's duration and result, then queue the next stage."""
+    from firebase_admin import firestore
+
+    next_index = STAGES.index(stage) + 1
+    update = {
+        f'stages.{stage}.status': DONE,
+        f'stages.{stage}.finishedAt': firestore.SERVER_TIMESTAMP,
+        f'stages.{stage}.seconds': round(time.monotonic() - started, 3),
+        f'stages.{stage}.result': result or {},
+        'updatedAt': firestore.SERVER_TIMESTAMP,
+    }
+    if next_index < len(STAGES):
+        next_stage = STAGES[next_index]
+        update.update({'status': QUEUED, 'stage': next_stage, f'stages.{next_stage}.status': QUEUED})
+    else:
+        update['status'] = DONE
+    job_ref(db, video_id).update(update)
+
+
+def fail_stage(db, video_id, stage, started, error):
+    """Mark the stage and the job failed."""
+    from firebase_admin import firestore
+
+    job_ref(db, video_id).update({
+        'status': FAILED,
+        'error': f"{stage}: {str(error)}",
+        f'stages.{stage}.status': FAILED,
+        f'stages.{stage}.finishedAt': firestore.SERVER_TIMESTAMP,
+        f'stages.{stage}.seconds': round(time.monotonic() - started, 3),
+        'updatedAt': firestore.SERVER_TIMESTAMP,
+    })
@@ -0,0 +1,212 @@
+"""Lease-based locking so one video is never converted or transcribed twice at once.
+
+Work on a (kind, video_id) pair runs under a lease document,
+job_leases/{kind}:{video_id}, acquired in a Firestore transaction. While the
+work runs a heartbeat thread keeps pushing expiresAt forward; if the holder
+dies the lease simply expires after LEASE_SECONDS and the next caller takes
+it over.
+
+A caller that finds a live lease does not duplicate the work: it waits for
+the holder to finish and then runs the work itself under the lease, which
+finds the holder's output already in place (current audio, stored
+transcript) and returns it without calling ffmpeg or Whisper. Each
+suppressed duplicate is counted on the lease and in metrics/job_leases.
+
+A holder that gives up for reasons of its own rather than the video's
+(no room on its instance) releases the lease as yielded instead of
+failed. Waiters then take the lease and try the work themselves instead
+of failing along with it.
+"""
+
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from services.tracing import span
+
+LEASE_COLLECTION = 'job_leases'
+METRICS_DOCUMENT = ('metrics', 'job_leases')
+
+LEASE_SECONDS = 60
+HEARTBEAT_SECONDS = 20
+POLL_SECONDS = 1.0
+WAIT_TIMEOUT_SECONDS = int(os.getenv('LEASE_WAIT_TIMEOUT_SECONDS', '540'))
+
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+YIELDED = 'yielded'
+
+# Per-instance counters, logged with every suppressed duplicate
+LEASE_STATS = {'acquired': 0, 'takeovers': 0, 'suppressed': 0}
+
+
+class LeaseHolderFailed(Exception):
+    """The request holding the lease failed, so waiting for it produced nothing."""
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def lease_ref(db, kind, video_id):
+    return db.collection(LEASE_COLLECTION).document(f'{kind}:{video_id}')
+
+
+def _is_live(lease, now):
+    return bool(lease) and lease.get('status') == RUNNING and lease.get('expiresAt') and lease['expiresAt'] > now
+
+
+def try_acquire(db, kind, video_id, owner):
+    """Take the lease unless someone else holds a live one.
+
+    Returns (acquired, lease dict as found).
+    """
+    from firebase_admin import firestore
+
+    ref = lease_ref(db, kind, video_id)
+
+    @firestore.transactional
+    def acquire(transaction):
+        snapshot = ref.get(transaction=transaction)
+        lease = snapshot.to_dict() if snapshot.exists else None
+        now = _now()
+        if _is_live(lease, now) and lease.get('owner') != owner:
+            transaction.update(ref, {'duplicates': firestore.Increment(1)})
+            return False, lease
+        transaction.set(ref, {
+            'kind': kind,
+            'videoId': video_id,
+            'owner': owner,
+            'status': RUNNING,
+            'acquiredAt': now,
+            'expiresAt': now + timedelta(seconds=LEASE_SECONDS),
+            'error': None,
+        }, merge=True)
+        return True, lease
+
+    return acquire(db.transaction())
+
+
+def _heartbeat(db, kind, video_id, owner, stop):
+    """Extend the lease every HEARTBEAT_SECONDS until stop is set."""
+    from firebase_admin import firestore
+
+    ref = lease_ref(db, kind, video_id)
+
+    @firestore.transactional
+    def extend(transaction):
+        snapshot = ref.get(transaction=transaction)
+        if not snapshot.exists or snapshot.get('owner') != owner:
+            return False
+        transaction.update(ref, {'expiresAt': _now() + timedelta(seconds=LEASE_SECONDS)})
+        return True
+
+    while not stop.wait(HEARTBEAT_SECONDS):
+        try:
+            if not extend(db.transaction()):
+                print(f"Lost lease {kind}:{video_id}; another request may now run the same work")
+                return
+        except Exception as e:
+            # A missed beat is fine as long as a later one lands before expiry
+            print(f"Lease heartbeat for {kind}:{video_id} failed: {str(e)}")
+
+
+def release(db, kind, video_id, owner, error=None, status=None):
+    """Mark the lease finished, if we still hold it.
+
+    status defaults to FAILED when there is an error and DONE otherwise.
+    """
+    from firebase_admin import firestore
+
+    ref = lease_ref(db, kind, video_id)
+
+    @firestore.transactional
+    def finish(transaction):
+        snapshot = ref.get(transaction=transaction)
+        if snapshot.exists and snapshot.get('owner') == owner:
+            transaction.update(ref, {
+                'status': status or (FAILED if error is not None else DONE),
+                'error': str(error) if error is not None else None,
+                'finishedAt': _now(),
+            })
+
+    finish(db.transaction())
+
+
+def wait_for_release(db, kind, video_id, deadline):
+    """Poll until the live lease is released or expires; returns the final lease."""
+    ref = lease_ref(db, kind, video_id)
+    while True:
+        snapshot = ref.get()
+        lease = snapshot.to_dict() if snapshot.exists else None
+        if not _is_live(lease, _now()):
+            return lease
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"Timed out waiting for in-flight {kind} of video {video_id}")
+        time.sleep(POLL_SECONDS)
+
+
+def _record_suppressed(db, kind, video_id):
+    from firebase_admin import firestore
+
+    LEASE_STATS['suppressed'] += 1
+    print(f"Duplicate {kind} of video {video_id} suppressed, waiting for the in-flight one ({LEASE_STATS})")
+    try:
+        db.collection(METRICS_DOCUMENT[0]).document(METRICS_DOCUMENT[1]).set(
+            {'suppressed': {kind: firestore.Increment(1)}}, merge=True
+        )
+    except Exception as e:
+        print(f"Could not record lease metrics: {str(e)}")
+
+
+def run_exclusive(db, kind, video_id, work, wait_timeout=WAIT_TIMEOUT_SECONDS, yield_on=()):
+    """Run work() while holding the (kind, video_id) lease.
+
+    If another request holds it, wait for that one to finish and then run
+    work() (which should find the finished output and return quickly).
+    Exceptions of the types in yield_on release the lease as YIELDED, so
+    waiters run work() themselves instead of raising LeaseHolderFailed;
+    the exception is still raised to this caller. Returns (result,
+    waited_seconds); waited_seconds is None when nothing was in flight.
+    """
+    owner = uuid.uuid4().hex
+    started = time.monotonic()
+    deadline = started + wait_timeout
+    waited = False
+
+    while True:
+        acquired, previous = try_acquire(db, kind, video_id, owner)
+        if acquired:
+            break
+        if not waited:
+            _record_suppressed(db, kind, video_id)
+            waited = True
+        with span('lease_wait', kind=kind):
+            lease = wait_for_release(db, kind, video_id, deadline)
+        if lease and lease.get('status') == FAILED and lease.get('owner') == previous.get('owner'):
+            raise LeaseHolderFailed(f"Concurrent {kind} of video {video_id} failed: {lease.get('error')}")
+
+    LEASE_STATS['acquired'] += 1
+    if previous and previous.get('status') == RUNNING:
+        LEASE_STATS['takeovers'] += 1
+        print(f"Took over expired lease {kind}:{video_id} from {previous.get('owner')}")
+
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat, args=(db, kind, video_id, owner, stop), daemon=True)
+    heartbeat.start()
+    try:
+        result = work()
+    except yield_on as e:
+        stop.set()
+        release(db, kind, video_id, owner, error=e, status=YIELDED)
+        raise
+    except Exception as e:
+        stop.set()
+        release(db, kind, video_id, owner, error=e)
+        raise
+    stop.set()
+    release(db, kind, video_id, owner)
+    return result, (round(time.monotonic() - started, 3) if waited else None)
@@ -0,0 +1,166 @@
+"""Probe-once metadata of uploaded videos.
+
+ffprobe runs once per blob generation and its summary is cached on the
+video document as mediaInfo, so later conversions and retries know the
+duration and which audio stream to use (or that there is none) without
+probing again:
+
+    duration     seconds: the audio stream's, else the container's
+    hasAudio     False when there is no usable audio stream
+    audioIndex   position among the audio streams (ffmpeg's a:N)
+    audioCodec, channels, sampleRate, videoCodec, width, height, formatName
+    faststart    True/False when known from the MP4 atom layout
+    generation   source blob generation the summary belongs to
+
+For MP4/MOV sources only the metadata atoms are fetched, with ranged reads,
+so a video without audio is rejected before any media data is downloaded.
+Other containers are probed once the file has been downloaded.
+"""
+
+import os
+
+import ffmpeg
+
+from services.storage import iter_mp4_atoms
+
+MEDIA_INFO_FIELD = 'mediaInfo'
+
+# Atoms with media data or padding, left out of the header copy
+_DATA_ATOMS = (b'mdat', b'free', b'skip', b'wide')
+MAX_HEADER_BYTES = 32 * 1024 * 1024  # A moov this large is not worth fetching on its own
+
+
+def _number(value):
+    """ffprobe numeric field, None when missing or 'N/A'."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def select_audio_stream(streams):
+    """Return (audio index, stream) of the audio to extract, or (None, None).
+
+    The stream flagged as default wins, otherwise the first one; streams
+    ffprobe could not identify a codec for are skipped.
+    """
+    audio = [s for s in streams if s.get('codec_type') == 'audio']
+    candidates = [(index, s) for index, s in enumerate(audio) if s.get('codec_name') not in (None, 'none')]
+    for index, stream in candidates:
+        if (stream.get('disposition') or {}).get('default'):
+            return index, stream
+    return candidates[0] if candidates else (None, None)
+
+
+def summarize(probe):
+    """Reduce ffprobe output to the fields conversion needs."""
+    streams = probe.get('streams') or []
+    audio_index, audio = select_audio_stream(streams)
+    video = next((s for s in streams if s.get('codec_type') == 'video'), None)
+    container = probe.get('format') or {}
+    duration = (_number((audio or {}).get('duration'))
+                or _number(container.get('duration'))
+                or max((_number(s.get('duration')) or 0 for s in streams), default=0)
+                or None)
+    return {
+        'duration': duration,
+        'hasAudio': audio is not None,
+        'audioIndex': audio_index,
+        'audioCodec': (audio or {}).get('codec_name'),
+        'channels': (audio or {}).get('channels'),
+        'sampleRate': int(_number((audio or {}).get('sample_rate')) or 0) or None,
+        'videoCodec': (video or {}).get('codec_name'),
+        'width': (video or {}).get('width'),
+        'height': (video or {}).get('height'),
+        'formatName': container.get('format_name'),
+    }
+
+
+def probe_file(path):
+    """Probe a local file."""
+    try:
+        return summarize(ffmpeg.probe(path))
+    except ffmpeg.Error as e:
+        stderr = e.stderr.decode(errors='replace').strip() if e.stderr else str(e)
+        raise Exception(f"Could not probe {os.path.basename(path)}: {stderr[-500:]}")
+
+
+def fetch_mp4_header(blob, path):
+    """Copy an MP4's top-level atoms, minus the media data, to path.
+
+    Returns whether moov precedes the media data (faststart), or None if
+    the blob is not an MP4 or its header is unusually large.
+    """
+    written = 0
+    moov_seen = False
+    faststart = None
+    with open(path, 'wb') as f:
+        for atom_type, offset, size in iter_mp4_atoms(blob):
+            if atom_type in _DATA_ATOMS:
+                if atom_type == b'mdat' and faststart is None:
+                    faststart = moov_seen
+                continue
+            written += size
+            if written > MAX_HEADER_BYTES:
+                return None
+            f.write(blob.download_as_bytes(start=offset, end=offset + size - 1))
+            moov_seen = moov_seen or atom_type == b'moov'
+    if not moov_seen:
+        return None
+    return True if faststart is None else faststart
+
+
+def probe_blob(blob, work_dir):
+    """Probe a blob from its MP4 header alone; None if that is not possible."""
+    header_path = os.path.join(work_dir, 'probe_header.mp4')
+    try:
+        faststart = fetch_mp4_header(blob, header_path)
+        if faststart is None:
+            return None
+        info = probe_file(header_path)
+    except Exception as e:
+        print(f"Header probe of {blob.name} failed, will probe after download: {str(e)}")
+        return None
+    finally:
+        if os.path.exists(header_path):
+            os.remove(header_path)
+    info['faststart'] = faststart
+    return info
+
+
+def cached_media_info(video_data, generation):
+    """The mediaInfo on a video document, if it describes this blob generation."""
+    info = (video_data or {}).get(MEDIA_INFO_FIELD)
+    if info and info.get('generation') == generation:
+        return info
+    return None
+
+
+def save_media_info(db, video_id, info, generation):
+    """Cache a probe summary on the video document."""
+    from firebase_admin import firestore
+
+    info = {**info, 'generation': generation}
+    try:
+        db.collection('videos').document(video_id).update({
+            MEDIA_INFO_FIELD: {**info, 'probedAt': firestore.SERVER_TIMESTAMP},
+        })
+    except Exception as e:
+        # Only a missed cache: the next request probes again
+        print(f"Could not cache media info for video {video_id}: {str(e)}")
+    return info
+
+
+def get_media_info(db, video_id, video_data, blob, generation, work_dir):
+    """Cached or header-probed media info for a video; returns (info or None, source).
+
+    source is 'cache', 'header' or None when the video has to be downloaded
+    before it can be probed (see probe_file).
+    """
+    info = cached_media_info(video_data, generation)
+    if info is not None:
+        return info, 'cache'
+    info = probe_blob(blob, work_dir)
+    if info is None:
+        return None, None
+    return save_media_info(db, video_id, info, generation), 'header'
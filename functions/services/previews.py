@@ -0,0 +1,180 @@
+"""Thumbnail, scene keyframes and a sprite sheet, from the decode that extracts the audio.
+
+convert_video downloads a video once. When previews are requested, the
+ffmpeg process that extracts the audio also decodes the video stream. It
+splits that stream three ways:
+
+    thumbnail   a representative frame (ffmpeg's thumbnail filter), THUMBNAIL_WIDTH wide
+    keyframes   the first frame plus every scene change, up to MAX_KEYFRAMES
+    sprite      one TILE_WIDTH tile every sprite_interval() seconds, in one sheet
+
+Everything is uploaded under previews/{video_id}/. The storage paths are
+recorded on the video document as previews, along with the keyframe times
+and the sprite grid. The generation stored with them lets a retry of the
+same upload skip the work.
+"""
+
+import glob
+import math
+import os
+import re
+import urllib.parse
+import uuid
+
+import ffmpeg
+
+from services.converter import run_ffmpeg
+from services.media_info import probe_file
+
+PREVIEWS_FIELD = 'previews'
+PREVIEW_PREFIX = 'previews'
+
+THUMBNAIL_WIDTH = 640
+THUMBNAIL_BATCH_FRAMES = 300  # The thumbnail is the most typical of the first this many frames
+KEYFRAME_WIDTH = 480
+SCENE_THRESHOLD = 0.35
+MAX_KEYFRAMES = 24
+TILE_WIDTH = 160
+SPRITE_COLUMNS = 10
+MAX_SPRITE_TILES = 100
+JPEG_QUALITY = 4  # ffmpeg -q:v, 2 (best) to 31
+
+_PTS_TIME = re.compile(r'pts_time:(\d+(?:\.\d+)?)')
+
+
+def sprite_interval(duration):
+    """Whole seconds between sprite tiles, so the video fits one sheet of MAX_SPRITE_TILES."""
+    return max(1, math.ceil((duration or 0) / MAX_SPRITE_TILES))
+
+
+class PreviewPlan:
+    """The preview outputs of one ffmpeg run, written to out_dir."""
+
+    def __init__(self, out_dir, duration):
+        self.out_dir = out_dir
+        self.interval = sprite_interval(duration)
+        tiles = max(1, math.ceil((duration or 0) / self.interval))
+        self.columns = min(SPRITE_COLUMNS, tiles)
+        self.rows = math.ceil(tiles / self.columns)
+        self.thumbnail_path = os.path.join(out_dir, 'thumbnail.jpg')
+        self.sprite_path = os.path.join(out_dir, 'sprite.jpg')
+        self.keyframe_pattern = os.path.join(out_dir, 'keyframe_%03d.jpg')
+        self.keyframe_log = os.path.join(out_dir, 'keyframes.txt')
+        os.makedirs(out_dir, exist_ok=True)
+
+    def outputs(self, video):
+        """ffmpeg output nodes for the thumbnail, sprite and keyframes of one video stream."""
+        branches = video.filter_multi_output('split', 3)
+        jpeg = {'q:v': JPEG_QUALITY}
+        thumbnail = (branches[0]
+                     .filter('thumbnail', THUMBNAIL_BATCH_FRAMES)
+                     .filter('scale', f'min({THUMBNAIL_WIDTH},iw)', -2))
+        sprite = (branches[1]
+                  .filter('fps', fps=f'1/{self.interval}')
+                  .filter('scale', TILE_WIDTH, -2)
+                  .filter('tile', f'{self.columns}x{self.rows}'))
+        # Scene scores are computed on the scaled frames, which is much cheaper
+        keyframes = (branches[2]
+                     .filter('scale', f'min({KEYFRAME_WIDTH},iw)', -2)
+                     .filter('select', f'eq(n,0)+gt(scene,{SCENE_THRESHOLD})')
+                     .filter('metadata', mode='print', file=self.keyframe_log))
+        return [
+            ffmpeg.output(thumbnail, self.thumbnail_path, vframes=1, **jpeg),
+            ffmpeg.output(sprite, self.sprite_path, vframes=1, **jpeg),
+            ffmpeg.output(keyframes, self.keyframe_pattern, vsync='vfr', vframes=MAX_KEYFRAMES, **jpeg),
+        ]
+
+    def keyframes(self):
+        """[(time_ms, local path)] of the keyframes written, in timeline order."""
+        times = []
+        if os.path.exists(self.keyframe_log):
+            with open(self.keyframe_log) as f:
+                times = [round(float(match.group(1)) * 1000) for match in map(_PTS_TIME.search, f) if match]
+        paths = sorted(glob.glob(os.path.join(self.out_dir, 'keyframe_*.jpg')))
+        return list(zip(times, paths))
+
+    def tile_size(self):
+        """(width, height) of one sprite tile, read back from the sheet (rotation is applied by then)."""
+        info = probe_file(self.sprite_path)
+        return info['width'] // self.columns, info['height'] // self.rows
+
+
+def extract_previews(input_path, plan, threads=1):
+    """Preview-only ffmpeg run, for when the audio needs no extraction from this download."""
+    video = ffmpeg.input(input_path, threads=threads)['v:0']
+    try:
+        run_ffmpeg(ffmpeg.merge_outputs(*plan.outputs(video)).global_args('-loglevel', 'error'),
+                   overwrite_output=True)
+    except ffmpeg.Error as e:
+        stderr = e.stderr.decode(errors='replace').strip() if e.stderr else str(e)
+        raise Exception(f"Preview extraction failed: {stderr[-1000:]}")
+
+
+def _upload_jpeg(bucket, path, local_path, token=None):
+    blob = bucket.blob(path)
+    if token:
+        # What Firebase download URLs (like videoUrl) authorize against
+        blob.metadata = {'firebaseStorageDownloadTokens': token}
+    blob.upload_from_filename(local_path, content_type='image/jpeg')
+    return blob
+
+
+def download_url(bucket, path, token):
+    return (f"https://firebasestorage.googleapis.com/v0/b/{bucket.name}/o/"
+            f"{urllib.parse.quote(path, safe='')}?alt=media&token={token}")
+
+
+def upload_previews(bucket, video_id, plan):
+    """Upload a plan's outputs; returns the previews summary for the video document."""
+    prefix = f'{PREVIEW_PREFIX}/{video_id}'
+    if not os.path.exists(plan.thumbnail_path) or not os.path.exists(plan.sprite_path):
+        raise Exception("Preview images were not created")
+
+    token = str(uuid.uuid4())
+    uploaded = [_upload_jpeg(bucket, f'{prefix}/thumbnail.jpg', plan.thumbnail_path, token).name,
+                _upload_jpeg(bucket, f'{prefix}/sprite.jpg', plan.sprite_path).name]
+    keyframes = []
+    for index, (time_ms, local_path) in enumerate(plan.keyframes()):
+        path = _upload_jpeg(bucket, f'{prefix}/keyframes/{index:03d}.jpg', local_path).name
+        uploaded.append(path)
+        keyframes.append({'timeMs': time_ms, 'path': path})
+
+    # Keyframes of an earlier upload of this video beyond the new count
+    for blob in bucket.list_blobs(prefix=f'{prefix}/'):
+        if blob.name not in uploaded:
+            blob.delete()
+
+    tile_width, tile_height = plan.tile_size()
+    return {
+        'thumbnailPath': f'{prefix}/thumbnail.jpg',
+        'thumbnailUrl': download_url(bucket, f'{prefix}/thumbnail.jpg', token),
+        'sprite': {
+            'path': f'{prefix}/sprite.jpg',
+            'columns': plan.columns,
+            'rows': plan.rows,
+            'intervalSeconds': plan.interval,
+            'tileWidth': tile_width,
+            'tileHeight': tile_height,
+        },
+        'keyframes': keyframes,
+    }
+
+
+def previews_current(video_data, generation):
+    """Whether the video document has previews of this blob generation."""
+    return ((video_data or {}).get(PREVIEWS_FIELD) or {}).get('generation') == generation
+
+
+def save_previews(db, video_id, video_data, summary, generation):
+    """Record previews on the video document.
+
+    thumbnailUrl is only set when the video has none, or still has the one
+    set from previews; a thumbnail chosen in the app is left alone.
+    """
+    from firebase_admin import firestore
+
+    update = {PREVIEWS_FIELD: {**summary, 'generation': generation, 'createdAt': firestore.SERVER_TIMESTAMP}}
+    current = (video_data or {}).get('thumbnailUrl')
+    if not current or current == ((video_data or {}).get(PREVIEWS_FIELD) or {}).get('thumbnailUrl'):
+        update['thumbnailUrl'] = summary['thumbnailUrl']
+    db.collection('videos').document(video_id).update(update)
@@ -0,0 +1,44 @@
+"""Instance resource readings used to size worker pools."""
+
+import os
+
+import psutil
+
+# cgroup v2 and v1 locations of the container memory limit and usage
+_CGROUP_LIMIT_FILES = ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes')
+_CGROUP_USAGE_FILES = ('/sys/fs/cgroup/memory.current', '/sys/fs/cgroup/memory/memory.usage_in_bytes')
+
+
+def _read_cgroup_value(paths):
+    """Return the first readable numeric cgroup value, or None."""
+    for path in paths:
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value.isdigit():
+            return int(value)
+    return None
+
+
+def get_available_memory_mb():
+    """Memory headroom in MB, honouring the container limit when there is one.
+
+    psutil reports host memory inside Cloud Functions, which can be far more
+    than the instance is allowed to use, so the cgroup limit wins when set.
+    """
+    available = psutil.virtual_memory().available
+    limit = _read_cgroup_value(_CGROUP_LIMIT_FILES)
+    usage = _read_cgroup_value(_CGROUP_USAGE_FILES)
+    if limit and usage is not None and limit < available + usage:
+        available = min(available, max(limit - usage, 0))
+    return available / 1024 / 1024
+
+
+def get_cpu_count():
+    """Number of CPUs this process may run on."""
+    try:
+        return len(os.sched_getaffinity(0)) or 1
+    except AttributeError:
+        return psutil.cpu_count(logical=True) or 1
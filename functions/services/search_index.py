@@ -0,0 +1,344 @@
+"""Per-video inverted index over transcript segments.
+
+The index is built when a transcript is created and stored as one small
+Firestore document in transcript_indexes/{video_id}. Integer arrays are
+packed into bytes fields so a long transcript stays one value per field
+instead of thousands of indexed array entries.
+
+Each index holds:
+  - terms: the sorted vocabulary, so prefix lookups are a bisect range
+  - postings: the segment positions of every term, in timeline order
+  - starts/ends: segment times in ms, sorted, for O(log n) timestamp seeks
+
+Segment text is not stored in the index; it stays in the transcript
+pages (transcript_store). Position k is the k-th segment by start time,
+so its page and slot follow from starts, and a lookup reads only the
+pages holding its results. An index too large for one document is not
+stored, and is rebuilt from the pages when an instance first needs it.
+"""
+
+import re
+import sys
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+from services.transcript_store import is_paged, load_header, load_pages, load_segments
+from services.vtt import Segment, format_timestamp
+
+INDEX_COLLECTION = 'transcript_indexes'
+INDEX_VERSION = 2
+MAX_DOCUMENT_BYTES = 900 * 1024  # Firestore's limit is 1 MiB, field names and metadata included
+
+MIN_SUBSTRING_LENGTH = 3  # Shorter fragments only match as prefixes
+CACHE_SIZE = 64
+CACHE_TTL_SECONDS = 300
+
+_TOKEN = re.compile(r"\w+(?:'\w+)*")
+
+
+def tokenize(text):
+    """Lowercased word tokens of text."""
+    return _TOKEN.findall(text.casefold())
+
+
+def _pack(values):
+    packed = array('I', values)
+    if sys.byteorder == 'big':
+        packed.byteswap()  # Stored little-endian
+    return packed.tobytes()
+
+
+def _unpack(data):
+    values = array('I')
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+class StaleIndexError(Exception):
+    """The index no longer lines up with the transcript it was built from."""
+
+
+class SearchIndex:
+    """In-memory form of a transcript index.
+
+    texts maps positions to segment text, filled from the transcript as
+    lookups need it. page_seconds is the page size of the transcript the
+    index was built from, None for a legacy unpaged transcript.
+    """
+
+    __slots__ = ('terms', 'posting_offsets', 'postings', 'starts', 'ends', 'page_seconds', 'texts')
+
+    def __init__(self, terms, posting_offsets, postings, starts, ends, page_seconds=None, texts=None):
+        self.terms = terms
+        self.posting_offsets = posting_offsets
+        self.postings = postings
+        self.starts = starts
+        self.ends = ends
+        self.page_seconds = page_seconds
+        self.texts = dict(enumerate(texts)) if texts is not None else {}
+
+    @classmethod
+    def from_segments(cls, segments, page_seconds=None):
+        """Build an index from Segments or segment dicts, in timeline order."""
+        records = sorted(
+            (s if isinstance(s, Segment) else Segment.from_dict(s) for s in segments),
+            key=lambda s: s.start_ms
+        )
+        term_positions = {}
+        for position, segment in enumerate(records):
+            for token in set(tokenize(segment.text)):
+                term_positions.setdefault(token, []).append(position)
+
+        terms = sorted(term_positions)
+        posting_offsets = array('I', [0])
+        postings = array('I')
+        for term in terms:
+            postings.extend(term_positions[term])
+            posting_offsets.append(len(postings))
+
+        return cls(
+            terms,
+            posting_offsets,
+            postings,
+            array('I', (s.start_ms for s in records)),
+            array('I', (s.end_ms for s in records)),
+            page_seconds,
+            [s.text for s in records],
+        )
+
+    @classmethod
+    def from_document(cls, data):
+        """Load an index from its Firestore document."""
+        return cls(
+            data['terms'].split('\n') if data['terms'] else [],
+            _unpack(data['postingOffsets']),
+            _unpack(data['postings']),
+            _unpack(data['starts']),
+            _unpack(data['ends']),
+            data.get('pageSeconds'),
+        )
+
+    def to_document(self):
+        """Firestore document for this index."""
+        return {
+            'version': INDEX_VERSION,
+            'segmentCount': len(self.starts),
+            'terms': '\n'.join(self.terms),
+            'postingOffsets': _pack(self.posting_offsets),
+            'postings': _pack(self.postings),
+            'starts': _pack(self.starts),
+            'ends': _pack(self.ends),
+            'pageSeconds': self.page_seconds,
+        }
+
+    def _term_positions(self, term_index):
+        return self.postings[self.posting_offsets[term_index]:self.posting_offsets[term_index + 1]]
+
+    def match_token(self, token):
+        """Segment positions containing a word starting with token.
+
+        Tokens of MIN_SUBSTRING_LENGTH or more that prefix nothing fall back
+        to matching anywhere inside a word.
+        """
+        low = bisect_left(self.terms, token)
+        high = bisect_left(self.terms, token + '\U0010ffff', low)
+        term_indexes = range(low, high)
+        if not term_indexes and len(token) >= MIN_SUBSTRING_LENGTH:
+            term_indexes = [i for i, term in enumerate(self.terms) if token in term]
+
+        positions = set()
+        for term_index in term_indexes:
+            positions.update(self._term_positions(term_index))
+        return positions
+
+    def search(self, query, limit=50):
+        """Positions of the segments matching every query token (as prefixes), in timeline order."""
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+
+        matches = None
+        # Rarest-looking (longest) tokens first keeps the intersection small
+        for token in sorted(set(tokens), key=len, reverse=True):
+            positions = self.match_token(token)
+            matches = positions if matches is None else matches & positions
+            if not matches:
+                return []
+
+        return sorted(matches)[:limit]
+
+    def position_at(self, time_ms):
+        """Position of the segment playing at time_ms (the last one starting before it)."""
+        position = bisect_right(self.starts, time_ms) - 1
+        return max(position, 0) if self.starts else None
+
+    def segment(self, position):
+        """Response representation of one segment; its text must have been loaded (load_texts)."""
+        return {
+            'position': position,
+            'start': format_timestamp(self.starts[position]),
+            'end': format_timestamp(self.ends[position]),
+            'startMs': self.starts[position],
+            'endMs': self.ends[position],
+            'text': self.texts[position],
+        }
+
+
+def document_size(document):
+    """Approximate stored size of an index document, in bytes."""
+    def value_size(value):
+        if isinstance(value, str):
+            return len(value.encode()) + 1
+        if isinstance(value, bytes):
+            return len(value)
+        return 8
+    return sum(len(key) + 1 + value_size(value) for key, value in document.items())
+
+
+def save_index(db, video_id, segments, header=None):
+    """Build and store the index for a video's segments; returns the index.
+
+    header is the transcript header the segments were saved under. An
+    index over MAX_DOCUMENT_BYTES is not stored: any older one is deleted
+    and the index is rebuilt from the transcript when an instance needs it.
+    """
+    from firebase_admin import firestore
+
+    index = SearchIndex.from_segments(segments, header.get('pageSeconds') if is_paged(header) else None)
+    document = index.to_document()
+    ref = db.collection(INDEX_COLLECTION).document(video_id)
+    _cache.pop(video_id, None)
+    size = document_size(document)
+    if size > MAX_DOCUMENT_BYTES:
+        print(f"Index of video {video_id} is {size} bytes, too large to store; it is built on demand")
+        ref.delete()
+        return index
+
+    document.update({
+        'videoId': video_id,
+        'createdAt': firestore.SERVER_TIMESTAMP,
+    })
+    ref.set(document)
+    return index
+
+
+def index_transcript(db, video_id, segments, header):
+    """save_index for a freshly saved transcript, never failing the transcription.
+
+    If the index cannot be written, the previous one is removed so search
+    rebuilds it from the new transcript instead of serving stale results.
+    """
+    try:
+        save_index(db, video_id, segments, header)
+    except Exception as e:
+        print(f"Could not index transcript of video {video_id}: {str(e)}")
+        try:
+            db.collection(INDEX_COLLECTION).document(video_id).delete()
+        except Exception as delete_error:
+            print(f"Could not remove the old index of video {video_id}: {str(delete_error)}")
+
+
+_cache = OrderedDict()  # video_id -> (loaded_at, SearchIndex)
+
+
+def load_index(db, video_id):
+    """Return the video's index, from the per-instance cache when fresh.
+
+    Transcripts created before indexing existed are indexed on first use.
+    Returns None if the video has no transcript.
+    """
+    cached = _cache.get(video_id)
+    if cached and time.monotonic() - cached[0] < CACHE_TTL_SECONDS:
+        _cache.move_to_end(video_id)
+        return cached[1]
+
+    index_doc = db.collection(INDEX_COLLECTION).document(video_id).get()
+    if index_doc.exists and index_doc.get('version') == INDEX_VERSION:
+        index = SearchIndex.from_document(index_doc.to_dict())
+    else:
+        index = rebuild_index(db, video_id)
+        if index is None:
+            return None
+    return _remember(video_id, index)
+
+
+def _remember(video_id, index):
+    _cache[video_id] = (time.monotonic(), index)
+    if len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+    return index
+
+
+def rebuild_index(db, video_id):
+    """Index the video's stored transcript again; None if it has none."""
+    header = load_header(db, video_id)
+    if header is None:
+        return None
+    return save_index(db, video_id, load_segments(db, video_id, header) or [], header)
+
+
+def load_texts(db, video_id, index, positions):
+    """Fill index.texts for positions from the transcript, reading only the pages that hold them.
+
+    Raises StaleIndexError if the transcript no longer matches the index.
+    """
+    missing = sorted({position for position in positions if position not in index.texts})
+    if not missing:
+        return
+
+    if not index.page_seconds:
+        segments = sorted(load_segments(db, video_id) or [], key=lambda segment: segment['startMs'])
+        if len(segments) != len(index.starts):
+            raise StaleIndexError(f"Transcript of video {video_id} has changed")
+        index.texts.update((position, segment['text']) for position, segment in enumerate(segments))
+        return
+
+    page_ms = index.page_seconds * 1000
+    by_page = {}
+    for position in missing:
+        by_page.setdefault(index.starts[position] // page_ms, []).append(position)
+    pages = load_pages(db, video_id, by_page)
+    for page, page_positions in by_page.items():
+        segments = pages.get(page) or []
+        first = bisect_left(index.starts, page * page_ms)
+        for position in page_positions:
+            slot = position - first
+            if slot >= len(segments) or (segments[slot]['startMs'], segments[slot]['endMs']) != (
+                    index.starts[position], index.ends[position]):
+                raise StaleIndexError(f"Transcript of video {video_id} has changed")
+            index.texts[position] = segments[slot]['text']
+
+
+def _lookup(db, video_id, index, query, at_ms, limit):
+    matches = index.search(query, limit=limit) if query else []
+    position = index.position_at(int(at_ms)) if at_ms is not None else None
+    load_texts(db, video_id, index, matches + ([position] if position is not None else []))
+    result = {}
+    if query:
+        result['matches'] = [index.segment(match) for match in matches]
+    if at_ms is not None:
+        result['segment'] = index.segment(position) if position is not None else None
+    return result
+
+
+def lookup(db, video_id, query=None, at_ms=None, limit=50):
+    """Matches for query and/or the segment playing at at_ms; None if the video has no transcript.
+
+    Returns {'matches': [...]} and/or {'segment': ...}, as requested. An
+    index that no longer matches the transcript is rebuilt first.
+    """
+    index = load_index(db, video_id)
+    if index is None:
+        return None
+    try:
+        return _lookup(db, video_id, index, query, at_ms, limit)
+    except StaleIndexError as e:
+        print(f"{str(e)}, rebuilding its index")
+        index = rebuild_index(db, video_id)
+        if index is None:
+            return None
+        return _lookup(db, video_id, _remember(video_id, index), query, at_ms, limit)
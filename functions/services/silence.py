@@ -0,0 +1,126 @@
+"""Silence detection, and trimming long silences out of converted audio.
+
+Audio encoded for transcription can drop long pauses: less to encode,
+store and upload to Whisper. The parts that are kept are recorded as a
+TimeMap on the audio blob, so timestamps Whisper reports against the
+trimmed audio can be put back on the source video's timeline.
+"""
+
+import re
+from bisect import bisect_left, bisect_right
+
+from services.tracing import run_process
+from services.vtt import Segment
+
+# Pauses shorter than this are left alone; the padding is kept on both
+# sides of a cut so words are not clipped.
+TRIM_MIN_SILENCE_SECONDS = 1.0
+TRIM_PADDING_SECONDS = 0.25
+TRIM_NOISE = '-40dB'
+# Caps the filter expression and the size of the map in blob metadata (8KB limit)
+MAX_TRIM_CUTS = 200
+# Below this the cut points are not worth the extra filter pass
+MIN_TRIMMED_SECONDS = 2.0
+
+# Custom metadata key on audio blobs holding the encoded TimeMap
+TIME_MAP_KEY = 'keptIntervals'
+
+_SILENCE_START = re.compile(r'silence_start: (-?\d+(?:\.\d+)?)')
+_SILENCE_END = re.compile(r'silence_end: (\d+(?:\.\d+)?)')
+
+
+def detect_silences(path, noise, min_seconds):
+    """Return (start, end) pairs of silences in seconds.
+
+    Only the audio is decoded, so this also works directly on a video file.
+    """
+    result = run_process(
+        ['ffmpeg', '-hide_banner', '-nostats', '-i', path, '-vn',
+         '-af', f'silencedetect=noise={noise}:d={min_seconds}',
+         '-f', 'null', '-']
+    )
+    stderr = result.stderr.decode(errors='replace')
+    if result.returncode != 0:
+        raise Exception(f"Silence detection failed: {stderr[-1000:]}")
+
+    silences = []
+    start = None
+    for line in stderr.splitlines():
+        start_match = _SILENCE_START.search(line)
+        if start_match:
+            start = max(float(start_match.group(1)), 0.0)
+            continue
+        end_match = _SILENCE_END.search(line)
+        if end_match and start is not None:
+            silences.append((start, float(end_match.group(1))))
+            start = None
+    return silences
+
+
+class TimeMap:
+    """The [start_ms, end_ms] intervals of the source that trimmed audio is made of."""
+
+    def __init__(self, intervals):
+        self.intervals = [tuple(interval) for interval in intervals]
+        # Where each kept interval starts in the trimmed audio
+        self.offsets = []
+        position = 0
+        for start, end in self.intervals:
+            self.offsets.append(position)
+            position += end - start
+        self.trimmed_ms = position
+
+    @classmethod
+    def plan(cls, silences, duration, padding=TRIM_PADDING_SECONDS, max_cuts=MAX_TRIM_CUTS):
+        """Intervals to keep from detected silences, or None if trimming saves too little."""
+        cuts = [(start + padding, end - padding) for start, end in silences if end - start > 2 * padding]
+        if len(cuts) > max_cuts:
+            # Drop the shortest pauses first
+            cuts = sorted(sorted(cuts, key=lambda cut: cut[1] - cut[0], reverse=True)[:max_cuts])
+        kept = []
+        position = 0.0
+        for start, end in cuts:
+            if start > position:
+                kept.append((position, start))
+            position = max(position, end)
+        if duration > position:
+            kept.append((position, duration))
+        if duration - sum(end - start for start, end in kept) < MIN_TRIMMED_SECONDS:
+            return None
+        return cls([(round(start * 1000), round(end * 1000)) for start, end in kept])
+
+    def select_filter(self):
+        """ffmpeg audio filter keeping only the mapped intervals, with timestamps closed up."""
+        ranges = '+'.join(f'between(t,{start / 1000:.3f},{end / 1000:.3f})' for start, end in self.intervals)
+        return f"aselect='{ranges}',asetpts=N/SR/TB"
+
+    def encode(self):
+        return ' '.join(f'{start}-{end}' for start, end in self.intervals)
+
+    @classmethod
+    def decode(cls, value):
+        """TimeMap from encode() output; None for audio that was not trimmed."""
+        if not value:
+            return None
+        return cls([tuple(int(part) for part in pair.split('-')) for pair in value.split()])
+
+    def to_source_ms(self, trimmed_ms, end=False):
+        """Map a trimmed-audio timestamp to the source.
+
+        A cue end that falls exactly on a cut belongs to the interval
+        before it, a cue start to the interval after.
+        """
+        index = (bisect_left if end else bisect_right)(self.offsets, trimmed_ms) - 1
+        index = min(max(index, 0), len(self.intervals) - 1)
+        start, stop = self.intervals[index]
+        return min(start + max(trimmed_ms - self.offsets[index], 0), stop)
+
+    def restore_segments(self, segments):
+        """Segment dicts (Segment.to_dict form) with times moved back to the source timeline."""
+        restored = []
+        for data in segments:
+            segment = Segment.from_dict(data)
+            segment.start_ms = self.to_source_ms(segment.start_ms)
+            segment.end_ms = max(self.to_source_ms(segment.end_ms, end=True), segment.start_ms)
+            restored.append(segment.to_dict())
+        return restored
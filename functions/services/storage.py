@@ -0,0 +1,132 @@
+"""Cloud Storage streaming helpers."""
+
+import shutil
+import struct
+import uuid
+from contextlib import contextmanager
+
+DEFAULT_CHUNK_SIZE = 2 * 1024 * 1024  # 2MB chunks, a multiple of the 256KB upload granularity
+
+# Temporary prefix for streamed uploads until they are complete
+STAGING_PREFIX = 'tmp/streaming'
+
+# Source objects one compose request accepts
+MAX_COMPOSE_SOURCES = 32
+
+# Atom headers read while looking for the MP4 'moov' box
+_MP4_ATOM_HEADER = 16
+_MP4_MAX_ATOMS = 64
+
+
+def stream_blob_to_file(blob, destination_path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Stream a blob to a file in chunks to minimize memory usage."""
+    with blob.open('rb', chunk_size=chunk_size) as reader, open(destination_path, 'wb') as f:
+        shutil.copyfileobj(reader, f, chunk_size)
+
+
+def stream_file_to_blob(source_path, blob, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Stream a file to a blob in chunks to minimize memory usage."""
+    blob.chunk_size = chunk_size  # Forces a resumable upload in chunk_size pieces
+    with open(source_path, 'rb') as f:
+        blob.upload_from_file(f)
+
+
+def open_blob_reader(blob, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Open a blob for reading with ranged requests of chunk_size bytes."""
+    return blob.open('rb', chunk_size=chunk_size)
+
+
+@contextmanager
+def staged_blob_writer(blob, content_type, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield a chunked resumable writer whose output only appears at blob once complete.
+
+    Bytes go to a staging object first; on success it is copied server-side
+    to the target name, so a failed stream never leaves a truncated file in
+    place of the real one.
+    """
+    bucket = blob.bucket
+    staging_blob = bucket.blob(f'{STAGING_PREFIX}/{uuid.uuid4().hex}-{blob.name.replace("/", "_")}')
+    writer = staging_blob.open('wb', chunk_size=chunk_size, content_type=content_type)
+    try:
+        yield writer
+        writer.close()
+        bucket.copy_blob(staging_blob, bucket, blob.name)
+    finally:
+        if not writer.closed:
+            writer.close()
+        try:
+            staging_blob.delete()
+        except Exception as e:
+            print(f"Could not delete staging object {staging_blob.name}: {str(e)}")
+
+
+def compose_blobs(sources, destination, content_type, scratch_prefix):
+    """Concatenate any number of blobs into destination server-side.
+
+    One compose call takes at most MAX_COMPOSE_SOURCES objects, so longer
+    lists are composed in rounds through intermediates under scratch_prefix,
+    which are deleted afterwards.
+    """
+    bucket = destination.bucket
+    intermediates = []
+    level = 0
+    while len(sources) > MAX_COMPOSE_SOURCES:
+        grouped = []
+        for start in range(0, len(sources), MAX_COMPOSE_SOURCES):
+            part = bucket.blob(f'{scratch_prefix}/compose-{level}-{start // MAX_COMPOSE_SOURCES:05d}')
+            part.compose(sources[start:start + MAX_COMPOSE_SOURCES])
+            grouped.append(part)
+        intermediates.extend(grouped)
+        sources = grouped
+        level += 1
+
+    destination.content_type = content_type
+    destination.compose(sources)
+    for part in intermediates:
+        try:
+            part.delete()
+        except Exception as e:
+            print(f"Could not delete compose intermediate {part.name}: {str(e)}")
+    return destination
+
+
+def iter_mp4_atoms(blob):
+    """Yield (type, offset, size) of the top-level MP4/MOV atoms of a blob.
+
+    Only the atom headers are fetched, with small ranged reads. Stops at
+    the end of the blob, after an atom that runs to the end of the file, or
+    at a header that cannot be valid (i.e. the blob is not an MP4).
+    """
+    if blob.size is None:
+        blob.reload()
+    size = blob.size or 0
+    offset = 0
+    for _ in range(_MP4_MAX_ATOMS):
+        if offset + 8 > size:
+            return
+        header = blob.download_as_bytes(start=offset, end=min(offset + _MP4_ATOM_HEADER, size) - 1)
+        atom_size, atom_type = struct.unpack('>I4s', header[:8])
+        if atom_size == 1:
+            atom_size = struct.unpack('>Q', header[8:16])[0]
+        elif atom_size == 0:
+            yield atom_type, offset, size - offset  # Atom extends to the end of the file
+            return
+        if atom_size < 8:
+            return
+        yield atom_type, offset, atom_size
+        offset += atom_size
+
+
+def is_streamable_mp4(blob):
+    """Check whether the MP4 index ('moov') comes before the media data.
+
+    ffmpeg cannot seek a pipe, so MP4s written without faststart (moov at
+    the end, as most phone cameras do) cannot be converted from stdin.
+    """
+    blob.reload()
+    for atom_type, _, _ in iter_mp4_atoms(blob):
+        if atom_type == b'moov':
+            return True
+        if atom_type == b'mdat':
+            return False
+    return False
@@ -0,0 +1,315 @@
+"""Per-request tracing: stage spans, bytes moved and sampled peak RSS.
+
+A request opens a trace and its stages open spans inside it:
+
+    with trace('convert_to_audio', video_id=video_id):
+        with span('download') as s:
+            ...
+            s.set(bytes=size)
+
+While a trace is open a background thread samples the process RSS every
+RSS_SAMPLE_SECONDS from /proc/self/statm, so each span gets the peak seen
+while it was open without any call on the request's own path.
+
+An instance serves concurrent requests, so the process-wide CPU and child
+rusage counters would mix them up. Instead, a span's cpuMs is the CPU time
+of the thread that opened it (time.thread_time). ffmpeg and other child
+processes started through run_process or reaped with wait_process are
+measured one by one (os.wait4). Their CPU time and peak RSS are charged
+to the span that ran them and its ancestors (childCpuMs, childMaxRssMb),
+and to the trace. When the trace closes it is written as one JSON log
+line, which Cloud Logging ingests as a structured entry
+(jsonPayload.trace).
+
+The current trace lives in a context variable, so services can open spans
+without it being passed around. Work handed to a thread pool keeps the
+request's trace when the callable is wrapped with propagate(); spans
+opened with no trace are no-ops. Set TRACING=0 to disable all of it.
+"""
+
+import contextvars
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+ENABLED = os.getenv('TRACING', '1') != '0'
+RSS_SAMPLE_SECONDS = float(os.getenv('TRACE_RSS_SAMPLE_SECONDS', '0.05'))
+MAX_SPANS = 500  # Spans beyond this are counted but not kept
+
+_PAGE_MB = os.sysconf('SC_PAGE_SIZE') / 1024 / 1024 if hasattr(os, 'sysconf') else 4096 / 1024 / 1024
+
+_current_trace = contextvars.ContextVar('trace', default=None)
+_current_span = contextvars.ContextVar('span', default=None)
+
+
+def read_rss_mb():
+    """Resident set size of this process in MB (0 if unavailable)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_MB
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+class Span:
+    """One timed stage of a trace."""
+
+    __slots__ = ('name', 'parent', 'start', 'end', 'cpu_start', 'cpu_seconds', 'attributes', 'peak_rss_mb',
+                 'child_cpu_seconds', 'child_max_rss_mb', 'error', 'thread')
+
+    def __init__(self, name, parent, attributes):
+        self.name = name
+        self.parent = parent
+        self.attributes = attributes
+        self.start = time.perf_counter()
+        self.end = None
+        self.cpu_start = time.thread_time()
+        self.cpu_seconds = None
+        self.peak_rss_mb = 0.0
+        self.child_cpu_seconds = 0.0
+        self.child_max_rss_mb = 0.0
+        self.error = None
+        self.thread = threading.current_thread().name
+
+    @property
+    def duration(self):
+        return (self.end or time.perf_counter()) - self.start
+
+    def set(self, **attributes):
+        """Attach attributes (bytes moved, counts, modes...) to the span."""
+        self.attributes.update(attributes)
+
+    def add(self, key, amount):
+        """Accumulate a counter attribute, e.g. bytes read in a loop."""
+        self.attributes[key] = self.attributes.get(key, 0) + amount
+
+
+class _NoopSpan:
+    name = None
+    start = 0.0
+    duration = 0.0
+
+    def set(self, **attributes):
+        pass
+
+    def add(self, key, amount):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    """Spans of one request plus the RSS sampler that watches them."""
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.attributes = attributes
+        self.start = time.perf_counter()
+        self.spans = []
+        self.dropped_spans = 0
+        self.peak_rss_mb = read_rss_mb()
+        self.start_rss_mb = self.peak_rss_mb
+        self.child_cpu_seconds = 0.0
+        self.child_max_rss_mb = 0.0
+        self._open = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, name=f'rss-{self.trace_id}', daemon=True)
+        self._sampler.start()
+
+    def _sample(self):
+        while not self._stop.wait(RSS_SAMPLE_SECONDS):
+            rss = read_rss_mb()
+            with self._lock:
+                self.peak_rss_mb = max(self.peak_rss_mb, rss)
+                for open_span in self._open:
+                    open_span.peak_rss_mb = max(open_span.peak_rss_mb, rss)
+
+    def open_span(self, name, parent, attributes):
+        new_span = Span(name, parent, attributes)
+        new_span.peak_rss_mb = read_rss_mb()
+        with self._lock:
+            if len(self.spans) < MAX_SPANS:
+                self.spans.append(new_span)
+            else:
+                self.dropped_spans += 1
+            self._open.add(new_span)
+        return new_span
+
+    def close_span(self, closed_span):
+        closed_span.end = time.perf_counter()
+        closed_span.cpu_seconds = time.thread_time() - closed_span.cpu_start
+        with self._lock:
+            self._open.discard(closed_span)
+
+    def record_child(self, owner, cpu_seconds, max_rss_mb):
+        """Charge a finished child process to the trace, owner and owner's ancestors."""
+        with self._lock:
+            self.child_cpu_seconds += cpu_seconds
+            self.child_max_rss_mb = max(self.child_max_rss_mb, max_rss_mb)
+            while owner is not None:
+                owner.child_cpu_seconds += cpu_seconds
+                owner.child_max_rss_mb = max(owner.child_max_rss_mb, max_rss_mb)
+                owner = owner.parent
+
+    def timings(self):
+        """{span name: seconds} of finished spans, last one winning for repeated names."""
+        return {s.name: round(s.duration, 3) for s in self.spans if s.end is not None}
+
+    def finish(self, error=None):
+        self._stop.set()
+        self._sampler.join()
+        end = time.perf_counter()
+        return {
+            'name': self.name,
+            'traceId': self.trace_id,
+            'attributes': self.attributes,
+            'durationMs': round((end - self.start) * 1000, 1),
+            'startRssMb': round(self.start_rss_mb, 1),
+            'peakRssMb': round(self.peak_rss_mb, 1),
+            # Child processes (ffmpeg) run by this trace: total CPU and the largest peak RSS
+            'childCpuMs': round(self.child_cpu_seconds * 1000, 1),
+            'childMaxRssMb': round(self.child_max_rss_mb, 1),
+            'error': str(error) if error is not None else None,
+            'droppedSpans': self.dropped_spans,
+            'spans': [
+                {
+                    'name': s.name,
+                    'parent': s.parent.name if s.parent else None,
+                    'startMs': round((s.start - self.start) * 1000, 1),
+                    'durationMs': round(((s.end or end) - s.start) * 1000, 1),
+                    'cpuMs': round(s.cpu_seconds * 1000, 1) if s.cpu_seconds is not None else None,
+                    'peakRssMb': round(s.peak_rss_mb, 1),
+                    'childCpuMs': round(s.child_cpu_seconds * 1000, 1),
+                    'childMaxRssMb': round(s.child_max_rss_mb, 1),
+                    'thread': s.thread,
+                    **({'error': s.error} if s.error else {}),
+                    **s.attributes,
+                }
+                for s in self.spans
+            ],
+        }
+
+
+def emit_to_stdout(record, severity='INFO'):
+    """Write one structured log entry to stdout."""
+    sys.stdout.write(json.dumps({
+        'severity': severity,
+        'message': f"trace {record['name']} {record['durationMs']}ms",
+        'trace': record,
+    }, default=str) + '\n')
+    sys.stdout.flush()
+
+
+emit = emit_to_stdout
+
+
+def set_emitter(emitter):
+    """Send finished traces to emitter(record, severity) instead of stdout, e.g. from a benchmark."""
+    global emit
+    emit = emitter or emit_to_stdout
+
+
+@contextmanager
+def trace(name, **attributes):
+    """Trace a request; the finished trace is emitted as a structured log line."""
+    if not ENABLED or _current_trace.get() is not None:
+        # Nested requests (e.g. a pipeline stage calling shared code) join the outer trace
+        yield _current_trace.get()
+        return
+
+    current = Trace(name, attributes)
+    trace_token = _current_trace.set(current)
+    span_token = _current_span.set(None)
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+        emit(current.finish(error), 'ERROR' if error is not None else 'INFO')
+
+
+@contextmanager
+def span(name, **attributes):
+    """Time a stage of the current trace; yields the span so attributes can be set."""
+    current = _current_trace.get()
+    if current is None:
+        yield _NOOP_SPAN
+        return
+
+    new_span = current.open_span(name, _current_span.get(), attributes)
+    token = _current_span.set(new_span)
+    try:
+        yield new_span
+    except BaseException as e:
+        new_span.error = f"{type(e).__name__}: {str(e)[:200]}"
+        raise
+    finally:
+        _current_span.reset(token)
+        current.close_span(new_span)
+
+
+def current_span():
+    """The innermost open span, or a no-op span outside any trace."""
+    return _current_span.get() or _NOOP_SPAN
+
+
+def propagate(fn):
+    """Wrap fn so calls from pool threads run inside the caller's trace."""
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.copy().run(fn, *args, **kwargs)
+    return run
+
+
+def wait_process(process):
+    """Wait for a subprocess.Popen and charge its CPU time and peak RSS to the current span.
+
+    Returns the exit code, like process.wait().
+    """
+    try:
+        _, status, usage = os.wait4(process.pid, 0)
+    except ChildProcessError:
+        return process.wait()  # Already reaped elsewhere, so no usage to record
+    process.returncode = os.waitstatus_to_exitcode(status)
+    current = _current_trace.get()
+    if current is not None:
+        current.record_child(_current_span.get(), usage.ru_utime + usage.ru_stime, usage.ru_maxrss / 1024)
+    return process.returncode
+
+
+def run_process(args):
+    """subprocess.run(args, capture_output=True) with the process measured by wait_process."""
+    process = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    output = {}
+
+    def drain(name, pipe):
+        with pipe:
+            output[name] = pipe.read()
+
+    readers = [threading.Thread(target=drain, args=(name, pipe), daemon=True)
+               for name, pipe in (('stdout', process.stdout), ('stderr', process.stderr))]
+    for reader in readers:
+        reader.start()
+    try:
+        returncode = wait_process(process)
+    except BaseException:
+        process.kill()
+        process.wait()
+        raise
+    finally:
+        for reader in readers:
+            reader.join()
+    return subprocess.CompletedProcess(args, returncode, output.get('stdout', b''), output.get('stderr', b''))
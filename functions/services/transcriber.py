@@ -0,0 +1,156 @@
+"""Whisper transcription with silence-aligned chunking for long audio.
+
+Audio over the API's upload limit (or simply long) is split near silences
+into chunks of roughly TARGET_CHUNK_SECONDS, the chunks are transcribed
+concurrently, and their VTT output is stitched back together with each
+chunk's offset added to its cue timestamps.
+
+The OpenAI endpoint follows OPENAI_API_BASE, so the whole pipeline can be
+exercised against devtools/stub_openai.py.
+"""
+
+import os
+import random
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import ffmpeg
+
+from services.clients import is_retryable_error
+from services.silence import detect_silences
+from services.tracing import propagate, run_process, span
+from services.vtt import format_vtt, iter_segments
+
+WHISPER_MODEL = 'whisper-1'
+WHISPER_MAX_BYTES = 25 * 1024 * 1024  # API upload limit
+
+TARGET_CHUNK_SECONDS = int(os.getenv('TRANSCRIBE_CHUNK_SECONDS', '600'))
+SPLIT_SEARCH_SECONDS = 60  # How far from the target a silence may be used as the cut
+MAX_CONCURRENCY = int(os.getenv('TRANSCRIBE_CONCURRENCY', '4'))
+MAX_ATTEMPTS = 4
+BACKOFF_SECONDS = 1.0
+
+# silencedetect settings used to find cut points
+SILENCE_NOISE = '-35dB'
+SILENCE_MIN_SECONDS = 0.4
+
+
+def get_audio_duration(audio_path):
+    """Duration of an audio file in seconds, or None if it cannot be told.
+
+    Containers that carry no duration fall back to size over bitrate.
+    """
+    info = ffmpeg.probe(audio_path)
+    container = info.get('format') or {}
+    try:
+        duration = float(container.get('duration'))
+    except (TypeError, ValueError):
+        duration = 0.0
+    if duration > 0:
+        return duration
+
+    bit_rates = [container.get('bit_rate')] + [stream.get('bit_rate') for stream in info.get('streams') or []]
+    for bit_rate in bit_rates:
+        try:
+            if float(bit_rate) > 0:
+                return os.path.getsize(audio_path) * 8 / float(bit_rate)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def choose_split_points(duration, silences, target=TARGET_CHUNK_SECONDS, search=SPLIT_SEARCH_SECONDS):
+    """Pick cut points near every target interval, preferring the middle of a silence."""
+    midpoints = [(start + end) / 2 for start, end in silences]
+    points = []
+    last = 0.0
+    while duration - last > target + search:
+        goal = last + target
+        nearby = [m for m in midpoints if goal - search <= m <= goal + search and m > last]
+        cut = min(nearby, key=lambda m: abs(m - goal)) if nearby else goal
+        points.append(cut)
+        last = cut
+    return points
+
+
+def split_audio(audio_path, points, out_dir):
+    """Cut audio at points without re-encoding; returns [(path, offset_seconds)]."""
+    bounds = [0.0] + points + [None]
+    extension = os.path.splitext(audio_path)[1]  # Chunks keep the container of the source
+    chunks = []
+    for index, (start, end) in enumerate(zip(bounds, bounds[1:])):
+        chunk_path = os.path.join(out_dir, f'chunk_{index:03d}{extension}')
+        cmd = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-ss', f'{start:.3f}', '-i', audio_path]
+        if end is not None:
+            cmd += ['-t', f'{end - start:.3f}']
+        cmd += ['-c', 'copy', '-y', chunk_path]
+        result = run_process(cmd)
+        if result.returncode != 0:
+            raise subprocess.CalledProcessError(result.returncode, cmd, result.stdout, result.stderr)
+        chunks.append((chunk_path, start))
+    return chunks
+
+
+def transcribe_file(openai, audio_path):
+    """Transcribe one file to VTT, retrying transient errors with backoff."""
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            with span('whisper_request', bytes=os.path.getsize(audio_path), attempt=attempt), \
+                    open(audio_path, 'rb') as audio_file:
+                return openai.Audio.transcribe(
+                    model=WHISPER_MODEL,
+                    file=audio_file,
+                    response_format="vtt",
+                    timestamp_granularities=["word", "segment"]
+                )
+        except Exception as e:
+            if attempt == MAX_ATTEMPTS or not is_retryable_error(openai, e):
+                raise
+            delay = BACKOFF_SECONDS * 2 ** (attempt - 1) * (1 + random.random())
+            print(f"Transcription of {os.path.basename(audio_path)} failed ({str(e)}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def stitch_vtt(parts):
+    """Join [(vtt_content, offset_seconds)] into one VTT document."""
+    segments = []
+    for content, offset in parts:
+        offset_ms = round(offset * 1000)
+        for segment in iter_segments(content.splitlines()):
+            segment.start_ms += offset_ms
+            segment.end_ms += offset_ms
+            segments.append(segment)
+    return format_vtt(segments)
+
+
+def transcribe_audio(openai, audio_path, work_dir, max_concurrency=MAX_CONCURRENCY):
+    """Transcribe an audio file to VTT, chunking it when it is long or large.
+
+    Returns (vtt_content, chunk_count).
+    """
+    file_size = os.path.getsize(audio_path)
+    duration = get_audio_duration(audio_path)
+    if not duration:
+        # Nothing to size chunks by; oversized audio fails at the API with its own error
+        print(f"Duration of {os.path.basename(audio_path)} ({file_size} bytes) is unknown, sending it whole")
+        return transcribe_file(openai, audio_path), 1
+    if file_size <= WHISPER_MAX_BYTES and duration <= TARGET_CHUNK_SECONDS + SPLIT_SEARCH_SECONDS:
+        return transcribe_file(openai, audio_path), 1
+
+    # Keep every chunk comfortably under the upload limit as well
+    bytes_per_second = file_size / duration
+    target = max(60, min(TARGET_CHUNK_SECONDS, int(WHISPER_MAX_BYTES * 0.9 / bytes_per_second) - SPLIT_SEARCH_SECONDS))
+    search = min(SPLIT_SEARCH_SECONDS, target // 4)
+
+    with span('silence_detect', duration_seconds=round(duration, 1)):
+        points = choose_split_points(duration, detect_silences(audio_path, SILENCE_NOISE, SILENCE_MIN_SECONDS), target, search)
+    chunk_dir = os.path.join(work_dir, 'chunks')
+    os.makedirs(chunk_dir, exist_ok=True)
+    with span('split', chunks=len(points) + 1):
+        chunks = split_audio(audio_path, points, chunk_dir)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(chunks)))) as pool:
+        results = list(pool.map(propagate(lambda chunk: transcribe_file(openai, chunk[0])), chunks))
+
+    return stitch_vtt(zip(results, (offset for _, offset in chunks))), len(chunks)
@@ -0,0 +1,141 @@
+"""Paged transcript storage.
+
+A transcript is a small header document plus its segments split into
+pages by start time, so no document approaches Firestore's 1 MiB limit
+and a player can read only the window it is showing:
+
+    transcripts/{video_id}                 videoId, createdAt, sourceHash, audioFileSize,
+                                           transcriptLength, segmentCount, durationMs,
+                                           pageSeconds, pageCount, format='paged'
+    transcripts/{video_id}/pages/{n:05d}   index, startMs, endMs, segments
+
+Page n holds the segments (Segment.to_dict form) that start in
+[n, n+1) * pageSeconds, in start order; every page up to pageCount
+exists, even if empty. Read in page order they are the segments sorted
+by start time, so the page and slot of the k-th segment follow from the
+start times alone (search_index relies on this). Documents written
+before paging carry content and segments inline, and every reader here
+handles both.
+"""
+
+from services.vtt import Segment
+
+TRANSCRIPT_COLLECTION = 'transcripts'
+PAGE_COLLECTION = 'pages'
+PAGED_FORMAT = 'paged'
+PAGE_SECONDS = 300  # ~100 cues, a few tens of KB per page
+FIRESTORE_BATCH_SIZE = 400  # Writes per batch, under the 500 limit
+
+
+def transcript_ref(db, video_id):
+    return db.collection(TRANSCRIPT_COLLECTION).document(video_id)
+
+
+def page_ref(db, video_id, index):
+    return transcript_ref(db, video_id).collection(PAGE_COLLECTION).document(f'{index:05d}')
+
+
+def is_paged(header):
+    return (header or {}).get('format') == PAGED_FORMAT
+
+
+def _normalized(segments):
+    """Segments in to_dict form; legacy string-only dicts gain their millisecond fields."""
+    return [s if 'startMs' in s and 'endMs' in s else Segment.from_dict(s).to_dict() for s in segments]
+
+
+def save_transcript(db, video_id, segments, fields, previous=None):
+    """Store segments as pages and then the header; returns the header.
+
+    fields are extra header fields (createdAt, sourceHash, ...). previous
+    is the header being replaced, if any, so pages it had beyond the new
+    pageCount are deleted.
+    """
+    segments = sorted(_normalized(segments), key=lambda segment: segment['startMs'])
+    page_ms = PAGE_SECONDS * 1000
+    pages = {}
+    for segment in segments:
+        pages.setdefault(segment['startMs'] // page_ms, []).append(segment)
+    page_count = max(pages) + 1 if pages else 0
+
+    writes = [
+        ('set', page_ref(db, video_id, index), {
+            'index': index,
+            'startMs': index * page_ms,
+            'endMs': (index + 1) * page_ms,
+            'segments': pages.get(index, []),
+        })
+        for index in range(page_count)
+    ]
+    header = {
+        **fields,
+        'videoId': video_id,
+        'format': PAGED_FORMAT,
+        'pageSeconds': PAGE_SECONDS,
+        'pageCount': page_count,
+        'segmentCount': len(segments),
+        'durationMs': max((segment['endMs'] for segment in segments), default=0),
+    }
+    # The header goes last so readers never see a pageCount whose pages are missing
+    writes.append(('set', transcript_ref(db, video_id), header))
+    previous_count = (previous or {}).get('pageCount') or 0 if is_paged(previous) else 0
+    writes.extend(('delete', page_ref(db, video_id, index), None) for index in range(page_count, previous_count))
+
+    for start in range(0, len(writes), FIRESTORE_BATCH_SIZE):
+        batch = db.batch()
+        for kind, ref, data in writes[start:start + FIRESTORE_BATCH_SIZE]:
+            if kind == 'set':
+                batch.set(ref, data)
+            else:
+                batch.delete(ref)
+        batch.commit()
+    return header
+
+
+def load_header(db, video_id):
+    """The transcript header (or legacy document) dict, or None."""
+    doc = transcript_ref(db, video_id).get()
+    return doc.to_dict() if doc.exists else None
+
+
+def load_pages(db, video_id, indexes):
+    """{page index: segments} of the given pages of a paged transcript; missing pages are left out."""
+    snapshots = db.get_all([page_ref(db, video_id, index) for index in sorted(set(indexes))])
+    pages = (doc.to_dict() for doc in snapshots if doc.exists)
+    return {page['index']: page.get('segments') or [] for page in pages}
+
+
+def load_segments(db, video_id, header=None, start_ms=None, end_ms=None):
+    """Segments overlapping [start_ms, end_ms), or all of them; None if there is no transcript.
+
+    Only the pages covering the window are read: the one before it too,
+    for a cue that starts earlier and is still showing.
+    """
+    if header is None:
+        header = load_header(db, video_id)
+        if header is None:
+            return None
+
+    if not is_paged(header):
+        segments = _normalized(header.get('segments') or [])
+    else:
+        page_count = header.get('pageCount') or 0
+        page_ms = (header.get('pageSeconds') or PAGE_SECONDS) * 1000
+        first = max(0, start_ms // page_ms - 1) if start_ms is not None else 0
+        last = min(page_count - 1, (end_ms - 1) // page_ms) if end_ms is not None else page_count - 1
+        if last < first:
+            return []
+        pages = load_pages(db, video_id, range(first, last + 1))
+        segments = [segment for index in sorted(pages) for segment in pages[index]]
+
+    return [
+        segment for segment in segments
+        if (start_ms is None or segment['endMs'] > start_ms) and (end_ms is None or segment['startMs'] < end_ms)
+    ]
+
+
+def load_content(db, video_id, header):
+    """Full transcript text: inline on legacy documents, joined from the pages otherwise."""
+    if not is_paged(header):
+        return header.get('content') or ''
+    return ' '.join(segment['text'] for segment in load_segments(db, video_id, header) or [])
@@ -0,0 +1,152 @@
+"""Streaming WebVTT parser producing compact segment records."""
+
+import re
+
+_TIMING_LINE = re.compile(
+    r'(?:(\d+):)?(\d{2}):(\d{2})[.,](\d{3})\s+-->\s+(?:(\d+):)?(\d{2}):(\d{2})[.,](\d{3})'
+)
+# Blocks that are not cues and are skipped whole
+_NON_CUE_BLOCKS = ('NOTE', 'STYLE', 'REGION')
+
+_MS_PER_SECOND = 1000
+_MS_PER_MINUTE = 60 * _MS_PER_SECOND
+_MS_PER_HOUR = 60 * _MS_PER_MINUTE
+
+
+class Segment:
+    """One cue with integer millisecond timestamps."""
+
+    __slots__ = ('start_ms', 'end_ms', 'text', 'identifier')
+
+    def __init__(self, start_ms, end_ms, text, identifier=None):
+        self.start_ms = start_ms
+        self.end_ms = end_ms
+        self.text = text
+        self.identifier = identifier
+
+    def __repr__(self):
+        return f'Segment({self.start_ms}, {self.end_ms}, {self.text!r})'
+
+    def __eq__(self, other):
+        return (isinstance(other, Segment)
+                and (self.start_ms, self.end_ms, self.text) == (other.start_ms, other.end_ms, other.text))
+
+    def __hash__(self):
+        return hash((self.start_ms, self.end_ms, self.text))
+
+    def to_dict(self):
+        """Firestore/app representation: string timestamps plus milliseconds."""
+        return {
+            'start': format_timestamp(self.start_ms),
+            'end': format_timestamp(self.end_ms),
+            'startMs': self.start_ms,
+            'endMs': self.end_ms,
+            'text': self.text,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build a segment from to_dict() output or a legacy string-only dict."""
+        start_ms = data.get('startMs')
+        end_ms = data.get('endMs')
+        return cls(
+            start_ms if start_ms is not None else parse_timestamp(data['start']),
+            end_ms if end_ms is not None else parse_timestamp(data['end']),
+            data.get('text', ''),
+        )
+
+
+def _to_ms(hours, minutes, seconds, millis):
+    return (int(hours or 0) * _MS_PER_HOUR + int(minutes) * _MS_PER_MINUTE
+            + int(seconds) * _MS_PER_SECOND + int(millis))
+
+
+def parse_timestamp(value):
+    """Parse HH:MM:SS.mmm (hours optional) to milliseconds."""
+    parts = value.strip().replace(',', '.').split(':')
+    seconds, millis = parts[-1].split('.')
+    hours = parts[-3] if len(parts) == 3 else 0
+    return _to_ms(hours, parts[-2], seconds, millis)
+
+
+def format_timestamp(total_ms):
+    """Format milliseconds as HH:MM:SS.mmm."""
+    hours, rest = divmod(int(total_ms), _MS_PER_HOUR)
+    minutes, rest = divmod(rest, _MS_PER_MINUTE)
+    seconds, millis = divmod(rest, _MS_PER_SECOND)
+    return f'{hours:02d}:{minutes:02d}:{seconds:02d}.{millis:03d}'
+
+
+def iter_segments(lines):
+    """Yield Segments from an iterable of VTT lines (e.g. an open file).
+
+    Handles the WEBVTT header block, NOTE/STYLE/REGION blocks, optional cue
+    identifiers, cue settings after the timing and multi-line cue text
+    (joined with spaces). Only the current cue is held in memory.
+    """
+    match_timing = _TIMING_LINE.match
+    in_header = True
+    skipping = False
+    pending_identifier = None
+    start_ms = end_ms = None
+    identifier = None
+    text_lines = []
+
+    for raw_line in lines:
+        line = raw_line.strip()
+
+        # Timing lines first: '-->' cannot appear in headers, notes or identifiers
+        if '-->' in line:
+            timing = match_timing(line)
+            if timing is not None:
+                if start_ms is not None:
+                    # A new timing without a blank line in between starts a new cue
+                    yield Segment(start_ms, end_ms, ' '.join(text_lines), identifier)
+                    text_lines = []
+                h1, m1, s1, ms1, h2, m2, s2, ms2 = timing.groups()
+                start_ms = ((int(h1 or 0) * 60 + int(m1)) * 60 + int(s1)) * 1000 + int(ms1)
+                end_ms = ((int(h2 or 0) * 60 + int(m2)) * 60 + int(s2)) * 1000 + int(ms2)
+                identifier = pending_identifier
+                pending_identifier = None
+                in_header = skipping = False
+                continue
+
+        if not line:
+            # A blank line ends whatever block we are in
+            if start_ms is not None:
+                yield Segment(start_ms, end_ms, ' '.join(text_lines), identifier)
+                start_ms = None
+                text_lines = []
+            in_header = skipping = False
+            pending_identifier = None
+        elif start_ms is not None:
+            text_lines.append(line)
+        elif skipping:
+            continue
+        elif in_header and line.startswith('WEBVTT'):
+            # Skip the header block; files without one start straight with cues
+            in_header = False
+            skipping = True
+        elif pending_identifier is None and line.split(' ', 1)[0] in _NON_CUE_BLOCKS:
+            in_header = False
+            skipping = True
+        else:
+            in_header = False
+            pending_identifier = line
+
+    if start_ms is not None:
+        yield Segment(start_ms, end_ms, ' '.join(text_lines), identifier)
+
+
+def parse_segments(vtt_content):
+    """Parse a VTT string into a list of Segments."""
+    return list(iter_segments(vtt_content.splitlines()))
+
+
+def format_vtt(segments):
+    """Serialize Segments back into a VTT document."""
+    cues = [
+        f'{format_timestamp(segment.start_ms)} --> {format_timestamp(segment.end_ms)}\n{segment.text}'
+        for segment in segments
+    ]
+    return 'WEBVTT\n\n' + '\n\n'.join(cues) + '\n'
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The functions deploy from this directory, so services/ and main import from its root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,152 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('psutil')
+
+from services import admission  # noqa: E402
+from services.admission import AdmissionController, AdmissionRejected, JobCost, estimate_cost  # noqa: E402
+
+
+@pytest.fixture
+def machine(monkeypatch):
+    """A fake instance: set machine['memory'] (MB free), ['cpus'] and ['busy'] (CPU percent)."""
+    state = {'memory': 1000, 'cpus': 4, 'busy': 0.0}
+    monkeypatch.setattr(admission, 'get_available_memory_mb', lambda: state['memory'])
+    monkeypatch.setattr(admission, 'get_cpu_count', lambda: state['cpus'])
+    monkeypatch.setattr(admission.psutil, 'cpu_percent', lambda interval=None: state['busy'])
+    monkeypatch.setattr(admission, 'POLL_SECONDS', 0.01)
+    monkeypatch.setattr(admission, 'RAMP_SECONDS', 0)
+    monkeypatch.setattr(admission, 'ADMISSION_STATS', dict.fromkeys(admission.ADMISSION_STATS, 0))
+    return state
+
+
+def test_estimate_cost_by_mode():
+    size = 100 * 1024 * 1024
+    streaming = estimate_cost('streaming', '64k', duration=600, size_bytes=size)
+    single = estimate_cost('single_pass', '64k', duration=600, size_bytes=size)
+    segmented = estimate_cost('segmented', '64k', duration=600, size_bytes=size)
+    parallel = estimate_cost('parallel', '64k', duration=600, size_bytes=size, workers=4)
+
+    assert streaming.memory_mb == admission.FFMPEG_MEMORY_MB
+    assert single.memory_mb == pytest.approx(admission.FFMPEG_MEMORY_MB + 100 + 600 * 8000 / 1024 / 1024)
+    assert segmented.memory_mb > single.memory_mb
+    assert (parallel.cpus, segmented.cpus) == (4, 1)
+    assert parallel.memory_mb - segmented.memory_mb == 3 * admission.FFMPEG_MEMORY_MB
+
+    with_previews = estimate_cost('streaming', '64k', previews=True)
+    assert with_previews.memory_mb == admission.FFMPEG_MEMORY_MB + admission.VIDEO_DECODE_MEMORY_MB
+    assert with_previews.cpus == 2
+    assert estimate_cost('single_pass', '64k').as_dict() == {'memoryMb': admission.FFMPEG_MEMORY_MB, 'cpus': 1}
+
+
+def test_a_lone_job_is_always_admitted(machine):
+    machine['memory'] = 0
+    controller = AdmissionController(memory_reserve_mb=100)
+    ticket, waited = controller.acquire(JobCost(5000, 8), max_wait=0)
+    assert waited < admission.POLL_SECONDS
+    assert admission.ADMISSION_STATS['running'] == 1
+    controller.release(ticket)
+    assert admission.ADMISSION_STATS['running'] == 0
+
+
+def test_jobs_that_fit_run_together(machine):
+    controller = AdmissionController(memory_reserve_mb=100)
+    first, _ = controller.acquire(JobCost(300, 1), max_wait=0)
+    second, _ = controller.acquire(JobCost(300, 1), max_wait=0)
+    assert admission.ADMISSION_STATS['admitted'] == 2
+    assert admission.ADMISSION_STATS['delayed'] == 0
+    controller.release(first)
+    controller.release(second)
+
+
+@pytest.mark.parametrize('limit, value', [('memory', 350), ('cpus', 1), ('busy', 95.0)])
+def test_rejected_without_headroom(machine, limit, value):
+    controller = AdmissionController(memory_reserve_mb=100)
+    running, _ = controller.acquire(JobCost(300, 1), max_wait=0)
+    machine[limit] = value
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire(JobCost(300, 1), max_wait=0.05)
+    assert rejected.value.retry_after >= admission.MIN_RETRY_AFTER_SECONDS
+    assert admission.ADMISSION_STATS['rejected'] == 1
+    assert admission.ADMISSION_STATS['queueDepth'] == 0
+    controller.release(running)
+
+
+def test_recently_admitted_jobs_count_against_headroom(machine, monkeypatch):
+    monkeypatch.setattr(admission, 'RAMP_SECONDS', 60)
+    controller = AdmissionController(memory_reserve_mb=100)
+    running, _ = controller.acquire(JobCost(600, 1), max_wait=0)
+    # The live reading has not dropped yet, but the first job will need its 600MB
+    with pytest.raises(AdmissionRejected):
+        controller.acquire(JobCost(400, 1), max_wait=0.05)
+    controller.release(running)
+
+
+def test_waiting_job_starts_when_room_frees_up(machine):
+    controller = AdmissionController(memory_reserve_mb=100)
+    running, _ = controller.acquire(JobCost(300, 1), max_wait=0)
+    machine['memory'] = 350
+    threading.Timer(0.1, controller.release, args=(running,)).start()
+    ticket, waited = controller.acquire(JobCost(300, 1), max_wait=5)
+    assert waited >= 0.05
+    assert admission.ADMISSION_STATS['delayed'] == 1
+    controller.release(ticket)
+
+
+def test_full_queue_rejects_immediately(machine):
+    machine['memory'] = 0
+    controller = AdmissionController(memory_reserve_mb=100, max_queue=1)
+    running, _ = controller.acquire(JobCost(300, 1), max_wait=0)
+    waiter = threading.Thread(target=lambda: pytest.raises(AdmissionRejected, controller.acquire,
+                                                           JobCost(300, 1), max_wait=0.5))
+    waiter.start()
+    while admission.ADMISSION_STATS['queueDepth'] < 1:
+        time.sleep(0.005)
+
+    started = time.monotonic()
+    with pytest.raises(AdmissionRejected, match='already queued'):
+        controller.acquire(JobCost(1, 1), max_wait=5)
+    assert time.monotonic() - started < 0.5
+    waiter.join(5)
+    controller.release(running)
+
+
+def test_queue_is_first_in_first_out(machine):
+    machine['memory'] = 0
+    controller = AdmissionController(memory_reserve_mb=100)
+    running, _ = controller.acquire(JobCost(300, 1), max_wait=0)
+    order = []
+
+    def job(name, cost):
+        ticket, _ = controller.acquire(cost, max_wait=5)
+        order.append(name)
+        controller.release(ticket)
+
+    big = threading.Thread(target=job, args=('big', JobCost(800, 1)))
+    big.start()
+    while admission.ADMISSION_STATS['queueDepth'] < 1:
+        time.sleep(0.005)
+    small = threading.Thread(target=job, args=('small', JobCost(10, 1)))
+    small.start()
+    while admission.ADMISSION_STATS['queueDepth'] < 2:
+        time.sleep(0.005)
+
+    # Room for the small job only: it must not overtake the big one
+    machine['memory'] = 200
+    time.sleep(0.1)
+    assert order == []
+    controller.release(running)
+    big.join(5)
+    small.join(5)
+    assert order == ['big', 'small']
+
+
+def test_retry_after_follows_job_durations(machine):
+    controller = AdmissionController()
+    assert controller.retry_after() == 30
+    ticket, _ = controller.acquire(JobCost(1, 1), max_wait=0)
+    ticket.started -= 99.5  # Rounded up to whole seconds
+    controller.release(ticket)
+    assert controller.retry_after() == 100
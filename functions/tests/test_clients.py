@@ -0,0 +1,116 @@
+import importlib
+import sys
+import threading
+import types
+
+import pytest
+
+from services import clients
+
+# A getter that deadlocks never returns, so calls are made on a thread and timed out
+CALL_TIMEOUT = 5
+
+
+def call_with_timeout(fn):
+    result = {}
+
+    def run():
+        try:
+            result['value'] = fn()
+        except BaseException as e:  # Re-raised on the test thread
+            result['error'] = e
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(CALL_TIMEOUT)
+    assert not thread.is_alive(), f"{fn.__name__}() did not return within {CALL_TIMEOUT}s"
+    if 'error' in result:
+        raise result['error']
+    return result['value']
+
+
+@pytest.fixture
+def sdks(monkeypatch):
+    """Stand-ins for the SDK modules the getters import, recording what they initialize."""
+    calls = []
+
+    dotenv = types.ModuleType('dotenv')
+    dotenv.load_dotenv = lambda: calls.append('load_dotenv')
+
+    firebase_admin = types.ModuleType('firebase_admin')
+    firebase_admin.__path__ = []
+
+    def get_app():
+        raise ValueError("The default Firebase app does not exist")
+
+    def initialize_app():
+        calls.append('initialize_app')
+        return 'app'
+
+    firebase_admin.get_app = get_app
+    firebase_admin.initialize_app = initialize_app
+    storage = types.ModuleType('firebase_admin.storage')
+    storage.bucket = lambda: 'bucket'
+    firestore = types.ModuleType('firebase_admin.firestore')
+    firestore.client = lambda: 'db'
+    firebase_admin.storage = storage
+    firebase_admin.firestore = firestore
+
+    openai = types.ModuleType('openai')
+    openai.api_key = None
+
+    for name, module in {'dotenv': dotenv, 'firebase_admin': firebase_admin, 'firebase_admin.storage': storage,
+                         'firebase_admin.firestore': firestore, 'openai': openai}.items():
+        monkeypatch.setitem(sys.modules, name, module)
+    monkeypatch.setattr('importlib.metadata.version', lambda name: '0.28.1')
+    monkeypatch.setenv('OPENAI_API_KEY', 'test-key')
+    yield calls
+    importlib.reload(clients)  # Drop the stand-ins cached by this test
+
+
+@pytest.fixture
+def fresh_clients(sdks):
+    return importlib.reload(clients)
+
+
+def test_getters_initialize_on_a_fresh_module(fresh_clients, sdks):
+    assert call_with_timeout(fresh_clients.get_bucket) == 'bucket'
+    assert call_with_timeout(fresh_clients.get_db) == 'db'
+    openai = call_with_timeout(fresh_clients.get_openai)
+    assert openai.api_key == 'test-key'
+    # Shared dependencies are initialized once
+    assert sdks == ['load_dotenv', 'initialize_app']
+
+
+@pytest.mark.parametrize('getter', ['get_bucket', 'get_db', 'get_openai'])
+def test_each_getter_alone_on_a_fresh_module(fresh_clients, getter):
+    assert call_with_timeout(getattr(fresh_clients, getter)) is not None
+
+
+def test_clients_are_cached(fresh_clients):
+    first = call_with_timeout(fresh_clients.get_db)
+    assert call_with_timeout(fresh_clients.get_db) is first
+    assert set(fresh_clients.INIT_TIMINGS) == {'dotenv', 'firebase_app', 'firestore'}
+
+
+def test_concurrent_first_use(fresh_clients, sdks):
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(fresh_clients.get_db())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(CALL_TIMEOUT)
+    assert results == ['db'] * 8
+    assert sdks.count('initialize_app') == 1
+
+
+def test_set_client_overrides_factory(fresh_clients):
+    fresh_clients.set_client('firestore', 'fake-db')
+    assert call_with_timeout(fresh_clients.get_db) == 'fake-db'
+
+
+def test_incompatible_openai_version(fresh_clients, monkeypatch):
+    monkeypatch.setattr('importlib.metadata.version', lambda name: '1.3.0')
+    with pytest.raises(ImportError, match='not compatible'):
+        call_with_timeout(fresh_clients.get_openai)
+    assert 'openai' not in fresh_clients._clients
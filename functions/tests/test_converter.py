@@ -0,0 +1,36 @@
+import shutil
+import subprocess
+
+import pytest
+
+pytest.importorskip('ffmpeg')
+
+from services.converter import segment_starts, transcode_segments, transcode_segments_parallel  # noqa: E402
+
+
+@pytest.mark.parametrize('duration, starts', [
+    (0.4, [0]),
+    (0, [0]),
+    (30, [0]),
+    (30.4, [0, 30]),
+    (60, [0, 30]),
+    (61, [0, 30, 60]),
+])
+def test_segment_starts(duration, starts):
+    assert segment_starts(duration, 30) == starts
+
+
+@pytest.fixture
+def short_clip(tmp_path):
+    if shutil.which('ffmpeg') is None:
+        pytest.skip('ffmpeg is not installed')
+    path = tmp_path / 'clip.mp4'
+    subprocess.run(['ffmpeg', '-hide_banner', '-loglevel', 'error', '-f', 'lavfi', '-i', 'sine=duration=0.5',
+                    '-c:a', 'aac', str(path)], check=True)
+    return str(path)
+
+
+@pytest.mark.parametrize('transcode', [transcode_segments, transcode_segments_parallel])
+def test_sub_second_source(short_clip, tmp_path, transcode):
+    segments = transcode(short_clip, str(tmp_path), 0.5, segment_duration=30)
+    assert [path.rsplit('/', 1)[-1] for path in segments] == ['segment_0.mp3']
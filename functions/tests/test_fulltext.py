@@ -0,0 +1,99 @@
+import json
+import os
+
+import pytest
+
+from devtools.fake_gcp import FakeBucket
+from services import fulltext
+from services.fulltext import FulltextIndex, download_index, upload_index
+
+PREFIX = 'search_index'
+
+
+@pytest.fixture
+def bucket(tmp_path):
+    return FakeBucket(str(tmp_path / 'bucket'))
+
+
+def doc(video_id, *texts):
+    return video_id, [(index * 1000, text) for index, text in enumerate(texts)]
+
+
+def video_ids(index, query):
+    return [hit['videoId'] for hit in index.search(query)]
+
+
+def test_search_ranks_and_replaces_videos(tmp_path):
+    index = FulltextIndex.create(str(tmp_path / 'index'), shards=2)
+    index.add([doc('a', 'camera settings', 'shutter shutter shutter'), doc('b', 'shutter speed basics')])
+    assert video_ids(index, 'shutter') == ['a', 'b']
+    assert index.search('speed')[0]['startMs'] == 0
+    assert index.search('nothing') == []
+
+    index.add([doc('a', 'all about lenses')])
+    assert video_ids(index, 'shutter') == ['b']
+    assert video_ids(index, 'lenses') == ['a']
+    assert index.doc_count == 2
+
+
+def test_compaction_keeps_results(tmp_path):
+    index = FulltextIndex.create(str(tmp_path / 'index'), shards=1)
+    for round_ in range(3):
+        index.add([doc('a', f'take {round_}'), doc(f'v{round_}', 'shared words')])
+    assert index.compact(max_segments=1) == 1
+    assert len(index.manifest['segments']['0']) == 1
+    assert video_ids(index, 'take') == ['a'] and index.search('take')[0]['startMs'] == 0
+    assert sorted(video_ids(index, 'shared')) == ['v0', 'v1', 'v2']
+    assert len(os.listdir(tmp_path / 'index' / 'shard-00')) == 1
+
+
+def test_rebuild_publishes_new_segments(tmp_path, bucket):
+    build_root = str(tmp_path / 'build')
+    served_root = str(tmp_path / 'served')
+
+    index = FulltextIndex.create(build_root, shards=1)
+    index.add([doc('old', 'banana bread')])
+    upload_index(index, bucket, PREFIX)
+    download_index(bucket, PREFIX, served_root)
+    assert video_ids(FulltextIndex(served_root), 'banana') == ['old']
+
+    # index_transcripts.py --rebuild: a new index in the same directory
+    rebuilt = FulltextIndex.create(build_root, shards=1)
+    rebuilt.add([doc('new', 'apple pie')])
+    assert video_ids(rebuilt, 'apple') == ['new']
+    upload_index(rebuilt, bucket, PREFIX)
+
+    download_index(bucket, PREFIX, served_root)
+    served = FulltextIndex(served_root)
+    assert video_ids(served, 'apple') == ['new']
+    assert video_ids(served, 'banana') == []
+
+
+def test_upload_keeps_the_previous_generation(tmp_path, bucket):
+    index = FulltextIndex.create(str(tmp_path / 'build'), shards=1)
+    index.add([doc('a', 'first')])
+    upload_index(index, bucket, PREFIX)
+    first = {blob.name for blob in bucket.list_blobs(prefix=f'{PREFIX}/shard-')}
+
+    index.add([doc('b', 'second')])
+    index.compact(max_segments=1)
+    upload_index(index, bucket, PREFIX)
+    # Instances still on the first manifest can finish downloading it
+    assert first <= {blob.name for blob in bucket.list_blobs(prefix=f'{PREFIX}/shard-')}
+
+    index.add([doc('c', 'third')])
+    upload_index(index, bucket, PREFIX)
+    assert not first & {blob.name for blob in bucket.list_blobs(prefix=f'{PREFIX}/shard-')}
+
+
+def test_legacy_segment_names(tmp_path):
+    root = tmp_path / 'index'
+    index = FulltextIndex.create(str(root), shards=1)
+    manifest = dict(index.manifest)
+    del manifest['build']
+    (root / fulltext.MANIFEST_NAME).write_text(json.dumps(manifest))
+
+    legacy = FulltextIndex(str(root))
+    legacy.add([doc('a', 'words')])
+    assert legacy.manifest['segments']['0'] == ['seg-000001.bin']
+    assert video_ids(FulltextIndex(str(root)), 'words') == ['a']
@@ -0,0 +1,135 @@
+import threading
+from datetime import timedelta
+
+import pytest
+
+pytest.importorskip('firebase_admin')
+
+from devtools.fake_gcp import FakeFirestore  # noqa: E402
+from services import leases  # noqa: E402
+from services.leases import LeaseHolderFailed, run_exclusive  # noqa: E402
+
+
+class Busy(Exception):
+    pass
+
+
+@pytest.fixture
+def db(monkeypatch):
+    monkeypatch.setattr(leases, 'POLL_SECONDS', 0.01)
+    monkeypatch.setattr(leases, 'LEASE_STATS', {'acquired': 0, 'takeovers': 0, 'suppressed': 0})
+    return FakeFirestore()
+
+
+def lease(db):
+    snapshot = leases.lease_ref(db, 'convert', 'v1').get()
+    return snapshot.to_dict() if snapshot.exists else None
+
+
+def hold_lease(db, work, **kwargs):
+    """Run work under the lease on another thread, returning once it holds it: (thread, outcome dict)."""
+    started = threading.Event()
+    outcome = {}
+
+    def run():
+        def held():
+            started.set()
+            return work()
+        try:
+            outcome['result'] = run_exclusive(db, 'convert', 'v1', held, **kwargs)
+        except Exception as e:
+            outcome['error'] = e
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    assert started.wait(5)
+    return thread, outcome
+
+
+def test_uncontended_work_runs_and_releases(db):
+    assert run_exclusive(db, 'convert', 'v1', lambda: 'audio') == ('audio', None)
+    assert lease(db)['status'] == leases.DONE
+    assert lease(db)['error'] is None
+    assert leases.LEASE_STATS['acquired'] == 1
+
+
+def test_failure_releases_as_failed(db):
+    def work():
+        raise ValueError('bad source')
+
+    with pytest.raises(ValueError):
+        run_exclusive(db, 'convert', 'v1', work)
+    assert lease(db)['status'] == leases.FAILED
+    assert lease(db)['error'] == 'bad source'
+    # A later request is not blocked by the failed one
+    assert run_exclusive(db, 'convert', 'v1', lambda: 'audio')[0] == 'audio'
+
+
+def test_duplicate_waits_for_the_holder_then_runs(db):
+    finish = threading.Event()
+    holder, outcome = hold_lease(db, lambda: finish.wait(5) and 'first')
+
+    threading.Timer(0.1, finish.set).start()
+    result, waited = run_exclusive(db, 'convert', 'v1', lambda: 'second')
+    holder.join(5)
+    assert outcome['result'][0] == 'first'
+    assert result == 'second' and waited >= 0.05
+    assert lease(db)['duplicates'] == 1
+    assert leases.LEASE_STATS['suppressed'] == 1
+    assert db.collection('metrics').document('job_leases').get().to_dict() == {'suppressed': {'convert': 1}}
+
+
+def test_waiter_fails_with_the_holder(db):
+    finish = threading.Event()
+
+    def work():
+        finish.wait(5)
+        raise ValueError('bad source')
+
+    holder, _ = hold_lease(db, work)
+    threading.Timer(0.1, finish.set).start()
+    with pytest.raises(LeaseHolderFailed, match='bad source'):
+        run_exclusive(db, 'convert', 'v1', lambda: 'second')
+    holder.join(5)
+
+
+def test_waiter_takes_over_a_yielded_lease(db):
+    finish = threading.Event()
+
+    def work():
+        finish.wait(5)
+        raise Busy('no room on this instance')
+
+    holder, outcome = hold_lease(db, work, yield_on=(Busy,))
+    threading.Timer(0.1, finish.set).start()
+    assert run_exclusive(db, 'convert', 'v1', lambda: 'second')[0] == 'second'
+    holder.join(5)
+    # The yielding caller still sees its own exception
+    assert isinstance(outcome['error'], Busy)
+    assert lease(db)['status'] == leases.DONE
+
+
+def test_expired_lease_is_taken_over(db):
+    now = leases._now()
+    leases.lease_ref(db, 'convert', 'v1').set({
+        'owner': 'dead', 'status': leases.RUNNING, 'expiresAt': now - timedelta(seconds=1),
+    })
+    assert run_exclusive(db, 'convert', 'v1', lambda: 'audio') == ('audio', None)
+    assert leases.LEASE_STATS['takeovers'] == 1
+    assert lease(db)['owner'] != 'dead'
+
+
+def test_wait_times_out(db):
+    now = leases._now()
+    leases.lease_ref(db, 'convert', 'v1').set({
+        'owner': 'other', 'status': leases.RUNNING, 'expiresAt': now + timedelta(seconds=60),
+    })
+    with pytest.raises(TimeoutError):
+        run_exclusive(db, 'convert', 'v1', lambda: 'audio', wait_timeout=0.05)
+
+
+def test_release_ignores_a_lease_we_lost(db):
+    leases.try_acquire(db, 'convert', 'v1', 'first')
+    leases.lease_ref(db, 'convert', 'v1').update({'owner': 'second'})
+    leases.release(db, 'convert', 'v1', 'first', error=ValueError('late'))
+    assert lease(db)['status'] == leases.RUNNING
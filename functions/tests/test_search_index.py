@@ -0,0 +1,174 @@
+import pytest
+
+from services import search_index
+from services.search_index import SearchIndex, StaleIndexError, document_size
+from services.vtt import Segment
+
+SEGMENTS = [
+    Segment(5000, 8000, "Let's talk about shutter speed."),
+    Segment(0, 5000, 'Welcome back to the channel!'),
+    Segment(8000, 12000, 'A faster shutter freezes motion.'),
+    Segment(12000, 15000, "Aperture isn't the same thing."),
+]
+
+
+def texts(index, positions):
+    return [index.texts[position] for position in positions]
+
+
+def test_segments_are_indexed_in_timeline_order():
+    index = SearchIndex.from_segments(SEGMENTS)
+    assert list(index.starts) == [0, 5000, 8000, 12000]
+    assert list(index.ends) == [5000, 8000, 12000, 15000]
+    assert index.texts[0] == 'Welcome back to the channel!'
+
+
+def test_search_matches_every_token_as_a_prefix():
+    index = SearchIndex.from_segments(SEGMENTS)
+    assert texts(index, index.search('shutter')) == [SEGMENTS[0].text, SEGMENTS[2].text]
+    assert texts(index, index.search('SHUT free')) == [SEGMENTS[2].text]
+    assert texts(index, index.search("isn't")) == [SEGMENTS[3].text]
+    assert index.search('shutter aperture') == []
+    assert index.search('  ,. ') == []
+    assert index.search('shutter', limit=1) == [1]
+
+
+def test_search_falls_back_to_substrings():
+    index = SearchIndex.from_segments(SEGMENTS)
+    assert texts(index, index.search('hann')) == [SEGMENTS[1].text]
+    # Short fragments only match as prefixes
+    assert index.search('ut') == []
+
+
+def test_position_at():
+    index = SearchIndex.from_segments(SEGMENTS)
+    assert index.position_at(0) == 0
+    assert index.position_at(7999) == 1
+    assert index.position_at(8000) == 2
+    assert index.position_at(99000) == 3
+    assert SearchIndex.from_segments([]).position_at(0) is None
+
+
+def test_document_round_trip_leaves_texts_out():
+    index = SearchIndex.from_segments(SEGMENTS, page_seconds=300)
+    document = index.to_document()
+    assert document['version'] == search_index.INDEX_VERSION
+    assert 'texts' not in document and 'welcome' not in document['postings'].decode('latin-1')
+
+    loaded = SearchIndex.from_document(document)
+    assert loaded.terms == index.terms
+    assert list(loaded.postings) == list(index.postings)
+    assert list(loaded.starts) == list(index.starts)
+    assert loaded.page_seconds == 300
+    assert loaded.texts == {}
+    assert loaded.search('shutter') == index.search('shutter')
+
+
+def test_document_size_grows_with_the_transcript():
+    small = SearchIndex.from_segments(SEGMENTS).to_document()
+    large = SearchIndex.from_segments(
+        Segment(i * 1000, i * 1000 + 900, f'word{i} filler') for i in range(1000)
+    ).to_document()
+    assert document_size(small) < document_size(large)
+    assert document_size(large) > 1000 * 4 * 2  # starts and ends alone
+
+
+# Lookups against stored transcripts
+
+@pytest.fixture
+def db(monkeypatch):
+    pytest.importorskip('firebase_admin')
+    from devtools.fake_gcp import FakeFirestore
+
+    monkeypatch.setattr(search_index, '_cache', type(search_index._cache)())
+    return FakeFirestore()
+
+
+def store(db, video_id, segments):
+    from services.transcript_store import save_transcript
+
+    header = save_transcript(db, video_id, [s.to_dict() for s in segments], {})
+    search_index.save_index(db, video_id, segments, header)
+    return header
+
+
+def long_transcript(count=2000, text='cue {i}'):
+    # A cue every second: seven pages of PAGE_SECONDS
+    return [Segment(i * 1000, i * 1000 + 900, text.format(i=i)) for i in range(count)]
+
+
+def test_lookup_reads_only_the_pages_it_needs(db, monkeypatch):
+    store(db, 'v1', long_transcript())
+    read = []
+    load_pages = search_index.load_pages
+    monkeypatch.setattr(search_index, 'load_pages',
+                        lambda db, video_id, indexes: read.append(sorted(indexes)) or load_pages(db, video_id, indexes))
+
+    result = search_index.lookup(db, 'v1', query='1500', at_ms=601500)
+    assert [match['text'] for match in result['matches']] == ['cue 1500']
+    assert result['matches'][0]['startMs'] == 1500000
+    assert result['segment']['text'] == 'cue 601'
+    assert read == [[2, 5]]
+
+
+def test_lookup_without_a_transcript(db):
+    assert search_index.lookup(db, 'missing', query='anything') is None
+
+
+def test_lookup_indexes_old_transcripts_on_first_use(db):
+    from services.transcript_store import save_transcript
+
+    save_transcript(db, 'v1', [s.to_dict() for s in SEGMENTS], {})
+    assert [m['text'] for m in search_index.lookup(db, 'v1', query='aperture')['matches']] == [SEGMENTS[3].text]
+    assert db.collection(search_index.INDEX_COLLECTION).document('v1').get().exists
+
+
+def test_legacy_unpaged_transcripts(db):
+    db.collection('transcripts').document('v1').set({
+        'content': ' '.join(s.text for s in SEGMENTS),
+        'segments': [{'start': s.to_dict()['start'], 'end': s.to_dict()['end'], 'text': s.text} for s in SEGMENTS],
+    })
+    result = search_index.lookup(db, 'v1', query='motion', at_ms=0)
+    assert [m['text'] for m in result['matches']] == [SEGMENTS[2].text]
+    assert result['segment']['text'] == SEGMENTS[1].text
+
+
+def test_stale_index_is_rebuilt(db):
+    store(db, 'v1', SEGMENTS)
+    assert search_index.lookup(db, 'v1', query='shutter')['matches']
+
+    # The transcript is replaced without its index being updated
+    from services.transcript_store import load_header, save_transcript
+
+    replaced = [Segment(1000, 4000, 'Completely different shutter talk.')]
+    save_transcript(db, 'v1', [s.to_dict() for s in replaced], {}, previous=load_header(db, 'v1'))
+    search_index._cache.clear()  # Another instance, which has not seen the old texts
+    index = search_index.load_index(db, 'v1')
+    with pytest.raises(StaleIndexError):
+        search_index.load_texts(db, 'v1', index, index.search('shutter'))
+
+    result = search_index.lookup(db, 'v1', query='shutter')
+    assert [m['text'] for m in result['matches']] == ['Completely different shutter talk.']
+
+
+def test_oversized_index_is_not_stored(db, monkeypatch):
+    store(db, 'v1', SEGMENTS)
+    monkeypatch.setattr(search_index, 'MAX_DOCUMENT_BYTES', 100)
+    store(db, 'v1', long_transcript(300))
+
+    assert not db.collection(search_index.INDEX_COLLECTION).document('v1').get().exists
+    search_index._cache.clear()
+    assert [m['text'] for m in search_index.lookup(db, 'v1', query='250')['matches']] == ['cue 250']
+
+
+def test_index_transcript_never_raises(db, monkeypatch, capsys):
+    store(db, 'v1', SEGMENTS)
+
+    def fail(*args, **kwargs):
+        raise RuntimeError('write failed')
+
+    monkeypatch.setattr(search_index, 'save_index', fail)
+    search_index.index_transcript(db, 'v1', SEGMENTS, {})
+    assert 'Could not index transcript of video v1' in capsys.readouterr().out
+    # The old index is gone, so the next lookup rebuilds from the transcript
+    assert not db.collection(search_index.INDEX_COLLECTION).document('v1').get().exists
@@ -0,0 +1,80 @@
+import pytest
+
+from services.silence import MAX_TRIM_CUTS, TRIM_PADDING_SECONDS, TimeMap
+
+
+def test_plan_keeps_speech_and_padding_around_cuts():
+    time_map = TimeMap.plan([(10.0, 15.0), (30.0, 40.0)], duration=60.0)
+    padding = round(TRIM_PADDING_SECONDS * 1000)
+    assert time_map.intervals == [(0, 10000 + padding), (15000 - padding, 30000 + padding), (40000 - padding, 60000)]
+    assert time_map.trimmed_ms == 60000 - (5000 - 2 * padding) - (10000 - 2 * padding)
+
+
+def test_plan_skips_trimming_that_saves_too_little():
+    assert TimeMap.plan([(10.0, 11.0)], duration=60.0) is None
+    assert TimeMap.plan([], duration=60.0) is None
+
+
+def test_plan_handles_leading_and_trailing_silence():
+    time_map = TimeMap.plan([(0.0, 5.0), (55.0, 60.0)], duration=60.0)
+    # Padding applies at the ends too, so a sliver of each edge silence is kept
+    assert time_map.intervals == [(0, 250), (4750, 55250), (59750, 60000)]
+
+
+def test_plan_keeps_only_the_longest_cuts():
+    silences = [(index * 10.0, index * 10.0 + (2.0 if index % 2 else 5.0)) for index in range(2 * MAX_TRIM_CUTS)]
+    time_map = TimeMap.plan(silences, duration=2 * MAX_TRIM_CUTS * 10.0)
+    assert len(time_map.intervals) == MAX_TRIM_CUTS + 1
+    # Every cut that was kept is one of the long pauses
+    cut_lengths = {next_start - end for (_, end), (next_start, _) in zip(time_map.intervals, time_map.intervals[1:])}
+    assert cut_lengths == {5000 - 2 * round(TRIM_PADDING_SECONDS * 1000)}
+
+
+def test_to_source_ms():
+    time_map = TimeMap([(0, 10000), (15000, 30000), (40000, 60000)])
+    assert time_map.offsets == [0, 10000, 25000]
+    assert time_map.to_source_ms(0) == 0
+    assert time_map.to_source_ms(5000) == 5000
+    assert time_map.to_source_ms(12000) == 17000
+    assert time_map.to_source_ms(26000) == 41000
+    # Past the end of the trimmed audio stays inside the last interval
+    assert time_map.to_source_ms(99000) == 60000
+
+
+def test_timestamps_on_a_cut():
+    time_map = TimeMap([(0, 10000), (15000, 30000)])
+    # A cue starting on the cut belongs after it, one ending on it before it
+    assert time_map.to_source_ms(10000) == 15000
+    assert time_map.to_source_ms(10000, end=True) == 10000
+
+
+def test_restore_segments():
+    time_map = TimeMap([(0, 10000), (15000, 30000)])
+    restored = time_map.restore_segments([
+        {'start': '00:00:08.000', 'end': '00:00:12.000', 'startMs': 8000, 'endMs': 12000, 'text': 'across'},
+        {'start': '00:00:10.000', 'end': '00:00:10.000', 'startMs': 10000, 'endMs': 10000, 'text': 'empty'},
+    ])
+    assert [(s['startMs'], s['endMs'], s['text']) for s in restored] == [(8000, 17000, 'across'),
+                                                                         (15000, 15000, 'empty')]
+    assert restored[0]['start'] == '00:00:08.000' and restored[0]['end'] == '00:00:17.000'
+
+
+def test_encode_decode_round_trip():
+    time_map = TimeMap([(0, 10000), (15000, 30000)])
+    decoded = TimeMap.decode(time_map.encode())
+    assert decoded.intervals == time_map.intervals
+    assert decoded.offsets == time_map.offsets
+    assert TimeMap.decode(None) is None
+    assert TimeMap.decode('') is None
+
+
+def test_select_filter():
+    assert TimeMap([(0, 1500), (2000, 3000)]).select_filter() == (
+        "aselect='between(t,0.000,1.500)+between(t,2.000,3.000)',asetpts=N/SR/TB"
+    )
+
+
+@pytest.mark.parametrize('trimmed_ms', range(0, 25001, 500))
+def test_mapping_is_monotonic(trimmed_ms):
+    time_map = TimeMap([(0, 10000), (15000, 30000)])
+    assert time_map.to_source_ms(trimmed_ms) <= time_map.to_source_ms(trimmed_ms + 500)
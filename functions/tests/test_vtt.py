@@ -0,0 +1,120 @@
+import io
+
+import pytest
+
+from services.vtt import Segment, format_timestamp, format_vtt, iter_segments, parse_segments, parse_timestamp
+
+WHISPER_VTT = """WEBVTT
+
+00:00:00.000 --> 00:00:04.500
+Hello and welcome.
+
+00:00:04.500 --> 00:00:09.250
+Today we look at cameras.
+"""
+
+
+def test_parses_whisper_output():
+    assert parse_segments(WHISPER_VTT) == [
+        Segment(0, 4500, 'Hello and welcome.'),
+        Segment(4500, 9250, 'Today we look at cameras.'),
+    ]
+
+
+def test_header_metadata_notes_styles_and_regions_are_skipped():
+    vtt = """WEBVTT - Some title
+Kind: captions
+Language: en
+
+NOTE
+This is a comment
+spanning two lines
+
+STYLE
+::cue { color: red }
+
+REGION
+id:fred width:40%
+
+00:01.000 --> 00:02.000
+Only cue
+"""
+    assert parse_segments(vtt) == [Segment(1000, 2000, 'Only cue')]
+
+
+def test_identifiers_settings_and_multiline_text():
+    vtt = """WEBVTT
+
+intro
+00:00:01.000 --> 00:00:03.000 align:start position:10%
+First line
+second line
+
+2
+00:00:03.000 --> 00:00:05.000
+Next
+"""
+    segments = parse_segments(vtt)
+    assert segments == [Segment(1000, 3000, 'First line second line'), Segment(3000, 5000, 'Next')]
+    assert [segment.identifier for segment in segments] == ['intro', '2']
+
+
+def test_cues_without_blank_lines_or_header_and_crlf():
+    vtt = "00:00.000 --> 00:01.000\r\nOne\r\n00:01.000 --> 00:02.000\r\nTwo"
+    assert parse_segments(vtt) == [Segment(0, 1000, 'One'), Segment(1000, 2000, 'Two')]
+
+
+def test_comma_millisecond_separator_and_long_hours():
+    assert parse_segments('WEBVTT\n\n100:00:00,250 --> 100:00:01,000\nLate\n') == [
+        Segment(360000250, 360001000, 'Late')
+    ]
+
+
+def test_arrow_in_text_is_not_a_timing_line():
+    assert parse_segments('WEBVTT\n\n00:00.000 --> 00:01.000\nleft --> right\n') == [
+        Segment(0, 1000, 'left --> right')
+    ]
+
+
+def test_empty_cue_text_and_empty_document():
+    assert parse_segments('WEBVTT\n\n00:00.000 --> 00:01.000\n\n') == [Segment(0, 1000, '')]
+    assert parse_segments('') == []
+    assert parse_segments('WEBVTT\n') == []
+
+
+def test_streams_from_a_file_object():
+    assert list(iter_segments(io.StringIO(WHISPER_VTT))) == parse_segments(WHISPER_VTT)
+
+
+@pytest.mark.parametrize('text, ms', [
+    ('00:00:00.000', 0),
+    ('00:01.500', 1500),
+    ('01:02:03.004', 3723004),
+    ('00:00:05,250', 5250),
+])
+def test_parse_timestamp(text, ms):
+    assert parse_timestamp(text) == ms
+
+
+def test_format_timestamp_round_trips():
+    for ms in (0, 999, 61001, 3723004, 360000250):
+        assert parse_timestamp(format_timestamp(ms)) == ms
+
+
+def test_format_vtt_round_trips():
+    segments = parse_segments(WHISPER_VTT)
+    assert parse_segments(format_vtt(segments)) == segments
+
+
+def test_segment_dicts():
+    segment = Segment(1500, 2750, 'Hi')
+    assert segment.to_dict() == {'start': '00:00:01.500', 'end': '00:00:02.750', 'startMs': 1500, 'endMs': 2750,
+                                 'text': 'Hi'}
+    assert Segment.from_dict(segment.to_dict()) == segment
+    # Transcripts stored before the millisecond fields existed
+    assert Segment.from_dict({'start': '00:00:01.500', 'end': '00:00:02.750', 'text': 'Hi'}) == segment
+
+
+def test_segments_are_hashable():
+    assert len({Segment(0, 1000, 'a'), Segment(0, 1000, 'a', identifier='1'), Segment(0, 1000, 'b')}) == 2
+    assert {Segment(0, 1000, 'a'): 'first'}[Segment(0, 1000, 'a')] == 'first'
@@ -1870,11 +1870,24 @@ class VideoEditorState extends State<VideoEditor> {
       
       // Log the document structure
       print('\nTranscript document structure:');
-      print('- Has content? ${data.containsKey('content')}');
-      print('- Has segments? ${data.containsKey('segments')}');
+      print('- Format: ${data['format'] ?? 'inline'}');
+      print('- Page count: ${data['pageCount']}');
       print('- Audio file size: ${data['audioFileSize']}');
-      
-      final segments = data['segments'] as List<dynamic>?;
+
+      // Paged transcripts keep their segments in time-window page documents
+      List<dynamic>? segments;
+      if (data['format'] == 'paged') {
+        final pages = await doc.reference
+            .collection('pages')
+            .orderBy('index')
+            .get();
+        segments = [
+          for (final page in pages.docs)
+            ...(page.data()['segments'] as List<dynamic>? ?? const []),
+        ];
+      } else {
+        segments = data['segments'] as List<dynamic>?;
+      }
       if (segments == null) {
         throw Exception('No segments array found in transcript');
       }